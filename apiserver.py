@@ -0,0 +1,591 @@
+"""HTTP/JSON API over the logbook, for the field tablets and the dispatch system.
+
+Connections are handled by an asyncio event loop, so idle and slow clients hold no database connection. The database work of a request
+runs on a bounded pool of worker threads, on a session of its own, and the engine keeps one pooled connection per worker.
+
+Responses of GET requests carry an ETag. Searches and flights are versioned by the row count and latest date_modified of the tables they
+read: the version is checked with one cheap query, a client sending back a current ETag gets 304 Not Modified and a repeated request is
+answered from a cache without running the search. Rollups read tables without date_modified, so their ETag is a hash of the response.
+Lists are paged with an opaque cursor, returned as next_cursor while there are more results.
+
+Requests writing to the logbook must carry the token of the [api] section of the config as an Authorization: Bearer header.
+Without a token configured, the server answers them 403. It listens on localhost unless given another host.
+
+Run with: python apiserver.py [--host=127.0.0.1] [--port=8080] [--workers=8]
+"""
+from __future__ import annotations
+import asyncio
+import base64
+import collections
+import dataclasses
+import datetime
+import hashlib
+import hmac
+import http
+import json
+import logging
+import optparse
+import re
+import sys
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm.session import Session
+
+import config
+import database
+from database import Airworthyness, Battery, CrewMemberToFlight, Drone, Equipment, EquipmentToFlight, Flight, FlightStatus, FlightType
+from errors import Error, InvalidArgumentError, RecordNotFoundError, WeatherSourceError
+import services
+import weatherprovider
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 8
+PAGE_LIMIT = 50
+"""Default number of records in a page."""
+MAX_PAGE_LIMIT = 500
+CACHE_SIZE = 256
+"""Number of responses kept by the response cache."""
+IDLE_TIMEOUT = 30.0
+"""Seconds a keep-alive connection may wait for its next request."""
+MAX_HEADER_SIZE = 16 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Request:
+    method: str
+    target: str
+    """Path and query string, the response cache key."""
+    path: str
+    query: dict[str, str]
+    headers: dict[str, str]
+    """Header values by lower case name."""
+    body: bytes = b""
+
+    def json(self) -> dict:
+        """Returns the JSON object in the body, an empty one if there is no body.
+
+        Raises:
+            InvalidArgumentError: If the body is not a JSON object.
+        """
+        if not self.body: return {}
+        try:
+            value = json.loads(self.body)
+        except ValueError as error:
+            raise InvalidArgumentError(f"The body is not valid JSON. {error}")
+        if not isinstance(value, dict):
+            raise InvalidArgumentError("The body must be a JSON object.")
+        return value
+
+    def param(self, name: str, parse: Callable[[str], Any]=str, default=None):
+        """Returns a query string parameter, or the default if it is missing or empty.
+
+        Raises:
+            InvalidArgumentError: If parse fails on the value.
+        """
+        value = self.query.get(name)
+        if not value: return default
+        try:
+            return parse(value)
+        except (TypeError, ValueError):
+            raise InvalidArgumentError(f"Invalid value for {name}: {value}")
+
+
+@dataclass
+class Response:
+    status: int
+    body: bytes = b""
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class Route:
+    method: str
+    pattern: re.Pattern
+    handler: Callable[..., Any]
+    """Called with the session, the request and the path parameters, returns the JSON value of the response."""
+    tables: list = None
+    """Models read by a GET route, to version its responses. None to use a hash of the response as its ETag."""
+
+
+class ResponseCache:
+    """Least recently used cache of response bodies by request target and version, shared by the worker threads."""
+    def __init__(self, size: int=CACHE_SIZE):
+        self.size = size
+        self._entries = collections.OrderedDict() # type: collections.OrderedDict[str, tuple[str, bytes]]
+        self._lock = threading.Lock()
+
+    def get(self, target: str, etag: str) -> bytes:
+        """Returns the cached body, or None if the target is not cached at this version."""
+        with self._lock:
+            entry = self._entries.get(target)
+            if entry is None or entry[0] != etag: return None
+            self._entries.move_to_end(target)
+            return entry[1]
+
+    def put(self, target: str, etag: str, body: bytes) -> None:
+        with self._lock:
+            self._entries[target] = (etag, body)
+            self._entries.move_to_end(target)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+def encode_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, default=_json_default).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    """
+    Raises:
+        InvalidArgumentError: If the cursor was not returned by the server.
+    """
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise InvalidArgumentError("Invalid cursor.")
+
+
+def parse_datetime(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value)
+
+
+def parse_bool(value: str) -> bool:
+    if value.lower() in ("1", "true", "yes"): return True
+    if value.lower() in ("0", "false", "no"): return False
+    raise ValueError(value)
+
+
+def parse_limit(request: Request) -> int:
+    return max(1, min(request.param("limit", int, PAGE_LIMIT), MAX_PAGE_LIMIT))
+
+
+def _plain(value):
+    """Converts a value to what json can write: dataclasses to objects with their properties, dictionary keys to strings."""
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        plain = {field_.name: _plain(getattr(value, field_.name)) for field_ in dataclasses.fields(value)}
+        for cls in reversed(type(value).__mro__):
+            plain.update({name: _plain(getattr(value, name)) for name, attribute in vars(cls).items() if isinstance(attribute, property)})
+        return plain
+    if isinstance(value, dict):
+        return {key.isoformat() if isinstance(key, datetime.date) else str(key): _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(value) -> bytes:
+    return json.dumps(_plain(value), default=_json_default, separators=(",", ":")).encode()
+
+
+def asset_json(asset) -> dict:
+    return {
+        "id": asset.id,
+        "name": asset.name,
+        "serial_number": asset.serial_number,
+        "status": asset.status,
+        "weight": asset.weight,
+        "date_modified": asset.date_modified,
+    }
+
+
+def flights_json(session: Session, flights: list[Flight]) -> list[dict]:
+    """Serializes a page of flights, loading the drone names, equipment and crew of the whole page in one query each."""
+    ids = [flight.id for flight in flights]
+    drone_names = dict(session.query(Drone.id, Drone.name).filter(Drone.id.in_({flight.drone_id for flight in flights})))
+    type_names = dict(session.query(FlightType.id, FlightType.name))
+    status_names = dict(session.query(FlightStatus.id, FlightStatus.name))
+    equipment = collections.defaultdict(list)
+    for flight_id, equipment_id in session.query(EquipmentToFlight.flight_id, EquipmentToFlight.equipment_id).filter(EquipmentToFlight.flight_id.in_(ids)):
+        equipment[flight_id].append(equipment_id)
+    crew = collections.defaultdict(list)
+    for flight_id, crew_member_id, role_id in session.query(CrewMemberToFlight.flight_id, CrewMemberToFlight.crew_member_id, CrewMemberToFlight.role_id)\
+            .filter(CrewMemberToFlight.flight_id.in_(ids)):
+        crew[flight_id].append({"crew_member_id": crew_member_id, "role_id": role_id})
+
+    return [{
+        "id": flight.id,
+        "uuid": flight.uuid,
+        "name": flight.name,
+        "date": flight.date,
+        "date_modified": flight.date_modified,
+        "active": flight.active,
+        "status_id": flight.status_id,
+        "status": status_names.get(flight.status_id),
+        "type_id": flight.type_id,
+        "type": type_names.get(flight.type_id),
+        "drone_id": flight.drone_id,
+        "drone_name": drone_names.get(flight.drone_id),
+        "battery_id": flight.battery_id,
+        "duration": flight.duration,
+        "distance_traveled": flight.distance_traveled,
+        "max_agl_altitude": flight.max_agl_altitude,
+        "night_flight": flight.night_flight,
+        "address": flight.address,
+        "location_latitude": flight.location_latitude,
+        "location_longitude": flight.location_longitude,
+        "notes": flight.notes,
+        "equipment_ids": sorted(equipment[flight.id]),
+        "crew": crew[flight.id],
+    } for flight in flights]
+
+
+def _asset_search(search: Callable[..., list]) -> Callable[[Session, Request], dict]:
+    def handler(session: Session, request: Request) -> dict:
+        limit = parse_limit(request)
+        status = request.param("status", Airworthyness)
+        cursor = request.param("cursor", decode_cursor)
+        assets = search(session, request.param("q"), status, limit + 1,
+                        after=tuple(cursor) if cursor else None)
+        more = len(assets) > limit
+        assets = assets[:limit]
+        return {
+            "items": [asset_json(asset) for asset in assets],
+            "next_cursor": encode_cursor(assets[-1].name, assets[-1].id) if more else None,
+        }
+    return handler
+
+
+def search_flights(session: Session, request: Request) -> dict:
+    limit = parse_limit(request)
+    cursor = request.param("cursor", decode_cursor)
+    flights = services.search_flights(
+        session,
+        drone_id=request.param("drone_id", int),
+        type_id=request.param("type_id", int),
+        status_id=request.param("status_id", int),
+        date_from=request.param("from", parse_datetime),
+        date_to=request.param("to", parse_datetime),
+        text=request.param("q"),
+        active=request.param("active", parse_bool, True) if request.query.get("active") != "all" else None,
+        limit=limit + 1,
+        after=(parse_datetime(cursor[0]), cursor[1]) if cursor else None,
+    )
+    more = len(flights) > limit
+    flights = flights[:limit]
+    return {
+        "items": flights_json(session, flights),
+        "next_cursor": encode_cursor(flights[-1].date, flights[-1].id) if more else None,
+    }
+
+
+def get_flight(session: Session, request: Request, flight_id: str) -> dict:
+    return flights_json(session, [services.get(session, Flight, int(flight_id))])[0]
+
+
+def _int(body: dict, name: str, required: bool=True) -> int:
+    value = body.get(name)
+    if value is None and not required: return None
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise InvalidArgumentError(f"{name} must be an integer.")
+    return value
+
+
+def create_flight(session: Session, request: Request) -> dict:
+    body = request.json()
+    crew = body.get("crew") or []
+    try:
+        crew = [(int(member["crew_member_id"]), int(member["role_id"])) for member in crew]
+    except (KeyError, TypeError, ValueError):
+        raise InvalidArgumentError("crew must be a list of objects with a crew_member_id and a role_id.")
+    flight = services.create_flight(session, _int(body, "drone_id"), _int(body, "type_id"), crew, _int(body, "battery_id", required=False))
+    return flights_json(session, [flight])[0]
+
+
+def update_flight(session: Session, request: Request, flight_id: str) -> dict:
+    """Sets the attributes in the body, services.FLIGHT_ATTRIBUTES and battery_id, and attaches and detaches the equipment listed in
+    add_equipment_ids and remove_equipment_ids."""
+    flight_id = int(flight_id)
+    body = request.json()
+    add_equipment_ids = body.pop("add_equipment_ids", None) or []
+    remove_equipment_ids = body.pop("remove_equipment_ids", None) or []
+    battery_id = _int(body, "battery_id", required=False)
+    body.pop("battery_id", None)
+
+    flight = services.get(session, Flight, flight_id)
+    if body:
+        flight = services.update_flight(session, flight_id, **body)
+    if battery_id is not None:
+        flight = services.set_flight_battery(session, flight_id, battery_id)
+    if add_equipment_ids:
+        flight = services.add_equipment(session, flight_id, add_equipment_ids)
+    if remove_equipment_ids:
+        flight = services.remove_equipment(session, flight_id, remove_equipment_ids)
+    return flights_json(session, [flight])[0]
+
+
+def start_flight(session: Session, request: Request, flight_id: str) -> dict:
+    return flights_json(session, [services.start_flight(session, int(flight_id))])[0]
+
+
+def end_flight(session: Session, request: Request, flight_id: str) -> dict:
+    duration = request.json().get("duration")
+    if not isinstance(duration, (int, float)) or isinstance(duration, bool):
+        raise InvalidArgumentError("duration must be a number of minutes.")
+    return flights_json(session, [services.end_flight(session, int(flight_id), duration)])[0]
+
+
+def flight_totals(session: Session, request: Request) -> list:
+    return services.flight_totals(session, request.param("from", parse_datetime), request.param("to", parse_datetime))
+
+
+def fleet_report(session: Session, request: Request) -> list:
+    end = request.param("end", lambda value: datetime.date.fromisoformat(value))
+    return services.fleet_report(session, end, max(1, min(request.param("months", int, 12), 120)))
+
+
+def crew_stats(session: Session, request: Request) -> dict:
+    return services.crew_stats(session)
+
+
+def maintenance_due(session: Session, request: Request) -> list:
+    return services.maintenance_due(session)
+
+
+def weight_audit(session: Session, request: Request) -> list:
+    return services.weight_audit(session, request.param("overweight_only", parse_bool, True))
+
+
+def _route(method: str, path: str, handler: Callable[..., Any], tables: list=None) -> Route:
+    pattern = re.compile("^" + re.sub(r"\{(\w+)\}", r"(?P<\1>\\d+)", path) + "$")
+    return Route(method, pattern, handler, tables)
+
+
+ROUTES = [
+    _route("GET", "/drones", _asset_search(services.search_drones), [Drone]),
+    _route("GET", "/batteries", _asset_search(services.search_batteries), [Battery]),
+    _route("GET", "/equipment", _asset_search(services.search_equipment), [Equipment]),
+    _route("GET", "/flights", search_flights, [Flight, Drone]),
+    _route("POST", "/flights", create_flight),
+    _route("GET", "/flights/{flight_id}", get_flight, [Flight, Drone]),
+    _route("PATCH", "/flights/{flight_id}", update_flight),
+    _route("POST", "/flights/{flight_id}/start", start_flight),
+    _route("POST", "/flights/{flight_id}/end", end_flight),
+    _route("GET", "/rollups/flight-totals", flight_totals, [Flight, Drone]),
+    _route("GET", "/rollups/fleet", fleet_report),
+    _route("GET", "/rollups/crew", crew_stats),
+    _route("GET", "/rollups/maintenance", maintenance_due),
+    _route("GET", "/rollups/weight-audit", weight_audit),
+]
+
+
+def json_response(status: int, value, headers: dict[str, str]=None) -> Response:
+    return Response(status, dumps(value), headers or {})
+
+
+def error_response(status: int, message: str) -> Response:
+    return json_response(status, {"error": message})
+
+
+class ApiServer:
+    def __init__(self, database_config: config.DatabaseConfig=None, workers: int=DEFAULT_WORKERS, routes: list[Route]=None, token: str=None):
+        """
+        Args:
+            database_config (config.DatabaseConfig, Optional): The database to serve. Defaults to the program's database.
+            workers (int, Optional): Requests running database work at the same time, and connections kept open. Defaults to DEFAULT_WORKERS.
+            token (str, Optional): The token writes must carry. Defaults to the token of the config, writes are refused if there is none.
+        """
+        database_config = dataclasses.replace(database_config or database.DATABASE_CONFIG, pool_size=workers)
+        self.engine = create_engine(database_config.database_url, **config.engine_options(database_config))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api")
+        self.cache = ResponseCache()
+        self.routes = ROUTES if routes is None else routes
+        self.token = config.load_api_config().token if token is None else token
+
+    def _match(self, request: Request) -> tuple[Route, Any]:
+        """Returns the route of a request and its path parameters, or None and whether the path has a route for another method."""
+        allowed = False
+        for route in self.routes:
+            match = route.pattern.match(request.path)
+            if match is None: continue
+            if route.method == request.method:
+                return route, match.groupdict()
+            allowed = True
+        return None, allowed
+
+    def _authorize(self, request: Request) -> Response:
+        """Returns the error response of a write without the token, None if the request may write."""
+        if not self.token:
+            return error_response(403, "Writes are disabled: the server has no API token configured.")
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), self.token.encode()):
+            response = error_response(401, "A valid API token is required.")
+            response.headers["WWW-Authenticate"] = "Bearer"
+            return response
+        return None
+
+    def _version(self, session: Session, request: Request, tables: list) -> str:
+        """Returns the ETag of a request on versioned tables: the row count and latest date_modified of each table, in one query."""
+        columns = []
+        for model in tables:
+            columns += [select(func.count(model.id)).scalar_subquery(), select(func.max(model.date_modified)).scalar_subquery()]
+        version = session.query(*columns).one()
+        return '"' + hashlib.sha1(f"{request.target}|{tuple(version)}".encode()).hexdigest() + '"'
+
+    def handle(self, request: Request) -> Response:
+        """Runs a request on a new session. Called on a worker thread."""
+        route, path_params = self._match(request)
+        if route is None:
+            return error_response(405 if path_params else 404, f"No route for {request.method} {request.path}.")
+        if route.method != "GET":
+            refused = self._authorize(request)
+            if refused is not None: return refused
+
+        session = database.Session(bind=self.engine)
+        try:
+            if route.method != "GET":
+                return json_response(201 if request.path == "/flights" else 200, route.handler(session, request, **path_params))
+
+            etag = None
+            if route.tables is not None:
+                etag = self._version(session, request, route.tables)
+                if etag in request.headers.get("if-none-match", ""):
+                    return Response(304, headers={"ETag": etag})
+                body = self.cache.get(request.target, etag)
+                if body is not None:
+                    return Response(200, body, {"ETag": etag})
+            body = dumps(route.handler(session, request, **path_params))
+            if etag is None:
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if etag in request.headers.get("if-none-match", ""):
+                    return Response(304, headers={"ETag": etag})
+            else:
+                self.cache.put(request.target, etag, body)
+            return Response(200, body, {"ETag": etag})
+        except RecordNotFoundError as error:
+            return error_response(404, str(error))
+        except InvalidArgumentError as error:
+            return error_response(400, str(error))
+        except Error as error:
+            # The logbook refused the operation, like starting a flight that is not ready.
+            return error_response(409, str(error))
+        except Exception:
+            logger.exception("%s %s failed.", request.method, request.target)
+            return error_response(500, "Internal server error.")
+        finally:
+            session.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Request:
+        """Reads the next request of a connection, or returns None if the client closed it.
+
+        Raises:
+            InvalidArgumentError: If the request is malformed.
+        """
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as error:
+            if error.partial.strip(): raise InvalidArgumentError("Incomplete request.")
+            return None
+        except asyncio.LimitOverrunError:
+            raise InvalidArgumentError("Request head too large.")
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise InvalidArgumentError("Invalid request line.")
+        headers = {}
+        for line in lines[1:]:
+            if not line: continue
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise InvalidArgumentError("Invalid Content-Length.")
+        if length > MAX_BODY_SIZE:
+            raise InvalidArgumentError("Request body too large.")
+        body = await reader.readexactly(length) if length else b""
+
+        url = urllib.parse.urlsplit(target)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        return Request(method.upper(), target, url.path.rstrip("/") or "/", query, headers, body)
+
+    async def _write_response(self, writer: asyncio.StreamWriter, response: Response, keep_alive: bool) -> None:
+        headers = {
+            "Content-Type": "application/json",
+            "Content-Length": str(len(response.body)),
+            "Connection": "keep-alive" if keep_alive else "close",
+            **response.headers,
+        }
+        if response.status == 304:
+            del headers["Content-Type"], headers["Content-Length"]
+        head = f"HTTP/1.1 {response.status} {http.HTTPStatus(response.status).phrase}\r\n"
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers.items()) + "\r\n"
+        writer.write(head.encode("latin-1") + response.body)
+        await writer.drain()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serves the requests of a keep-alive connection one after the other until the client closes it or stays idle."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), IDLE_TIMEOUT)
+                except InvalidArgumentError as error:
+                    await self._write_response(writer, error_response(400, str(error)), keep_alive=False)
+                    return
+                if request is None: return
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                response = await loop.run_in_executor(self.executor, self.handle, request)
+                await self._write_response(writer, response, keep_alive)
+                if not keep_alive: return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str=DEFAULT_HOST, port: int=DEFAULT_PORT) -> None:
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_SIZE)
+        logger.info("Serving the logbook on http://%s:%d", host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        self.engine.dispose()
+
+
+def main() -> int:
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--host", dest="host", default=DEFAULT_HOST, help="Address to listen on")
+    parser.add_option("--port", dest="port", type="int", default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_option("--workers", dest="workers", type="int", default=DEFAULT_WORKERS,
+                      help="Requests using the database at the same time, and connections kept open")
+    opts, _ = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        weatherprovider.start_filling()
+    except WeatherSourceError as error:
+        logger.error("Flight weather is not filled: %s", error)
+    server = ApiServer(workers=opts.workers)
+    if not server.token:
+        logger.warning("No API token is configured, writes are refused. Set token in the [api] section of the config or DRONELOGBOOK_API_TOKEN.")
+    try:
+        asyncio.run(server.serve(opts.host, opts.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
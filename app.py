@@ -1,14 +1,34 @@
 from __future__ import annotations
 import traceback
 import os
-from typing import Any
-from win32com.client import Dispatch
+import time
+import datetime
+import functools
+from dataclasses import dataclass, field
+from typing import Any, Callable
+from sqlalchemy import func, or_, select
+from sqlalchemy.exc import SQLAlchemyError
 from PyQt5 import QtCore, QtGui, QtWidgets
 
 from mainwindow import Ui_MainWindow
 import database
 import utilities
 import label_template_data
+import flightexport
+import telemetry
+import maintenance
+import batteryanalytics
+import chargelog
+import reports
+import crewstats
+import compliance
+import weatherprovider
+import weightbalance
+import startup
+import offlinesync
+import events
+import labelqueue
+import inventoryindex
 from errors import *
 
 from customwidgets import SearchWidget
@@ -26,82 +46,76 @@ LABEL_TEMPLATE_FOLDER = os.path.join(PROGRAM_FOLDER, 'Label Templates')
 
 DUMPS_FOLDER = os.path.join(PROGRAM_FOLDER, 'Dumps')
 DATABASE_DUMPS_FOLDER = os.path.join(DUMPS_FOLDER, 'Database')
+LABEL_OUTPUT_FOLDER = os.path.join(DUMPS_FOLDER, 'Labels')
+FLIGHT_LOG_EXPORT_FOLDER = os.path.join(DUMPS_FOLDER, 'Flight Log')
 
 THUMBNAIL_WIDTH = 400
 THUMBNAIL_HEIGHT = 250
 
-import dialogs
-
-if not os.path.exists(COMPANY_FOLDER):
-    os.mkdir(COMPANY_FOLDER)
-
-if not os.path.exists(PROGRAM_FOLDER):
-    os.makedirs(PROGRAM_FOLDER)
-
-if not os.path.exists(LABEL_TEMPLATE_FOLDER):
-    os.makedirs(LABEL_TEMPLATE_FOLDER)
-    with open(os.path.join(LABEL_TEMPLATE_FOLDER, label_template_data.INVENTORY_BARCODE_TEMPLATE["FileName"]), 'w') as f:
-        f.write(label_template_data.INVENTORY_BARCODE_TEMPLATE["Data"])
-
-if not os.path.exists(LOG_FOLDER):
-    os.makedirs(LOG_FOLDER)
-
-if not os.path.exists(DUMPS_FOLDER):
-    os.makedirs(DUMPS_FOLDER)
-
-if not os.path.exists(DATABASE_DUMPS_FOLDER):
-    os.makedirs(DATABASE_DUMPS_FOLDER)
-
-
-class DymoLabelPrinter:
-    def __init__(self) -> object:
-        self.printer_name = None
-        self.label_file_path = None
-        self.is_open = False
-        try:
-            self.printer_engine = Dispatch('Dymo.DymoAddIn')
-            self.label_engine = Dispatch('Dymo.DymoLabels')
-        except Exception as error:
-            if error.strerror == "Invalid class string":
-                raise MissingRequiredSoftwareError("Missing required software program. Please install DLS8Setup.8.7.exe.")
+CHANGE_FEED_INTERVAL = 5
+"""Seconds between two reads of the change log for the writes of the other workstations."""
+CHANGE_LOG_RETENTION = datetime.timedelta(days=1)
+"""Age after which the change log entries are pruned, read by then by every workstation that was open."""
 
-        printers = self.printer_engine.GetDymoPrinters()
-        self.PRINTERS = [printer for printer in printers.split('|') if printer]
-
-    def __enter__(self):
-        self.printer_engine.StartPrintJob()
-        return self.printer_engine
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        # Log the exception if one was raised
-        self.printer_engine.EndPrintJob()
-
-    def set_printer(self, printer_name: str):
-        if printer_name not in self.PRINTERS:
-            raise Exception('Printer not found')
-        self.printer_engine.SelectPrinter(printer_name)
-
-    def print_labels(self, copies: int = 1):
-        with self as label_engine:
-            label_engine.Print(copies, False)
+import dialogs
 
-    def set_field(self, field_name: str, field_value: Any):
-        self.label_engine.SetField(field_name, field_value)
 
-    def register_label_file(self, label_file_path: str) -> object:
-        self.label_file_path = label_file_path
-        self.is_open = self.printer_engine.Open(label_file_path)
-        if not self.is_open:
-            raise SetLabelFileError('Could not open label file.')
+def create_program_folders() -> None:
+    """Creates the program's folders, and the default label template along with its folder."""
+    if not os.path.exists(LABEL_TEMPLATE_FOLDER):
+        os.makedirs(LABEL_TEMPLATE_FOLDER)
+        with open(os.path.join(LABEL_TEMPLATE_FOLDER, label_template_data.INVENTORY_BARCODE_TEMPLATE["FileName"]), 'w') as f:
+            f.write(label_template_data.INVENTORY_BARCODE_TEMPLATE["Data"])
+
+    for folder in (LOG_FOLDER, DUMPS_FOLDER, DATABASE_DUMPS_FOLDER, FLIGHT_LOG_EXPORT_FOLDER):
+        os.makedirs(folder, exist_ok=True)
+
+
+STARTUP_STAGES = [
+    startup.Stage("Creating program folders", create_program_folders),
+    startup.Stage("Connecting to database", startup.connect, weight=3),
+    startup.Stage("Checking default data", database.check_default_data, weight=3),
+    startup.Stage("Loading reference data", startup.load_reference_data, weight=2),
+    startup.Stage("Starting weather fill", weatherprovider.start_filling),
+]
+"""Startup stages run off the GUI thread before the main window is built."""
+
+
+@dataclass
+class SearchTab:
+    """The search table of a tab. Loaded when the tab is first opened, then refreshed incrementally each time it is opened again."""
+    widget: SearchWidget
+    model: Any
+    results_attr: str
+    """Name of the window attribute listing the records in table order."""
+    query: Callable[[], Any]
+    rows: Callable[[list], list[list[str]]]
+    """Builds the table rows of a list of records in one batch."""
+    related: list[tuple[Any, Any]] = field(default_factory=list)
+    """(Model, foreign key) of other tables shown in the rows. Their changes also change the rows."""
+    comboboxes: Callable[[], None] = None
+    """Fills the tab's comboboxes that list the records of other tables."""
+    combobox_models: list[Any] = field(default_factory=list)
+    """Models listed in the comboboxes. They are refilled only when one of them changed."""
+    loaded_at: datetime.datetime = None
+    """Staleness timestamp. Rows modified after it are reloaded by the next refresh."""
+    records: dict[int, Any] = field(default_factory=dict)
+    """The loaded records by id."""
+    combobox_signature: tuple = None
 
 
 class MainWindow(Ui_MainWindow):
     initialized = QtCore.pyqtSignal()
+    changes_received = QtCore.pyqtSignal(object)
+    """Carries the change events published on any thread to apply_changes on the GUI thread."""
 
-    def __init__(self, parent=None):
+    def __init__(self, reference_data: startup.ReferenceData=None, parent=None):
         super().__init__()
         self.setupUi(self)
         self.setWindowTitle(f"{PROGRAM_NAME} v{VERSION}")
+        self.reference_data = reference_data or startup.load_reference_data()
+        self.loaded_tabs = set() # type: set[QtWidgets.QWidget]
+        """Tabs whose search tables have been loaded. The others load when opened."""
 
         self.drone_info_tabwidget.setEnabled(False)
         self.batteries_info_groupbox.setEnabled(False)
@@ -112,6 +126,61 @@ class MainWindow(Ui_MainWindow):
         self.load_settings()
 
         self.label_printing_enabled = True
+        self.label_printer = None # type: labelprinter.DymoLabelPrinter
+        """Opened by open_label_printer when the first label is printed."""
+        self.dymo_label_backend = None # type: labelqueue.DymoBackend
+        self.label_thread = None # type: QtCore.QThread
+        self.label_queue = None # type: labelqueue.LabelQueue
+        """Prints the labels in the background, started with the first label printed."""
+
+        self.actionExport_Flight_Log = QtWidgets.QAction("Export Flight Log", self)
+        self.menuFIle.addAction(self.actionExport_Flight_Log)
+        self.actionExport_Fleet_Report = QtWidgets.QAction("Export Fleet Report", self)
+        self.menuFIle.addAction(self.actionExport_Fleet_Report)
+        self.actionImport_Records = QtWidgets.QAction("Import Records", self)
+        self.menuDrone.addAction(self.actionImport_Records)
+        self.actionImport_Charge_Log = QtWidgets.QAction("Import Charge Log", self)
+        self.menuDrone.addAction(self.actionImport_Charge_Log)
+        self.actionImport_Telemetry_Logs = QtWidgets.QAction("Import Telemetry Logs", self)
+        self.menuFlight.addAction(self.actionImport_Telemetry_Logs)
+        self.actionBackfill_Weather = QtWidgets.QAction("Backfill Weather", self)
+        self.menuFlight.addAction(self.actionBackfill_Weather)
+        self.actionCrew_Currency = QtWidgets.QAction("Crew Currency", self)
+        self.menuFlight.addAction(self.actionCrew_Currency)
+        self.actionDocument_Compliance = QtWidgets.QAction("Document Compliance", self)
+        self.menuFlight.addAction(self.actionDocument_Compliance)
+        self.actionWeight_Audit = QtWidgets.QAction("Weight Audit", self)
+        self.menuFlight.addAction(self.actionWeight_Audit)
+        self.actionMaintenance_Due = QtWidgets.QAction("Maintenance Due", self)
+        self.menuMaintenance.addAction(self.actionMaintenance_Due)
+        self.actionSync_Now = QtWidgets.QAction("Sync Now", self)
+        self.menuFIle.addAction(self.actionSync_Now)
+        self.actionResolve_Sync_Conflicts = QtWidgets.QAction("Resolve Sync Conflicts", self)
+        self.menuFIle.addAction(self.actionResolve_Sync_Conflicts)
+        self.actionSync_Now.setVisible(offlinesync.active_replica is not None)
+        self.actionResolve_Sync_Conflicts.setVisible(offlinesync.active_replica is not None)
+
+        self.sync_status_label = QtWidgets.QLabel()
+        self.statusBar().addPermanentWidget(self.sync_status_label)
+        self.sync_thread = None # type: QtCore.QThread
+        self.sync_worker = None # type: SyncWorker
+        """Syncs the replica in the background, when the program works on one."""
+        if offlinesync.active_replica is not None:
+            self.start_sync(offlinesync.active_replica)
+        self.change_feed_thread = None # type: QtCore.QThread
+        self.change_feed_worker = None # type: ChangeFeedWorker
+        """Reads the writes of the other workstations from the change log. A replica gets them through its sync instead."""
+        if offlinesync.active_replica is None:
+            self.start_change_feed()
+
+        self.scan_line_edit = QtWidgets.QLineEdit()
+        self.scan_line_edit.setPlaceholderText("Scan inventory ID")
+        self.scan_line_edit.setClearButtonEnabled(True)
+        self.scan_line_edit.setFixedWidth(200)
+        self.menuBar().setCornerWidget(self.scan_line_edit, QtCore.Qt.TopRightCorner)
+        self.actionScan_Inventory_ID = QtWidgets.QAction("Scan Inventory ID", self)
+        self.actionScan_Inventory_ID.setShortcut(QtGui.QKeySequence("Ctrl+K"))
+        self.menuFIle.addAction(self.actionScan_Inventory_ID)
 
         columns = [
             "Serial Number",
@@ -170,7 +239,8 @@ class MainWindow(Ui_MainWindow):
             "Unique Id",
             "Drone",
             "Type",
-            "Status"
+            "Status",
+            "Takeoff Weight"
         ]
         self.flight_search_widget = SearchWidget(columns)
         self.flight_search_layout.addWidget(self.flight_search_widget)
@@ -199,24 +269,6 @@ class MainWindow(Ui_MainWindow):
         self.flight_controller_search_widget.add_search_form_field("Name:", self.search_flight_controller_name_line_edit)
         self.flight_controller_search_widget.add_search_form_field("Status:", self.search_flight_controller_status_combobox)
 
-        try:
-            self.label_printer = DymoLabelPrinter()
-        except MissingRequiredSoftwareError as error:
-            self.label_printing_enabled = False
-            self.label_printer = None
-            print(error)
-
-        if self.label_printing_enabled:
-            if self.default_printer == "":
-                if len(self.label_printer.PRINTERS) == 1:
-                    self.default_printer = self.label_printer.PRINTERS[0]
-                    self.label_printer.set_printer(self.default_printer)
-                    self.settings.setValue("default_printer", self.default_printer)
-                else:
-                    self.ask_for_default_printer()
-            self.label_printer.set_printer(self.default_printer)
-
-        
         self.init_form_data()
         self.connect_signals()
         self.initialized.emit()
@@ -239,6 +291,12 @@ class MainWindow(Ui_MainWindow):
     def closeEvent(self, event=None) -> None:
         """Closes the application."""
         self.save_settings()
+        for entity in self.change_models:
+            events.unsubscribe(entity, self._on_changes)
+        for thread in (self.sync_thread, self.change_feed_thread, self.label_thread):
+            if thread is not None:
+                thread.quit()
+                thread.wait()
         self.close()
     
     def _restore_splitter_states(self) -> None:
@@ -298,170 +356,277 @@ class MainWindow(Ui_MainWindow):
         self._populate_combobox(self.flight_controller_status_combobox, database.Airworthyness.all())
         
         
-        drones = database.global_session.query(database.Drone).all()
-        self._populate_combobox(self.search_flight_drone_combobox, [d.combobox_name for d in drones], add_blank=True)
-        self._populate_combobox(self.flight_drone_combobox, [d.combobox_name for d in drones])
-
-        batteries = database.global_session.query(database.Battery).all()
-        self._populate_combobox(self.flight_battery_combobox, [b.combobox_name for b in batteries])
-
-        flight_types = database.global_session.query(database.FlightType).all()
-        self._populate_combobox(self.search_flight_type_combobox, [flight_type.name for flight_type in flight_types], add_blank=True)
-        self._populate_combobox(self.flight_type_combbox, [flight_type.name for flight_type in flight_types])
-
-        flight_statues = database.global_session.query(database.FlightStatus).order_by(database.FlightStatus.id).all()
-        self._populate_combobox(self.search_flight_status_combobox, [flight_status.name for flight_status in flight_statues], add_blank=True)
-
-        flight_operation_types = database.global_session.query(database.FlightOperationType).all()
-        self._populate_combobox(self.flight_operation_type_combobox, [flight_operation_type.name for flight_operation_type in flight_operation_types])
-
-        flight_operation_aprovals = database.global_session.query(database.FlightOperationApproval).all()
-        self._populate_combobox(self.flight_operation_aproval_type_combobox, [flight_operation_approval.name for flight_operation_approval in flight_operation_aprovals])
-
-        legal_rules = database.global_session.query(database.LegalRule).all()
-        self._populate_combobox(self.flight_legal_rule_combobox, [legal_rule.name for legal_rule in legal_rules])
-
-        battery_chemistries = database.global_session.query(database.BatteryChemistry).all()
-        self._populate_combobox(self.search_battery_chemistry_combobox, [battery_chemistry.combobox_name for battery_chemistry in battery_chemistries], add_blank=True)
-        self._populate_combobox(self.battery_chemistry_combobox, [battery_chemistry.combobox_name for battery_chemistry in battery_chemistries])
+        reference_data = self.reference_data
+        self._populate_combobox(self.search_flight_type_combobox, reference_data.flight_types, add_blank=True)
+        self._populate_combobox(self.flight_type_combbox, reference_data.flight_types)
+        self._populate_combobox(self.search_flight_status_combobox, reference_data.flight_statuses, add_blank=True)
+        self._populate_combobox(self.flight_operation_type_combobox, reference_data.flight_operation_types)
+        self._populate_combobox(self.flight_operation_aproval_type_combobox, reference_data.flight_operation_approvals)
+        self._populate_combobox(self.flight_legal_rule_combobox, reference_data.legal_rules)
+        self._populate_combobox(self.search_battery_chemistry_combobox, reference_data.battery_chemistries, add_blank=True)
+        self._populate_combobox(self.battery_chemistry_combobox, reference_data.battery_chemistries)
 
         self._populate_combobox(self.search_equipment_status_combobox, database.Airworthyness.all(), add_blank=True)
         self._populate_combobox(self.equipment_status_combobox, database.Airworthyness.all())
 
-        equipment_types = database.global_session.query(database.EquipmentType).all()
-        self._populate_combobox(self.search_equipment_type_combobox, [equipment_type.name for equipment_type in equipment_types], add_blank=True)
-        self._populate_combobox(self.equipment_type_combobox, [equipment_type.name for equipment_type in equipment_types])
+        self._populate_combobox(self.search_equipment_type_combobox, reference_data.equipment_types, add_blank=True)
+        self._populate_combobox(self.equipment_type_combobox, reference_data.equipment_types)
 
-        flight_controllers = database.global_session.query(database.FlightController).all()
-        self._populate_combobox(self.drone_flight_controller_combobox, [flight_controller.combobox_name for flight_controller in flight_controllers])
-        
-        self.drone_geometry_combobox.addItems([geometry.name for geometry in database.DroneGeometry.find_all()])
+        self.drone_geometry_combobox.addItems(reference_data.drone_geometries)
+
+        self._init_search_tabs()
+        self.load_visible_tab()
 
-        self.reload_all_search_tables()
+    def _init_search_tabs(self) -> None:
+        """Sets up the search table of each tab. Nothing is loaded until a tab is opened."""
+        self.drone_search_results = [] # type: list[database.Drone]
+        self.battery_search_results = [] # type: list[database.Battery]
+        self.flight_search_results = [] # type: list[database.Flight]
+        self.equipment_search_results = [] # type: list[database.Equipment]
+        self.flight_controller_search_results = [] # type: list[database.FlightController]
+
+        session = database.global_session
+        self.search_tabs = {
+            self.drones_tab: SearchTab(self.drone_search_widget, database.Drone, "drone_search_results",
+                                       lambda: session.query(database.Drone), self._drone_rows,
+                                       comboboxes=self._reload_flight_controller_comboboxes, combobox_models=[database.FlightController]),
+            self.batteries_tab: SearchTab(self.battery_search_widget, database.Battery, "battery_search_results",
+                                          lambda: session.query(database.Battery), self._battery_rows),
+            self.equipment_tab: SearchTab(self.equipment_search_widget, database.Equipment, "equipment_search_results",
+                                          lambda: session.query(database.Equipment), self._equipment_rows),
+            self.flight_controller_tab: SearchTab(self.flight_controller_search_widget, database.FlightController, "flight_controller_search_results",
+                                                  lambda: session.query(database.FlightController), self._flight_controller_rows),
+            self.flight_tab: SearchTab(self.flight_search_widget, database.Flight, "flight_search_results",
+                                       lambda: session.query(database.Flight).filter(database.Flight.active == True), self._flight_rows,
+                                       related=[(database.Drone, database.Flight.drone_id)],
+                                       comboboxes=self._reload_drone_comboboxes, combobox_models=[database.Drone]),
+        } # type: dict[QtWidgets.QWidget, SearchTab]
+
+        self.change_models = {} # type: dict[str, Any]
+        """Models whose writes change a search table or a combobox, by table name."""
+        for search_tab in self.search_tabs.values():
+            for model in [search_tab.model, *(related_model for related_model, _ in search_tab.related), *search_tab.combobox_models]:
+                self.change_models[model.__tablename__] = model
+        self.changes_received.connect(self.apply_changes, QtCore.Qt.QueuedConnection)
+        for entity in self.change_models:
+            events.subscribe(entity, self._on_changes)
+
+    def visible_tab(self) -> QtWidgets.QWidget:
+        """Returns the visible tab, the inventory sub tab if the inventory is open."""
+        tab = self.tabWidget.currentWidget()
+        if tab is self.inventory_tab:
+            tab = self.tabWidget_2.currentWidget()
+        return tab
+
+    def load_visible_tab(self) -> None:
+        """Loads the search table and comboboxes of the visible tab the first time it is opened, and refreshes them incrementally afterwards."""
+        tab = self.visible_tab()
+        if tab not in self.search_tabs: return
+        if tab in self.loaded_tabs:
+            self.refresh_search_table(tab)
+        else:
+            self.load_search_table(tab)
+
+    def load_search_table(self, tab: QtWidgets.QWidget) -> None:
+        """Loads every record of a tab's search table."""
+        search_tab = self.search_tabs[tab]
+        search_tab.loaded_at = datetime.datetime.now()
+        records = search_tab.query().all()
+        search_tab.records = {record.id: record for record in records}
+        search_tab.widget.set_record_data(search_tab.rows(records), [record.id for record in records])
+        setattr(self, search_tab.results_attr, records)
+        self.loaded_tabs.add(tab)
+        self._refresh_tab_comboboxes(search_tab)
+
+    def refresh_search_table(self, tab: QtWidgets.QWidget) -> None:
+        """Updates the rows of a tab's search table that were added, modified or deleted since it was loaded or last refreshed.
+            Costs an id query and a query of the modified rows, instead of reloading the whole table. Tabs not loaded yet are left to load when opened.
+        """
+        if tab not in self.loaded_tabs: return
+
+        search_tab = self.search_tabs[tab]
+        model = search_tab.model
+        since = search_tab.loaded_at
+        search_tab.loaded_at = datetime.datetime.now()
+
+        ids = {id_ for id_, in search_tab.query().with_entities(model.id)}
+        removed = search_tab.records.keys() - ids
+        modified = model.date_modified >= since
+        for related_model, foreign_key in search_tab.related:
+            modified = or_(modified, foreign_key.in_(select(related_model.id).where(related_model.date_modified >= since)))
+        changed = search_tab.query().filter(modified).all()
+        # Rows brought back into the query, like a reactivated flight, can be older than the timestamp.
+        returned = ids - search_tab.records.keys() - {record.id for record in changed}
+        if returned:
+            changed += search_tab.query().filter(model.id.in_(returned)).all()
+
+        if changed or removed:
+            for id_ in removed:
+                del search_tab.records[id_]
+            search_tab.records.update({record.id: record for record in changed})
+            search_tab.widget.update_records(dict(zip([record.id for record in changed], search_tab.rows(changed))), removed)
+            setattr(self, search_tab.results_attr, [search_tab.records[id_] for id_ in search_tab.widget.record_keys])
+        self._refresh_tab_comboboxes(search_tab)
+
+    def _on_changes(self, changes: list[events.ChangeEvent]) -> None:
+        # Published inside the commit, maybe on another thread. The rows are queried once the commit is done, on the GUI thread.
+        self.changes_received.emit(changes)
+
+    def apply_changes(self, changes: list[events.ChangeEvent]) -> None:
+        """Patches the rows of the loaded search tables that the writes to one table changed, and refills the comboboxes listing it.
+            Costs a query of the written records, the other rows and the tabs not loaded yet are left alone. A bulk write reloads the tables it changed.
+        """
+        entity = changes[0].entity
+        model = self.change_models[entity]
+        ids = {change.id for change in changes}
+        whole_table = events.TABLE_ID in ids
+        session = database.global_session
+        for change in changes:
+            # Written by another workstation, the loaded record is stale.
+            if not change.remote: continue
+            if change.id == events.TABLE_ID:
+                records = [record for record in session.identity_map.values() if isinstance(record, model)]
+            else:
+                records = [session.identity_map.get(session.identity_key(model, change.id))]
+            for record in filter(None, records):
+                session.expire(record)
+
+        for tab in self.loaded_tabs & self.search_tabs.keys():
+            search_tab = self.search_tabs[tab]
+            if whole_table and (search_tab.model is model or any(related_model is model for related_model, _ in search_tab.related)):
+                # Written in bulk, any row may have changed.
+                self.load_search_table(tab)
+                continue
+            if search_tab.model is model:
+                self._patch_search_table(search_tab, ids)
+            for related_model, foreign_key in search_tab.related:
+                if related_model is model:
+                    self._patch_search_table(search_tab, {id_ for id_, in search_tab.query().filter(foreign_key.in_(ids)).with_entities(search_tab.model.id)})
+            if model in search_tab.combobox_models:
+                self._refresh_tab_comboboxes(search_tab)
+
+    def _patch_search_table(self, search_tab: SearchTab, ids: set[int]) -> None:
+        """Reloads the rows of records in a search table, adding the records the query now returns and dropping the ones it no longer does."""
+        if not ids: return
+        model = search_tab.model
+        records = search_tab.query().filter(model.id.in_(ids)).all()
+        removed = (ids - {record.id for record in records}) & search_tab.records.keys()
+        for id_ in removed:
+            del search_tab.records[id_]
+        search_tab.records.update({record.id: record for record in records})
+        search_tab.widget.update_records(dict(zip([record.id for record in records], search_tab.rows(records))), removed)
+        setattr(self, search_tab.results_attr, [search_tab.records[id_] for id_ in search_tab.widget.record_keys])
+
+    def refresh_visible_tab(self) -> None:
+        """Refreshes the visible tab and marks the others stale, they reload when opened."""
+        self.loaded_tabs.intersection_update({self.visible_tab()})
+        self.load_visible_tab()
+
+    def _refresh_tab_comboboxes(self, search_tab: SearchTab) -> None:
+        """Refills a tab's comboboxes if the tables they list changed, from the row count and latest modification of each table."""
+        if search_tab.comboboxes is None: return
+        signature = tuple(tuple(database.global_session.query(func.count(model.id), func.max(model.date_modified)).one()) for model in search_tab.combobox_models)
+        if signature == search_tab.combobox_signature: return
+        search_tab.combobox_signature = signature
+        search_tab.comboboxes()
+
+    def _refill_combobox(self, combo_box: QtWidgets.QComboBox, data_list: list, add_blank=False) -> None:
+        """Populates a combo box without emitting its change signals, keeping its current text."""
+        current_text = combo_box.currentText()
+        combo_box.blockSignals(True)
+        self._populate_combobox(combo_box, data_list, add_blank)
+        combo_box.setCurrentText(current_text)
+        combo_box.blockSignals(False)
+
+    def _reload_drone_comboboxes(self) -> None:
+        names = [drone.combobox_name for drone in database.global_session.query(database.Drone)]
+        self._refill_combobox(self.search_flight_drone_combobox, names, add_blank=True)
+        self._refill_combobox(self.flight_drone_combobox, names)
+
+    def _reload_flight_controller_comboboxes(self) -> None:
+        names = [flight_controller.combobox_name for flight_controller in database.global_session.query(database.FlightController)]
+        self._refill_combobox(self.drone_flight_controller_combobox, names)
 
     def reload_all_search_tables(self) -> None:
         """Reloads all search tables."""
-
-        # Inventory tab.
-        self.reload_drone_search_table()
-        self.reload_battery_search_table()
-
-        # Flight tab.
-        self.reload_flight_search_table()
-
-        # Equipment tab.
-        self.reload_equipment_search_table()
-
-        # Flight Controller tab.
-        self.reload_flight_controller_search_table()
+        for tab in self.search_tabs:
+            self.load_search_table(tab)
     
     def reload_drone_search_table(self, search_criteria=None) -> None:
         """Reloads the drone search table."""
-        self.drone_search_results = [] # type: list[database.Drone]
-
         # TODO: Implement search criteria.
-        if search_criteria:
-            self.drone_search_results = database.global_session.query(database.Drone).all()
-        else:
-            self.drone_search_results = database.global_session.query(database.Drone).all()
-        
-        data = []
-        for drone in self.drone_search_results:
-            row = []
-            row.append(drone.serial_number)
-            row.append(drone.name)
-            row.append(drone.color)
-            row.append(drone.brand)
-            row.append(drone.status)
-            data.append(row)
+        self.load_search_table(self.drones_tab)
 
-        self.drone_search_widget.set_record_data(data)
+    def _drone_rows(self, drones: list[database.Drone]) -> list[list[str]]:
+        return [[drone.serial_number, drone.name, drone.color, drone.brand, drone.status] for drone in drones]
     
     def reload_battery_search_table(self, search_criteria=None) -> None:
         """Reloads the battery search table."""
-
         # TODO: Implement search criteria.
-        self.battery_search_results = [] # type: list[database.Battery]
-
-        if search_criteria:
-            self.battery_search_results = database.global_session.query(database.Battery).all()
-        else:
-            self.battery_search_results = database.global_session.query(database.Battery).all()
-        
-        data = []
-        for battery in self.battery_search_results:
-            row = []
-            row.append(battery.serial_number)
-            row.append(battery.name)
-            row.append(battery.chemistry.name)
-            row.append(battery.status)
-            data.append(row)
+        self.load_search_table(self.batteries_tab)
 
-        self.battery_search_widget.set_record_data(data)
+    def _battery_rows(self, batteries: list[database.Battery]) -> list[list[str]]:
+        return [[battery.serial_number, battery.name, battery.chemistry.name, battery.status] for battery in batteries]
     
     def reload_flight_search_table(self, search_criteria=None) -> None:
         """Reloads the flight search table."""
-        self.flight_search_results = [] # type: list[database.Flight]
-
         # TODO: Implement search criteria.
-        if search_criteria:
-            self.flight_search_results = database.global_session.query(database.Flight).all()
-        else:
-            self.flight_search_results = database.global_session.query(database.Flight).filter(database.Flight.active == True).all()
-        
+        self.load_search_table(self.flight_tab)
+
+    def _flight_rows(self, flights: list[database.Flight]) -> list[list[str]]:
+        weights = weightbalance.compute([flight.id for flight in flights])
         data = []
-        for flight in self.flight_search_results:
+        for flight in flights:
+            weight = weights[flight.id]
             row = []
             row.append(flight.uuid)
             row.append(flight.drone.combobox_name)
             row.append(flight.type_.name)
             row.append(flight.status.name)
+            row.append(f"{weight.takeoff_weight} kg" + (" (Overweight)" if weight.overweight else ""))
             data.append(row)
-
-        self.flight_search_widget.set_record_data(data)
+        return data
     
     def reload_equipment_search_table(self, search_criteria=None) -> None:
         """Reloads the equipment search table."""
-        self.equipment_search_results = [] # type: list[database.Equipment]
-
         # TODO: Implement search criteria.
-        if search_criteria:
-            self.equipment_search_results = database.global_session.query(database.Equipment).all()
-        else:
-            self.equipment_search_results = database.global_session.query(database.Equipment).all()
-        
-        data = []
-        for item in self.equipment_search_results:
-            row = []
-            row.append(item.serial_number)
-            row.append(item.name)
-            row.append(item.description)
-            row.append(item.type_.name)
-            row.append(item.status)
-            data.append(row)
-        
-        self.equipment_search_widget.set_record_data(data)
+        self.load_search_table(self.equipment_tab)
+
+    def _equipment_rows(self, equipment: list[database.Equipment]) -> list[list[str]]:
+        return [[item.serial_number, item.name, item.description, item.type_.name, item.status] for item in equipment]
     
     def reload_flight_controller_search_table(self, search_criteria=None) -> None:
         """Reloads the flight controller search table."""
-        self.flight_controller_search_results = []
-
         # TODO: Implement search criteria.
-        if search_criteria:
-            self.flight_controller_search_results = database.global_session.query(database.FlightController).all()
-        else:
-            self.flight_controller_search_results = database.global_session.query(database.FlightController).all()
-        
-        data = []
-        for flight_controller in self.flight_controller_search_results:
-            row = []
-            row.append(flight_controller.serial_number)
-            row.append(flight_controller.name)
-            row.append(flight_controller.status)
-            data.append(row)
-        
-        self.flight_controller_search_widget.set_record_data(data)
+        self.load_search_table(self.flight_controller_tab)
+
+    def _flight_controller_rows(self, flight_controllers: list[database.FlightController]) -> list[list[str]]:
+        return [[flight_controller.serial_number, flight_controller.name, flight_controller.status] for flight_controller in flight_controllers]
     
+    def reload_flight_battery_combobox(self, flight: database.Flight) -> None:
+        """Lists the batteries the flight's drone can fly with, the recommended one first. Batteries past their end of life are listed last, in red."""
+        end_of_life = set()
+        try:
+            recommended = batteryanalytics.recommend_batteries(flight.drone, planned_duration=flight.duration)
+            names = [health.combobox_name for health in recommended]
+            end_of_life = {health.combobox_name for health in recommended if health.end_of_life}
+        except MissingRequiredSoftwareError:
+            names = [battery_to_drone.battery.combobox_name for battery_to_drone in flight.drone.batteries]
+        if flight.battery is not None and flight.battery.combobox_name not in names:
+            names.append(flight.battery.combobox_name)
+
+        self.flight_battery_combobox.blockSignals(True)
+        self._populate_combobox(self.flight_battery_combobox, names)
+        for index in range(self.flight_battery_combobox.count()):
+            if self.flight_battery_combobox.itemText(index) in end_of_life:
+                self.flight_battery_combobox.setItemData(index, QtGui.QBrush(QtCore.Qt.red), QtCore.Qt.ForegroundRole)
+                self.flight_battery_combobox.setItemData(index, "Past its end of life, retire it.", QtCore.Qt.ToolTipRole)
+        if flight.battery is not None:
+            self.flight_battery_combobox.setCurrentText(flight.battery.combobox_name)
+        else:
+            self.flight_battery_combobox.setCurrentIndex(-1)
+        self.flight_battery_combobox.blockSignals(False)
+
     def reload_flight_equipment_table(self, flight: database.Flight):
         """Reloads the flight equipment table."""
         self.flight_equipment_table.setRowCount(0)
@@ -514,6 +679,21 @@ class MainWindow(Ui_MainWindow):
         database.backup_database(DATABASE_DUMPS_FOLDER)
         self.statusBar().showMessage("Database backup complete.", 5000)
 
+    def export_flight_log(self) -> None:
+        """Exports the flights added or modified since the last export to the flight log export folder."""
+        self.statusBar().showMessage("Exporting flight log...")
+        try:
+            file_path = flightexport.export_flights_incremental(FLIGHT_LOG_EXPORT_FOLDER)
+        except MissingRequiredSoftwareError as error:
+            self.statusBar().clearMessage()
+            self.show_error(error)
+            return
+
+        if file_path is None:
+            self.statusBar().showMessage("Flight log export is up to date.", 5000)
+        else:
+            self.statusBar().showMessage(f"Flight log exported to {file_path}.", 5000)
+
     def connect_signals(self):
         # Window Widgets
         self.drone_splitter.splitterMoved.connect(self.on_splitter_moved)
@@ -521,24 +701,42 @@ class MainWindow(Ui_MainWindow):
         self.equipment_splitter.splitterMoved.connect(self.on_splitter_moved)
         self.flight_controller_splitter.splitterMoved.connect(self.on_splitter_moved)
         self.flights_splitter.splitterMoved.connect(self.on_splitter_moved)
-
+        self.tabWidget.currentChanged.connect(self.load_visible_tab)
+        self.tabWidget_2.currentChanged.connect(self.load_visible_tab)
 
         # File menu
         self.actionAbout.triggered.connect(self.about)
         self.actionExit.triggered.connect(self.closeEvent)
         self.actionExit.setShortcut("Ctrl+Q")
         self.actionBackup_Database.triggered.connect(self.backup_database)
+        self.actionExport_Flight_Log.triggered.connect(self.export_flight_log)
 
         # Inventory menu
         self.actionAdd_Drone.triggered.connect(self.add_drone)
         self.actionAdd_Battery.triggered.connect(self.add_battery)
         self.actionAdd_Equipment.triggered.connect(self.add_equipment)
+        self.actionImport_Records.triggered.connect(self.import_records)
 
         # Maintenance menu
         self.actionAdd_Maintenance.triggered.connect(self.add_maintenance)
+        self.actionMaintenance_Due.triggered.connect(self.show_maintenance_due)
+        self.actionScan_Inventory_ID.triggered.connect(self.focus_scan_input)
+        self.scan_line_edit.returnPressed.connect(self.open_scanned_record)
 
         # Flight menu
         self.actionAdd_Flight.triggered.connect(self.add_flight)
+        self.actionImport_Telemetry_Logs.triggered.connect(self.import_telemetry_logs)
+        self.actionImport_Charge_Log.triggered.connect(self.import_charge_log)
+        self.actionBackfill_Weather.triggered.connect(self.backfill_weather)
+        self.actionExport_Fleet_Report.triggered.connect(self.export_fleet_report)
+        self.actionCrew_Currency.triggered.connect(self.show_crew_currency)
+        self.actionSync_Now.triggered.connect(self.sync_now)
+        self.actionResolve_Sync_Conflicts.triggered.connect(self.resolve_sync_conflicts)
+        self.actionDocument_Compliance.triggered.connect(self.show_document_compliance)
+        self.actionWeight_Audit.triggered.connect(self.export_weight_audit)
+
+        for tab in self.search_tabs:
+            self.search_tabs[tab].widget.print_labels_button.clicked.connect(functools.partial(self.print_selected_labels, tab))
 
         # Drone tab
         self.drone_search_widget.search_button.clicked.connect(self.on_search_drone_button_clicked)
@@ -677,6 +875,7 @@ class MainWindow(Ui_MainWindow):
         self.flight_max_altitude_spinbox.valueChanged.connect(lambda: self.selected_flight.set_attribute(database.Flight.max_altitude, self.flight_max_altitude_spinbox.value()))
         self.flight_distance_traveled_spinbox.valueChanged.connect(lambda: self.selected_flight.set_attribute(database.Flight.distance_traveled, self.flight_distance_traveled_spinbox.value()))
         self.flight_drone_combobox.currentIndexChanged.connect(lambda: self.selected_flight.set_attribute(database.Flight.drone_id, database.Drone.find_by_combobox_name(self.flight_drone_combobox.currentText()).id))
+        self.flight_drone_combobox.currentIndexChanged.connect(lambda: self.reload_flight_battery_combobox(self.selected_flight))
         self.flight_battery_combobox.currentIndexChanged.connect(lambda: self.selected_flight.set_attribute(database.Flight.battery_id, database.Battery.find_by_combobox_name(self.flight_battery_combobox.currentText()).id))
         self.flight_equipment_add_button.clicked.connect(self.on_flight_equipment_add_button_clicked)
         self.flight_equipment_edit_button.clicked.connect(self.on_flight_equipment_edit_button_clicked)
@@ -771,20 +970,113 @@ class MainWindow(Ui_MainWindow):
 
         self.reload_flight_equipment_table(self.selected_flight)
 
-    def print_inventory_label(self, label_name: str, label_value: str):
-        """Prints a label with the given name and value."""
+    def open_label_printer(self) -> labelprinter.DymoLabelPrinter:
+        """Returns the label printer, opening it and choosing the default printer on first use.
+            The printer's COM components are slow to load, so they are only loaded once a label is printed. None if label printing is not available.
+        """
+        if self.label_printer is not None or not self.label_printing_enabled:
+            return self.label_printer
 
+        import labelprinter
         try:
-            self.label_printer.register_label_file(self.inventory_label_file_path)
-        except SetLabelFileError as error:
+            self.label_printer = labelprinter.DymoLabelPrinter()
+        except MissingRequiredSoftwareError as error:
+            self.label_printing_enabled = False
             self.show_error(error)
+            return None
+
+        if self.default_printer == "":
+            if len(self.label_printer.PRINTERS) == 1:
+                self.default_printer = self.label_printer.PRINTERS[0]
+                self.settings.setValue("default_printer", self.default_printer)
+            else:
+                self.ask_for_default_printer()
+                self.default_printer = self.settings.value("default_printer", "")
+        self.label_printer.set_printer(self.default_printer)
+        return self.label_printer
+
+    def label_backend(self) -> labelqueue.LabelBackend:
+        """Returns where to print labels: the default Dymo printer, or without one a PDF file the user picks. None if cancelled."""
+        if self.open_label_printer() is not None:
+            if self.dymo_label_backend is None or self.dymo_label_backend.printer_name != self.default_printer:
+                self.dymo_label_backend = labelqueue.DymoBackend(self.default_printer)
+            return self.dymo_label_backend
+
+        os.makedirs(LABEL_OUTPUT_FOLDER, exist_ok=True)
+        file_path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save Labels", os.path.join(LABEL_OUTPUT_FOLDER, "Labels.pdf"), "PDF Files (*.pdf)")
+        if not file_path: return None
+        return labelqueue.FileBackend(file_path)
+
+    def print_labels(self, jobs: list[labelqueue.LabelJob]) -> None:
+        """Queues labels, printed on the label queue's thread. The progress and the failures are shown once they are done."""
+        if not jobs: return
+        backend = self.label_backend()
+        if backend is None: return
+        if self.label_queue is None:
+            self.label_thread = QtCore.QThread()
+            self.label_queue = labelqueue.LabelQueue(self.inventory_label_file_path)
+            self.label_queue.moveToThread(self.label_thread)
+            self.label_queue.progress.connect(self.on_label_progress)
+            self.label_queue.finished.connect(self.on_labels_printed)
+            self.label_thread.finished.connect(self.label_queue.deleteLater)
+            self.label_thread.start()
+        self.label_queue.template_path = self.inventory_label_file_path
+        self.label_queue.submit(jobs, backend)
+        self.statusBar().showMessage(f"Printing {len(jobs)} labels...")
+
+    def on_label_progress(self, done: int, total: int) -> None:
+        self.statusBar().showMessage(f"Printing labels, {done} of {total} done...")
+
+    def on_labels_printed(self, result: labelqueue.PrintResult) -> None:
+        self.statusBar().showMessage(f"{result.printed} labels printed.", 10000)
+        if not result.failed: return
+        lines = [f"{job.name} ({job.inventory_id}): {message}" for job, message in result.failed[:20]]
+        if len(result.failed) > len(lines):
+            lines.append(f"And {len(result.failed) - len(lines)} more.")
+        QtWidgets.QMessageBox.warning(self, "Print Labels", f"{len(result.failed)} labels could not be printed.\n\n" + "\n".join(lines))
+
+    def print_selected_labels(self, tab: QtWidgets.QWidget) -> None:
+        """Prints the inventory labels of the records selected in a tab's search table."""
+        search_tab = self.search_tabs[tab]
+        records = [search_tab.records[key] for key in search_tab.widget.selected_keys() if key in search_tab.records]
+        self.print_labels([labelqueue.LabelJob(record.name or "", record.inventory_id) for record in records if record.inventory_id])
+
+    def focus_scan_input(self) -> None:
+        self.scan_line_edit.setFocus()
+        self.scan_line_edit.selectAll()
+
+    def open_scanned_record(self) -> None:
+        """Opens the form of the record whose inventory id was scanned or typed. The input stays focused and selected for the next scan."""
+        code = self.scan_line_edit.text().strip()
+        self.scan_line_edit.selectAll()
+        if not code: return
+        item = inventoryindex.find(code)
+        record = item.record() if item is not None else None
+        if record is None:
+            if item is not None:
+                # Deleted by a bulk write, which publishes no event.
+                inventoryindex.invalidate()
+            self.statusBar().showMessage(f"No drone, battery, equipment, flight controller or flight has the inventory ID {code}.", 10000)
             return
-        self.label_printer.set_field("barcode_upper_left", label_value)
-        self.label_printer.set_field("barcode_upper_right", label_value)
-        self.label_printer.set_field("barcode_lower_left", label_value)
-        self.label_printer.set_field("barcode_lower_right", label_value)
-        self.label_printer.set_field("center_waste_text", label_name)
-        self.label_printer.print_labels()
+
+        tab, reload_form = {
+            database.Drone: (self.drones_tab, self.reload_drone_form),
+            database.Battery: (self.batteries_tab, self.reload_battery_form),
+            database.Equipment: (self.equipment_tab, self.reload_equipment_form),
+            database.FlightController: (self.flight_controller_tab, self.reload_flight_controller_form),
+            database.Flight: (self.flight_tab, self.reload_flight_form),
+        }[item.model]
+        if self.tabWidget.indexOf(tab) == -1:
+            self.tabWidget.setCurrentWidget(self.inventory_tab)
+            self.tabWidget_2.setCurrentWidget(tab)
+        else:
+            self.tabWidget.setCurrentWidget(tab)
+        reload_form(record)
+        self.statusBar().showMessage(f"Opened {record.name or code}.", 10000)
+
+    def print_inventory_label(self, label_name: str, label_value: str):
+        """Prints a label with the given name and value."""
+        self.print_labels([labelqueue.LabelJob(label_name, label_value)])
 
     def on_drone_print_inventory_label_button_clicked(self):
         """Open the dialog to print the inventory labels."""
@@ -1172,7 +1464,7 @@ class MainWindow(Ui_MainWindow):
         self.flight_drone_combobox.setCurrentText(flight.drone.combobox_name)
         self.flight_drone_status_value.setText(flight.drone.status)
         self.flight_drone_serial_number_value.setText(flight.drone.serial_number)
-        self.flight_battery_combobox.setCurrentText(flight.battery.combobox_name)
+        self.reload_flight_battery_combobox(flight)
         self.reload_flight_equipment_table(flight)
 
         # Safety / Incidence tab
@@ -1218,7 +1510,6 @@ class MainWindow(Ui_MainWindow):
         dialog = dialogs.AddDroneDialog(self)
         dialog.exec()
         if dialog.drone is None: return
-        self.reload_drone_search_table()
         self.reload_drone_form(dialog.drone)
 
     def add_battery(self) -> None:
@@ -1228,7 +1519,6 @@ class MainWindow(Ui_MainWindow):
         battery = dialog.battery
         if battery is None: return
         self.reload_battery_form(battery)
-        self.reload_battery_search_table()
 
     def add_equipment(self) -> None:
         """Opens a dialog box to add a new equipment."""
@@ -1237,7 +1527,6 @@ class MainWindow(Ui_MainWindow):
         equipment = dialog.equipment
         if equipment is None: return
         self.reload_equipment_form(equipment)
-        self.reload_equipment_search_table()
     
     def add_flight_controller(self) -> None:
         """Opens a dialog box to add a new flight controller."""
@@ -1246,8 +1535,14 @@ class MainWindow(Ui_MainWindow):
         flight_controller = dialog.flight_controller
         if flight_controller is None: return
         self.reload_flight_controller_form(flight_controller)
-        self.reload_flight_controller_search_table()
     
+    def import_records(self) -> None:
+        """Opens a dialog box to bulk import records from a file."""
+        dialog = dialogs.ImportDialog(self)
+        dialog.exec()
+        if dialog.result is None or dialog.result.imported == 0: return
+        self.refresh_visible_tab()
+
     def add_maintenance(self) -> None:
         """Opens a dialog box to add a new maintenance."""
         return
@@ -1258,6 +1553,118 @@ class MainWindow(Ui_MainWindow):
         self.reload_maintenance_form(maintenance)
         self.reload_maintenance_search_table()
     
+    def show_maintenance_due(self) -> None:
+        """Shows the maintenance due across the fleet."""
+        due = maintenance.find_due()
+        if not due:
+            QtWidgets.QMessageBox.information(self, "Maintenance Due", "No maintenance is due.")
+            return
+
+        lines = []
+        for item in due:
+            state = "OVERDUE" if item.overdue else f"due in {item.remaining_hours} h"
+            lines.append(f"{item.drone_name}: {item.description} ({item.flight_hours} of {item.interval} flight hours, {state})")
+        QtWidgets.QMessageBox.warning(self, "Maintenance Due", "\n".join(lines))
+
+    def start_sync(self, replica: offlinesync.Replica) -> None:
+        """Syncs the replica with the database on a worker thread, now and every sync interval."""
+        self.sync_thread = QtCore.QThread()
+        self.sync_worker = SyncWorker(replica, replica.server_config.sync_interval)
+        self.sync_worker.moveToThread(self.sync_thread)
+        self.sync_thread.started.connect(self.sync_worker.start)
+        self.sync_worker.synced.connect(self.on_synced)
+        self.sync_thread.finished.connect(self.sync_worker.deleteLater)
+        self.sync_thread.start()
+
+    def start_change_feed(self) -> None:
+        """Reads the change log on a worker thread every CHANGE_FEED_INTERVAL, publishing the writes of the other workstations."""
+        self.change_feed_thread = QtCore.QThread()
+        self.change_feed_worker = ChangeFeedWorker(CHANGE_FEED_INTERVAL)
+        self.change_feed_worker.moveToThread(self.change_feed_thread)
+        self.change_feed_thread.started.connect(self.change_feed_worker.start)
+        self.change_feed_thread.finished.connect(self.change_feed_worker.deleteLater)
+        self.change_feed_thread.start()
+
+    def sync_now(self) -> None:
+        QtCore.QMetaObject.invokeMethod(self.sync_worker, "sync", QtCore.Qt.QueuedConnection)
+
+    def on_synced(self, result: offlinesync.SyncResult) -> None:
+        """Shows the state of the replica, and reloads the search tables if the sync changed it."""
+        if result.pulled or result.renumbered:
+            # Pulled rows keep the database's date_modified, older than the tables' last refresh, so the tables reload in full.
+            database.global_session.expire_all()
+            self.loaded_tabs.clear()
+            self.load_visible_tab()
+
+        if not result.online:
+            text = f"Offline, {result.pending} changes waiting"
+        elif result.conflicts:
+            text = f"{result.conflicts} sync conflicts"
+        else:
+            text = f"Synced at {datetime.datetime.now():%H:%M}"
+        self.sync_status_label.setText(text)
+        self.sync_status_label.setToolTip(result.error or "")
+
+    def resolve_sync_conflicts(self) -> None:
+        """Asks which version to keep of every row changed both here and in the database."""
+        replica = offlinesync.active_replica
+        conflicts = replica.conflicts()
+        if not conflicts:
+            QtWidgets.QMessageBox.information(self, "Resolve Sync Conflicts", "There are no sync conflicts.")
+            return
+
+        for conflict in conflicts:
+            answer = QtWidgets.QMessageBox.question(
+                self, "Resolve Sync Conflicts",
+                f"{conflict.table_name} {', '.join(str(value) for value in conflict.row_key)}: {conflict.message}\n\n"
+                "Keep the changes made here? No keeps the database's version.",
+                QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No | QtWidgets.QMessageBox.Cancel)
+            if answer == QtWidgets.QMessageBox.Cancel: break
+            try:
+                replica.resolve(conflict, keep_local=answer == QtWidgets.QMessageBox.Yes)
+            except Exception as error:
+                self.show_error(error)
+                return
+        self.sync_now()
+
+    def show_crew_currency(self) -> None:
+        """Shows the logbook hours and currency of every active crew member."""
+        stats = crewstats.all_stats()
+        active = {crew_member_id for crew_member_id, in database.global_session.query(database.CrewMember.id).filter(database.CrewMember.active == True)}
+        lines = []
+        for member in sorted((member for member in stats.values() if member.crew_member_id in active), key=lambda member: member.name):
+            currency = "current" if member.current else "NOT CURRENT"
+            night_currency = "night current" if member.night_current else "not night current"
+            lines.append(f"{member.name}: {member.hours} h, {member.flights} flights, {member.recent_flights} in the last 90 days ({currency}, {night_currency})")
+        if not lines:
+            QtWidgets.QMessageBox.information(self, "Crew Currency", "There are no active crew members.")
+            return
+        QtWidgets.QMessageBox.information(self, "Crew Currency", "\n".join(lines))
+
+    def show_document_compliance(self) -> None:
+        """Shows the required crew documents that are missing, expired or expire soon."""
+        issues = compliance.scan()
+        if not issues:
+            QtWidgets.QMessageBox.information(self, "Document Compliance", "Every crew member has the documents their roles require.")
+            return
+        QtWidgets.QMessageBox.warning(self, "Document Compliance", "\n".join(str(issue) for issue in issues))
+
+    def export_weight_audit(self) -> None:
+        """Writes every overweight flight to a CSV file."""
+        overweight = weightbalance.audit()
+        if not overweight:
+            QtWidgets.QMessageBox.information(self, "Weight Audit", "No flight is over its drone's max payload weight.")
+            return
+
+        file_path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export Weight Audit", "weight_audit.csv", "CSV Files (*.csv)")
+        if not file_path: return
+        try:
+            weightbalance.write_audit_csv(overweight, file_path)
+        except OSError as error:
+            self.show_error(error)
+            return
+        self.statusBar().showMessage(f"Weight audit exported. {len(overweight)} overweight flights.", 10000)
+
     def add_flight(self) -> None:
         """Opens a dialog box to add a new flight."""
         return
@@ -1266,8 +1673,103 @@ class MainWindow(Ui_MainWindow):
         flight = dialog.flight
         if flight is None: return
         self.reload_flight_form(flight)
-        self.reload_flight_search_table()
     
+    def import_telemetry_logs(self) -> None:
+        """Creates or updates the flights of a drone from a folder of telemetry logs."""
+        folder_path = QtWidgets.QFileDialog.getExistingDirectory(self, "Select Telemetry Log Folder")
+        if not folder_path: return
+
+        drones = [drone.combobox_name for drone in database.global_session.query(database.Drone).all()]
+        drone_name, ok = QtWidgets.QInputDialog.getItem(self, "Import Telemetry Logs", "Drone:", drones, editable=False)
+        if not ok: return
+        flight_types = [flight_type.name for flight_type in database.global_session.query(database.FlightType).all()]
+        flight_type_name, ok = QtWidgets.QInputDialog.getItem(self, "Import Telemetry Logs", "Flight Type:", flight_types, editable=False)
+        if not ok: return
+
+        self.statusBar().showMessage("Importing telemetry logs...")
+        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            result = telemetry.ingest_directory(folder_path, database.Drone.find_by_combobox_name(drone_name), database.FlightType.find_by_name(flight_type_name))
+        except MissingRequiredSoftwareError as error:
+            self.statusBar().clearMessage()
+            self.show_error(error)
+            return
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
+        self.refresh_search_table(self.flight_tab)
+        message = f"Telemetry import complete. {result.created} flights created, {result.updated} flights updated."
+        if result.failed:
+            message += f" {len(result.failed)} logs could not be read."
+        self.statusBar().showMessage(message, 10000)
+
+    def export_fleet_report(self) -> None:
+        """Writes the fleet's utilization and cost over the last twelve months to a CSV file."""
+        file_path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export Fleet Report", "fleet_report.csv", "CSV Files (*.csv)")
+        if not file_path: return
+
+        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            fleet_report = reports.fleet_report(months=12)
+            reports.write_csv(fleet_report, file_path)
+        except OSError as error:
+            self.show_error(error)
+            return
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
+        hours = sum(report.hours for report in fleet_report)
+        self.statusBar().showMessage(f"Fleet report exported. {round(hours, 2)} flight hours over 12 months.", 10000)
+
+    def backfill_weather(self) -> None:
+        """Attaches weather from a folder of METAR or CSV weather archives to every flight without any."""
+        folder_path = QtWidgets.QFileDialog.getExistingDirectory(self, "Select Weather Archive Folder")
+        if not folder_path: return
+
+        self.statusBar().showMessage("Backfilling weather...")
+        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            result = weatherprovider.backfill(weatherprovider.WeatherProvider(weatherprovider.open_archive(folder_path)))
+        except WeatherSourceError as error:
+            self.statusBar().clearMessage()
+            self.show_error(error)
+            return
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
+        if getattr(self, "selected_flight", None) is not None:
+            self.reload_flight_form(self.selected_flight)
+        message = f"Weather backfill complete. {result.filled} flights filled."
+        if result.no_observation:
+            message += f" {result.no_observation} flights had no observation nearby."
+        if result.no_location:
+            message += f" {result.no_location} flights have no location."
+        self.statusBar().showMessage(message, 10000)
+
+    def import_charge_log(self) -> None:
+        """Logs the charge sessions of a smart charger's report."""
+        file_path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Select Charge Log", "", "Charge Logs (*.csv *.xlsx *.xlsm)")
+        if not file_path: return
+
+        self.statusBar().showMessage("Importing charge log...")
+        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            result = chargelog.ingest_file(file_path)
+        except MissingRequiredSoftwareError as error:
+            self.statusBar().clearMessage()
+            self.show_error(error)
+            return
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
+        self.refresh_search_table(self.batteries_tab)
+        message = f"Charge log import complete. {result.added} charges logged, {result.duplicates} already logged."
+        if result.unknown_serial_numbers:
+            message += f" {len(result.unknown_serial_numbers)} unknown batteries."
+        if result.rejected:
+            message += f" {len(result.rejected)} rows could not be read."
+        self.statusBar().showMessage(message, 10000)
+
     def delete_drone(self) -> None:
         """Deletes the selected drone."""
         if not self.selected_drone: return
@@ -1285,7 +1787,6 @@ class MainWindow(Ui_MainWindow):
         try:
             self.selected_drone.delete()
             self.reload_drone_form(None)
-            self.reload_drone_search_table()
         except database.Error as e:
             self.show_error(e)
             return
@@ -1306,7 +1807,6 @@ class MainWindow(Ui_MainWindow):
         try:
             self.selected_battery.delete()
             self.reload_battery_form(None)
-            self.reload_battery_search_table()
         except database.Error as e:
             self.show_error(e)
             return
@@ -1326,7 +1826,6 @@ class MainWindow(Ui_MainWindow):
         try:
             self.selected_equipment.delete()
             self.reload_equipment_form(None)
-            self.reload_equipment_search_table()
         except database.Error as e:
             self.show_error(e)
             return
@@ -1346,7 +1845,6 @@ class MainWindow(Ui_MainWindow):
         try:
             self.selected_flight_controller.delete()
             self.reload_flight_controller_form(None)
-            self.reload_flight_controller_search_table()
         except database.Error as e:
             self.show_error(e)
             return
@@ -1367,18 +1865,90 @@ class MainWindow(Ui_MainWindow):
         try:
             self.selected_flight.delete()
             self.reload_flight_form(None)
-            self.reload_flight_search_table()
         except database.Error as e:
             self.show_error(e)
             return
 
 
+class SyncWorker(QtCore.QObject):
+    """Syncs the replica with the database on the thread it is moved to, every interval and when sync is invoked."""
+    synced = QtCore.pyqtSignal(object)
+
+    def __init__(self, replica: offlinesync.Replica, interval: int):
+        """
+        Args:
+            interval (int): Seconds between two syncs.
+        """
+        super().__init__()
+        self.replica = replica
+        self.interval = interval
+        self.timer = None # type: QtCore.QTimer
+
+    def start(self) -> None:
+        # Created here so the timer belongs to the worker's thread.
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.sync)
+        self.timer.start(self.interval * 1000)
+        self.sync()
+
+    @QtCore.pyqtSlot()
+    def sync(self) -> None:
+        try:
+            result = self.replica.sync()
+        except Exception as error:
+            result = offlinesync.SyncResult(online=False, error=str(error))
+            result.pending, result.conflicts = self.replica.counts()
+        self.synced.emit(result)
+
+
+class ChangeFeedWorker(QtCore.QObject):
+    """Reads the change log on the thread it is moved to every interval, and publishes the writes of the other workstations."""
+
+    def __init__(self, interval: int):
+        """
+        Args:
+            interval (int): Seconds between two reads.
+        """
+        super().__init__()
+        self.interval = interval
+        self.timer = None # type: QtCore.QTimer
+        self.cursor = database.ChangeLogCursor()
+        self.pruned_at = None # type: datetime.datetime
+
+    def start(self) -> None:
+        self.cursor = database.ChangeLogCursor(database.ChangeLog.latest_id())
+        self.pruned_at = datetime.datetime.now()
+        database.global_session.remove()
+        # Created here so the timer belongs to the worker's thread.
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.poll)
+        self.timer.start(self.interval * 1000)
+
+    @QtCore.pyqtSlot()
+    def poll(self) -> None:
+        now = datetime.datetime.now()
+        try:
+            entries = database.ChangeLog.since(self.cursor)
+            ids = [entry.id for entry in entries]
+            changes = [entry.change_event for entry in entries if entry.client_id != events.CLIENT_ID]
+            if now - self.pruned_at > datetime.timedelta(hours=1):
+                database.ChangeLog.prune(now - CHANGE_LOG_RETENTION)
+                self.pruned_at = now
+        except SQLAlchemyError:
+            # The database can not be reached, the entries are read on the next poll.
+            return
+        finally:
+            database.global_session.remove()
+        self.cursor.advance(ids, now)
+        events.publish(changes)
+
+
 class SplashScreen(QtWidgets.QWidget):
     closing = QtCore.pyqtSignal()
 
     def __init__(self):
         super().__init__()
-        self.setWindowTitle('Splash Screen Example')
+        self.setWindowTitle(PROGRAM_NAME)
         self.setFixedSize(600, 300)
         self.setWindowFlag(QtCore.Qt.FramelessWindowHint)
         self.setAttribute(QtCore.Qt.WA_TranslucentBackground)
@@ -1433,14 +2003,14 @@ class SplashScreen(QtWidgets.QWidget):
         self.labelTitle.setObjectName('LabelTitle')
         
         # center labels
-        self.labelTitle.setText('Splash Screen')
+        self.labelTitle.setText(PROGRAM_NAME)
         self.labelTitle.setAlignment(QtCore.Qt.AlignCenter)
         v_layout.addWidget(self.labelTitle)
 
 
         self.labelDescription = QtWidgets.QLabel(self.frame)
         self.labelDescription.setObjectName('LabelDesc')
-        self.labelDescription.setText('<strong>Working on Task #1</strong>')
+        self.labelDescription.setText('<strong>Starting</strong>')
         self.labelDescription.setAlignment(QtCore.Qt.AlignCenter)
         v_layout.addWidget(self.labelDescription)
 
@@ -1449,7 +2019,7 @@ class SplashScreen(QtWidgets.QWidget):
         self.progressBar.setFormat('%p%')
         self.progressBar.setTextVisible(True)
         self.progressBar.setRange(0, 100)
-        self.progressBar.setValue(20)
+        self.progressBar.setValue(0)
         v_layout.addWidget(self.progressBar)
 
         self.labelLoading = QtWidgets.QLabel(self.frame)
@@ -1460,27 +2030,53 @@ class SplashScreen(QtWidgets.QWidget):
 
         self.frame.setLayout(v_layout)
 
-    def loading(self):
-        self.progressBar.setValue(0)
-        # database.force_recreate()
-        self.closing.emit()
-        self.close()
+    def set_progress(self, value: int, text: str) -> None:
+        """Shows the progress of the startup and the stage running."""
+        self.progressBar.setValue(value)
+        self.labelDescription.setText(f'<strong>{text}</strong>')
+        QtWidgets.QApplication.processEvents()
 
 
 class Application(QtWidgets.QApplication):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.start_time = time.perf_counter()
+        self.main_window = None # type: MainWindow
 
-        self.main_window = MainWindow()
-        self.aboutToQuit.connect(self.main_window.closeEvent)
-
-        # TODO: Work on splash screen
         self.splash = SplashScreen()
-        # self.splash.closing.connect(lambda: self.main_window.show())
-        self.splash.closing.connect(lambda: self.main_window.showMaximized())
         self.splash.show()
-        self.splash.loading()
-        
+
+        # The stages run on a worker thread so the splash screen keeps painting while the database is slow to answer.
+        self.startup_thread = QtCore.QThread()
+        self.startup_worker = startup.StartupWorker(STARTUP_STAGES, progress_range=80)
+        self.startup_worker.moveToThread(self.startup_thread)
+        self.startup_thread.started.connect(self.startup_worker.run)
+        self.startup_worker.progress.connect(self.splash.set_progress)
+        self.startup_worker.finished.connect(self.on_startup_finished)
+        self.startup_worker.failed.connect(self.on_startup_failed)
+        self.startup_thread.start()
+
+    def _stop_startup_thread(self) -> None:
+        self.startup_thread.quit()
+        self.startup_thread.wait()
+
+    def on_startup_finished(self, result: startup.StartupResult) -> None:
+        self._stop_startup_thread()
+        self.splash.set_progress(90, "Loading first tab")
+        self.main_window = MainWindow(result.results.get("Loading reference data"))
+        self.aboutToQuit.connect(self.main_window.closeEvent)
+        self.main_window.showMaximized()
+        self.splash.closing.emit()
+        self.splash.close()
+
+        timings = ", ".join(f"{name} {seconds:.2f} s" for name, seconds in result.timings.items())
+        self.main_window.statusBar().showMessage(f"Ready in {time.perf_counter() - self.start_time:.2f} s ({timings})", 10000)
+
+    def on_startup_failed(self, message: str) -> None:
+        self._stop_startup_thread()
+        self.splash.close()
+        QtWidgets.QMessageBox.critical(None, PROGRAM_NAME, message)
+        self.quit()
 
 
 if __name__ == "__main__":
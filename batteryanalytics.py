@@ -0,0 +1,297 @@
+"""Battery health analytics for the whole inventory: wear, end of life forecasts, outliers and rotation order."""
+from __future__ import annotations
+import datetime
+import threading
+from dataclasses import dataclass, field
+
+from sqlalchemy import case, func
+
+from database import global_session, Airworthyness, Battery, BatteryChargeEvent, BatteryChemistry, BatteryToDrone, Drone, Flight
+from errors import MissingRequiredSoftwareError
+import events
+
+numpy = None
+"""Imported by _check_numpy when the analytics are first computed."""
+
+
+USAGE_WINDOW = datetime.timedelta(weeks=12)
+"""Recent period the usage rates are measured over."""
+CALENDAR_LIFE = {
+    "Li-Ion": 4.0,
+    "Li-Po": 3.0,
+    "NiCd": 5.0,
+    "NiMH": 4.0,
+}
+"""Expected calendar life in years by chemistry code."""
+DEFAULT_CALENDAR_LIFE = 3.0
+OUTLIER_SCORE = 3.5
+"""Modified z-score above which a battery is flagged as an outlier."""
+IDLE_TIME = datetime.timedelta(weeks=26)
+"""Airworthy batteries not flown for this long are flagged, packs degrade in storage."""
+
+
+@dataclass
+class BatteryHealth:
+    """Health and forecast of a single battery."""
+    battery_id: int
+    serial_number: str
+    name: str
+    status: str
+    charge_cycles: int
+    total_flights: int
+    total_flight_time: float
+    """Flight time in minutes."""
+    last_used: datetime.datetime
+    age: float
+    """Age in years from the purchase date."""
+    flights_per_week: float
+    minutes_per_week: float
+    health: float
+    """Remaining life in percent, from whichever of charge cycles, flights and calendar life is closest to its limit."""
+    end_of_life_date: datetime.datetime
+    """Projected date the battery reaches its first limit at its current usage."""
+    end_of_life_reason: str
+    max_flight_time: int
+    """Maximum flight time per charge in minutes."""
+    outlier_reasons: list[str] = field(default_factory=list)
+    rotation_rank: int = None
+    """Position in the rotation order, 1 being the next battery to fly. None if the battery is not airworthy or is past its end of life."""
+
+    @property
+    def outlier(self) -> bool:
+        return bool(self.outlier_reasons)
+
+    @property
+    def airworthy(self) -> bool:
+        return self.status in (None, Airworthyness.Airworthy.value)
+
+    @property
+    def end_of_life(self) -> bool:
+        """Whether the battery reached one of its limits. It can still fly until it is retired, but is left out of the rotation."""
+        return self.health <= 0
+
+    @property
+    def combobox_name(self) -> str:
+        """Same as Battery.combobox_name."""
+        return f"[{self.serial_number}] - {self.name}"
+
+
+_cache = None # type: dict[int, BatteryHealth]
+_cache_date = None # type: datetime.date
+"""Day the cache was computed, the ages and usage rates are recomputed every day."""
+_drone_batteries = None # type: dict[int, list[int]]
+"""Ids of the batteries linked to each drone, by drone id."""
+
+
+_lock = threading.Lock()
+"""Guards the caches, the analytics are served to several threads."""
+
+
+def invalidate() -> None:
+    """Drops the cached analytics and battery links, they are reloaded on the next request.
+        Committed writes to batteries, charge events, drones and flights invalidate automatically, those of the other workstations included,
+        bulk writes have to call this. A drone's battery links change along with the drone.
+    """
+    global _cache, _drone_batteries
+    with _lock:
+        _cache = None
+        _drone_batteries = None
+
+
+events.call_on_change([model.__tablename__ for model in (Battery, BatteryChargeEvent, BatteryChemistry, Drone, Flight)], invalidate)
+
+
+def _check_numpy() -> None:
+    """Imports numpy on first use, it is slow to import."""
+    global numpy
+    if numpy is not None: return
+    try:
+        import numpy
+    except ImportError:
+        raise MissingRequiredSoftwareError("Missing required python package numpy. Please install it to use battery analytics.")
+
+
+def _robust_scores(values: numpy.ndarray) -> numpy.ndarray:
+    """Returns the modified z-scores of values, based on the median absolute deviation."""
+    if len(values) == 0: return values
+    median = numpy.median(values)
+    deviation = numpy.median(numpy.abs(values - median))
+    if deviation == 0:
+        deviation = numpy.mean(numpy.abs(values - median)) / 0.7979
+    if deviation == 0:
+        return numpy.zeros(len(values))
+    return 0.6745 * (values - median) / deviation
+
+
+def _compute(now: datetime.datetime) -> dict[int, BatteryHealth]:
+    batteries = global_session.query(Battery.id, Battery.serial_number, Battery.name, Battery.status, Battery.charge_cycle_count,
+                                     Battery.max_charge_cycles, Battery.max_flights, Battery.max_flight_time, Battery.purchase_date,
+                                     Battery.cell_count, BatteryChemistry.code, BatteryChemistry.safe_min_cell_voltage)\
+        .join(BatteryChemistry, Battery.chemistry_id == BatteryChemistry.id)\
+        .order_by(Battery.id)\
+        .all()
+    if not batteries: return {}
+
+    window_start = now - USAGE_WINDOW
+    in_window = Flight.date >= window_start
+    below_safe_voltage = Flight.min_battery_voltage < BatteryChemistry.safe_min_cell_voltage * Battery.cell_count
+    usage = global_session.query(
+            Flight.battery_id,
+            func.count(Flight.id),
+            func.coalesce(func.sum(Flight.duration), 0),
+            func.max(Flight.date),
+            func.coalesce(func.sum(case((in_window, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((in_window, Flight.duration), else_=0)), 0),
+            func.coalesce(func.sum(case((below_safe_voltage, 1), else_=0)), 0),
+        )\
+        .join(Battery, Flight.battery_id == Battery.id)\
+        .join(BatteryChemistry, Battery.chemistry_id == BatteryChemistry.id)\
+        .filter(Flight.active == True)\
+        .group_by(Flight.battery_id)
+    usage = {row[0]: row[1:] for row in usage}
+    empty_usage = (0, 0, None, 0, 0, 0)
+    rows = [usage.get(battery.id, empty_usage) for battery in batteries]
+
+    charge_cycles = numpy.array([battery.charge_cycle_count or 0 for battery in batteries], dtype=float)
+    max_charge_cycles = numpy.array([battery.max_charge_cycles or 1 for battery in batteries], dtype=float)
+    max_flights = numpy.array([battery.max_flights or 1 for battery in batteries], dtype=float)
+    calendar_life = numpy.array([CALENDAR_LIFE.get(battery.code, DEFAULT_CALENDAR_LIFE) for battery in batteries]) * 52
+    age = numpy.array([(now - (battery.purchase_date or now)).days / 7 for battery in batteries], dtype=float)
+    total_flights = numpy.array([row[0] for row in rows], dtype=float)
+    total_minutes = numpy.array([row[1] for row in rows], dtype=float)
+    recent_flights = numpy.array([row[3] for row in rows], dtype=float)
+    recent_minutes = numpy.array([row[4] for row in rows], dtype=float)
+    deep_discharges = numpy.array([row[5] for row in rows], dtype=int)
+    last_used = [row[2] for row in rows]
+
+    # Usage rates over the recent window, or over the battery's life if it is younger than the window.
+    weeks = numpy.clip(numpy.minimum(age, USAGE_WINDOW.days / 7), 1, None)
+    flights_per_week = recent_flights / weeks
+    minutes_per_week = recent_minutes / weeks
+    # Batteries without a logged charge are assumed to be charged once per flight.
+    cycles_per_week = numpy.where(charge_cycles > 0, charge_cycles / numpy.clip(age, 1, None), flights_per_week)
+
+    wear = numpy.stack([charge_cycles / max_charge_cycles, total_flights / max_flights, age / calendar_life])
+    health = numpy.clip(1 - wear.max(axis=0), 0, 1) * 100
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        weeks_left = numpy.stack([
+            numpy.where(cycles_per_week > 0, (max_charge_cycles - charge_cycles) / cycles_per_week, numpy.inf),
+            numpy.where(flights_per_week > 0, (max_flights - total_flights) / flights_per_week, numpy.inf),
+            calendar_life - age,
+        ])
+    weeks_left = numpy.clip(weeks_left, 0, None)
+    end_of_life_reason = weeks_left.argmin(axis=0)
+    end_of_life_weeks = weeks_left.min(axis=0)
+    reason_names = ["charge cycles", "flights", "calendar life"]
+
+    heavy_use = _robust_scores(minutes_per_week) > OUTLIER_SCORE
+    fast_wear = _robust_scores(wear.max(axis=0) / numpy.clip(age, 1, None)) > OUTLIER_SCORE
+
+    airworthy = numpy.array([battery.status in (None, Airworthyness.Airworthy.value) for battery in batteries])
+    can_fly = airworthy & (health > 0)
+    # Least worn first, ties broken by the longest rested.
+    rested = numpy.array([-(now - used).total_seconds() if used else -numpy.inf for used in last_used])
+    order = [index for index in numpy.lexsort((rested, wear.max(axis=0))) if can_fly[index]]
+    ranks = {int(index): rank for rank, index in enumerate(order, start=1)}
+
+    results = {}
+    for index, battery in enumerate(batteries):
+        outlier_reasons = []
+        if heavy_use[index]:
+            outlier_reasons.append("Flown far more than the rest of the fleet.")
+        if fast_wear[index]:
+            outlier_reasons.append("Wearing out faster than the rest of the fleet.")
+        if deep_discharges[index]:
+            outlier_reasons.append(f"Discharged below the safe minimum voltage on {deep_discharges[index]} flights.")
+        if airworthy[index] and last_used[index] is not None and now - last_used[index] > IDLE_TIME:
+            outlier_reasons.append("Not flown in over six months.")
+
+        weeks_to_end = end_of_life_weeks[index]
+        results[battery.id] = BatteryHealth(
+            battery_id=battery.id,
+            serial_number=battery.serial_number,
+            name=battery.name,
+            status=battery.status,
+            charge_cycles=int(charge_cycles[index]),
+            total_flights=int(total_flights[index]),
+            total_flight_time=float(total_minutes[index]),
+            last_used=last_used[index],
+            age=round(float(age[index]) / 52, 2),
+            flights_per_week=round(float(flights_per_week[index]), 2),
+            minutes_per_week=round(float(minutes_per_week[index]), 2),
+            health=round(float(health[index]), 1),
+            end_of_life_date=now + datetime.timedelta(weeks=float(weeks_to_end)) if numpy.isfinite(weeks_to_end) else None,
+            end_of_life_reason=reason_names[end_of_life_reason[index]],
+            max_flight_time=battery.max_flight_time,
+            outlier_reasons=outlier_reasons,
+            rotation_rank=ranks.get(index),
+        )
+    return results
+
+
+def analyze() -> dict[int, BatteryHealth]:
+    """Returns the health of every battery by battery id, computed in one batch and cached until flights or batteries change, or the day ends.
+
+    Raises:
+        MissingRequiredSoftwareError: If numpy is not installed.
+    """
+    global _cache, _cache_date
+    _check_numpy()
+    now = datetime.datetime.now()
+    with _lock:
+        if _cache is None or _cache_date != now.date():
+            _cache = _compute(now)
+            _cache_date = now.date()
+        return _cache
+
+
+def battery_health(battery: Battery) -> BatteryHealth:
+    """Returns the health of a single battery."""
+    return analyze().get(battery.id)
+
+
+def rotation_order() -> list[BatteryHealth]:
+    """Returns the batteries that can fly, the one that should fly next first."""
+    return sorted((health for health in analyze().values() if health.rotation_rank is not None), key=lambda health: health.rotation_rank)
+
+
+def find_outliers() -> list[BatteryHealth]:
+    """Returns the batteries flagged as outliers, least healthy first."""
+    return sorted((health for health in analyze().values() if health.outlier), key=lambda health: health.health)
+
+
+def drone_battery_ids(drone: Drone) -> list[int]:
+    """Returns the ids of the batteries linked to a drone, from a map of every drone's batteries loaded once."""
+    global _drone_batteries
+    with _lock:
+        if _drone_batteries is None:
+            drone_batteries = {} # type: dict[int, list[int]]
+            for drone_id, battery_id in global_session.query(BatteryToDrone.drone_id, BatteryToDrone.battery_id):
+                drone_batteries.setdefault(drone_id, []).append(battery_id)
+            _drone_batteries = drone_batteries
+        return _drone_batteries.get(drone.id, [])
+
+
+def recommend_batteries(drone: Drone, planned_duration: float=None) -> list[BatteryHealth]:
+    """Ranks the batteries a drone can fly with to even out wear. Served from the cached analytics, so no query runs once they are loaded.
+
+    Args:
+        drone (Drone): The drone of the flight.
+        planned_duration (float, Optional): The planned flight time in minutes. Batteries with a shorter max flight time are ranked after the others.
+
+    Raises:
+        MissingRequiredSoftwareError: If numpy is not installed.
+
+    Returns:
+        list[BatteryHealth]: Every airworthy battery linked to the drone, the recommended one first. Batteries past their end of life,
+            which are out of the rotation, come last.
+    """
+    health = analyze()
+    candidates = [health[battery_id] for battery_id in drone_battery_ids(drone) if battery_id in health and health[battery_id].airworthy]
+
+    def key(battery: BatteryHealth) -> tuple:
+        too_short = bool(planned_duration) and (battery.max_flight_time or 0) < planned_duration
+        return (battery.rotation_rank is None, too_short, battery.rotation_rank or 0, battery.serial_number)
+
+    return sorted(candidates, key=key)
@@ -0,0 +1,498 @@
+"""Bulk import of batteries, equipment, flight controllers, drones and flights from CSV or Excel files."""
+from __future__ import annotations
+import csv
+import datetime
+import os
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import (global_session, generate_unique_string, log_bulk_write, Airworthyness, Battery, BatteryChemistry, BatteryToDrone, Drone, DroneFlightTime, DroneGeometry, Equipment,
+                      EquipmentType, Flight, FlightController, FlightStatus, FlightType, LegalRule)
+from errors import MissingRequiredSoftwareError, ImportRowError
+import geo
+
+openpyxl = None
+"""Imported by read_rows when the first Excel file is read."""
+
+
+BATCH_SIZE = 1000
+"""Number of rows inserted per transaction."""
+DATE_FORMATS = ["%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%m/%d/%Y", "%m/%d/%Y %H:%M"]
+LIST_SEPARATOR = ";"
+"""Separator used for columns holding more than one value, like the batteries of a drone."""
+
+
+def to_text(value: Any) -> str:
+    return str(value).strip()
+
+def to_float(value: Any) -> float:
+    return float(value)
+
+def to_int(value: Any) -> int:
+    return int(float(value))
+
+def to_bool(value: Any) -> bool:
+    if isinstance(value, bool): return value
+    return str(value).strip().lower() in ("1", "true", "yes", "y", "x")
+
+def to_datetime(value: Any, utc: bool = False) -> datetime.datetime:
+    """Parses a date into a local datetime. With utc, a value without an offset is taken as UTC instead of local."""
+    if isinstance(value, datetime.datetime): parsed = value
+    elif isinstance(value, datetime.date): return datetime.datetime(value.year, value.month, value.day)
+    else:
+        text = str(value).strip()
+        parsed = None
+        for date_format in DATE_FORMATS:
+            try:
+                parsed = datetime.datetime.strptime(text, date_format)
+                break
+            except ValueError:
+                continue
+        if parsed is None:
+            try:
+                # ISO 8601 with fractional seconds or an offset, which the formats above do not cover.
+                parsed = datetime.datetime.fromisoformat(text)
+            except ValueError:
+                raise ValueError(f"Unknown date format '{text}'.") from None
+    if parsed.tzinfo is None and utc:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed if parsed.tzinfo is None else parsed.astimezone().replace(tzinfo=None)
+
+def to_list(value: Any) -> list[str]:
+    return [item.strip() for item in str(value).split(LIST_SEPARATOR) if item.strip()]
+
+
+@dataclass
+class ImportSpec:
+    """Describes how the columns of a source file map to the fields of a record type."""
+    record_type: str
+    """One of the keys of IMPORTERS."""
+    columns: dict[str, str] = None
+    """Maps a field name to the column header in the source file. Defaults to headers matching the field names."""
+    sheet_name: str = None
+    """The worksheet to read from Excel files. Defaults to the active sheet."""
+
+    def column_for(self, field_name: str) -> str:
+        if self.columns is None:
+            return field_name
+        return self.columns.get(field_name)
+
+
+@dataclass
+class RejectedRow:
+    row_number: int
+    """The row number in the source file, the header being row 1."""
+    reason: str
+    data: dict
+
+
+@dataclass
+class ImportResult:
+    record_type: str
+    imported: int = 0
+    rejected: list[RejectedRow] = field(default_factory=list)
+
+    @property
+    def total_rows(self) -> int:
+        return self.imported + len(self.rejected)
+
+    def write_rejected_report(self, file_path: str) -> None:
+        """Writes the rejected rows, with the reason they were rejected, to a CSV file."""
+        headers = [] # type: list[str]
+        for rejected_row in self.rejected:
+            for header in rejected_row.data:
+                if header not in headers:
+                    headers.append(header)
+
+        with open(file_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Row", "Reason"] + headers)
+            for rejected_row in self.rejected:
+                writer.writerow([rejected_row.row_number, rejected_row.reason] + [rejected_row.data.get(header, "") for header in headers])
+
+
+def read_rows(file_path: str, sheet_name: str=None) -> Iterator[dict]:
+    """Streams the rows of a CSV or Excel file as dicts keyed by column header."""
+    global openpyxl
+    extension = os.path.splitext(file_path)[1].lower()
+
+    if extension in (".xlsx", ".xlsm"):
+        if openpyxl is None:
+            try:
+                import openpyxl
+            except ImportError:
+                raise MissingRequiredSoftwareError("Missing required python package openpyxl. Please install it to import Excel files.")
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            sheet = workbook[sheet_name] if sheet_name else workbook.active
+            rows = sheet.iter_rows(values_only=True)
+            headers = [str(header).strip() if header is not None else "" for header in next(rows, [])]
+            for row in rows:
+                yield {header: value for header, value in zip(headers, row)}
+        finally:
+            workbook.close()
+        return
+
+    with open(file_path, "r", newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            yield row
+
+
+class RecordImporter:
+    """Base class for importing one type of record.
+        Lookups and uniqueness checks are resolved against maps loaded once in `preload`, so rows never query the database.
+    """
+    model = None
+    fields = {} # type: dict[str, Callable[[Any], Any]]
+    """Maps the importable fields to their converter."""
+    required = [] # type: list[str]
+    """Fields that must have a value."""
+    serial_numbers = None # type: set[str]
+    """Serial numbers in the database and reserved by the rows built so far, for record types that have one."""
+
+    def __init__(self, spec: ImportSpec):
+        self.spec = spec
+
+    def preload(self) -> None:
+        """Loads the key sets and lookup maps used to validate rows."""
+        pass
+
+    def values(self, row: dict) -> dict:
+        """Converts the mapped columns of a row, skipping blank cells."""
+        values = {}
+        for field_name, converter in self.fields.items():
+            column = self.spec.column_for(field_name)
+            if column is None: continue
+            raw_value = row.get(column)
+            if raw_value is None or (isinstance(raw_value, str) and raw_value.strip() == ""):
+                continue
+            try:
+                values[field_name] = converter(raw_value)
+            except (TypeError, ValueError):
+                raise ImportRowError(f"Invalid value '{raw_value}' for {field_name}.")
+
+        for field_name in self.required:
+            if field_name not in values:
+                raise ImportRowError(f"Missing required value for {field_name}.")
+        return values
+
+    def build(self, values: dict) -> dict:
+        """Validates the converted values of a row and returns the mapping to insert."""
+        raise NotImplementedError()
+
+    def insert(self, mappings: list[dict]) -> None:
+        """Inserts a batch of mappings. Does not commit."""
+        global_session.bulk_insert_mappings(self.model, mappings)
+
+    def release(self, mappings: list[dict]) -> None:
+        """Frees what build reserved for the mappings of a batch that was rolled back, so the rows after it can use it."""
+        if self.serial_numbers is not None:
+            self.serial_numbers.difference_update(mapping["serial_number"] for mapping in mappings)
+
+    def finish(self) -> None:
+        """Called once every batch is inserted, if any row was. Bulk inserts skip the session hooks, so the tables written are logged whole."""
+        log_bulk_write([self.model])
+
+    @staticmethod
+    def _lookup(lookup: dict, key: str, name: str):
+        result = lookup.get(key.lower())
+        if result is None:
+            raise ImportRowError(f"Unknown {name} '{key}'.")
+        return result
+
+    @staticmethod
+    def _serial_numbers(model) -> set[str]:
+        return {serial_number for serial_number, in global_session.query(model.serial_number) if serial_number is not None}
+
+    @staticmethod
+    def _check_unique(serial_number: str, serial_numbers: set[str]) -> None:
+        if serial_number in serial_numbers:
+            raise ImportRowError(f"Serial number {serial_number} already exists.")
+        serial_numbers.add(serial_number)
+
+    @staticmethod
+    def _check_status(values: dict) -> None:
+        if "status" in values and values["status"] not in Airworthyness.all():
+            raise ImportRowError(f"Unknown status '{values['status']}'.")
+
+
+class BatteryImporter(RecordImporter):
+    model = Battery
+    fields = {
+        "serial_number": to_text,
+        "name": to_text,
+        "chemistry": to_text,
+        "capacity": to_int,
+        "cell_count": to_int,
+        "charge_cycle_count": to_int,
+        "max_flight_time": to_int,
+        "max_charge_cycles": to_int,
+        "max_flights": to_int,
+        "weight": to_float,
+        "item_value": to_float,
+        "purchase_date": to_datetime,
+        "status": to_text,
+        "notes": to_text,
+    }
+    required = ["serial_number", "name", "capacity", "cell_count"]
+
+    def preload(self) -> None:
+        self.serial_numbers = self._serial_numbers(Battery)
+        self.chemistries = {}
+        for chemistry in global_session.query(BatteryChemistry):
+            self.chemistries[chemistry.name.lower()] = chemistry.id
+            self.chemistries[chemistry.code.lower()] = chemistry.id
+
+    def build(self, values: dict) -> dict:
+        self._check_status(values)
+        if "chemistry" in values:
+            values["chemistry_id"] = self._lookup(self.chemistries, values.pop("chemistry"), "battery chemistry")
+        self._check_unique(values["serial_number"], self.serial_numbers)
+        return values
+
+
+class EquipmentImporter(RecordImporter):
+    model = Equipment
+    fields = {
+        "serial_number": to_text,
+        "name": to_text,
+        "type": to_text,
+        "description": to_text,
+        "weight": to_float,
+        "item_value": to_float,
+        "purchase_date": to_datetime,
+        "status": to_text,
+    }
+    required = ["serial_number", "name", "type"]
+
+    def preload(self) -> None:
+        self.serial_numbers = self._serial_numbers(Equipment)
+        self.types = {type_.name.lower(): type_.id for type_ in global_session.query(EquipmentType)}
+
+    def build(self, values: dict) -> dict:
+        self._check_status(values)
+        values["type_id"] = self._lookup(self.types, values.pop("type"), "equipment type")
+        self._check_unique(values["serial_number"], self.serial_numbers)
+        return values
+
+
+class FlightControllerImporter(RecordImporter):
+    model = FlightController
+    fields = {
+        "serial_number": to_text,
+        "name": to_text,
+        "item_value": to_float,
+        "purchase_date": to_datetime,
+        "status": to_text,
+    }
+    required = ["serial_number", "name"]
+
+    def preload(self) -> None:
+        self.serial_numbers = self._serial_numbers(FlightController)
+
+    def build(self, values: dict) -> dict:
+        self._check_status(values)
+        self._check_unique(values["serial_number"], self.serial_numbers)
+        return values
+
+
+class DroneImporter(RecordImporter):
+    model = Drone
+    fields = {
+        "serial_number": to_text,
+        "name": to_text,
+        "geometry": to_text,
+        "flight_controller": to_text,
+        "batteries": to_list,
+        "brand": to_text,
+        "model": to_text,
+        "color": to_text,
+        "description": to_text,
+        "legal_id": to_text,
+        "item_value": to_float,
+        "max_payload_weight": to_float,
+        "max_service_interval": to_int,
+        "max_speed": to_float,
+        "max_vertical_speed": to_float,
+        "weight": to_float,
+        "purchase_date": to_datetime,
+        "status": to_text,
+    }
+    required = ["serial_number", "name", "geometry", "flight_controller", "batteries"]
+
+    def preload(self) -> None:
+        self.serial_numbers = self._serial_numbers(Drone)
+        self.geometries = {name.lower(): id_ for name, id_ in global_session.query(DroneGeometry.name, DroneGeometry.id)}
+        self.flight_controllers = {serial_number.lower(): id_ for serial_number, id_ in global_session.query(FlightController.serial_number, FlightController.id)}
+        self.assigned_flight_controllers = {id_ for id_, in global_session.query(Drone.flight_controller_id)}
+        self.batteries = {serial_number.lower(): id_ for serial_number, id_ in global_session.query(Battery.serial_number, Battery.id)}
+
+    def build(self, values: dict) -> dict:
+        self._check_status(values)
+        values["geometry_id"] = self._lookup(self.geometries, values.pop("geometry"), "drone geometry")
+        flight_controller_id = self._lookup(self.flight_controllers, values.pop("flight_controller"), "flight controller")
+        if flight_controller_id in self.assigned_flight_controllers:
+            raise ImportRowError("Flight controller is already assigned to a drone.")
+        values["flight_controller_id"] = flight_controller_id
+
+        battery_serial_numbers = values.pop("batteries")
+        if not battery_serial_numbers:
+            raise ImportRowError("Drone must have at least one battery.")
+        battery_ids = [self._lookup(self.batteries, serial_number, "battery") for serial_number in battery_serial_numbers]
+
+        self._check_unique(values["serial_number"], self.serial_numbers)
+        self.assigned_flight_controllers.add(flight_controller_id)
+        values["_battery_ids"] = battery_ids
+        return values
+
+    def insert(self, mappings: list[dict]) -> None:
+        battery_ids = [mapping.pop("_battery_ids") for mapping in mappings]
+        global_session.bulk_insert_mappings(Drone, mappings, return_defaults=True)
+        links = []
+        for mapping, ids in zip(mappings, battery_ids):
+            links.extend({"drone_id": mapping["id"], "battery_id": battery_id} for battery_id in dict.fromkeys(ids))
+        global_session.bulk_insert_mappings(BatteryToDrone, links)
+
+    def release(self, mappings: list[dict]) -> None:
+        super().release(mappings)
+        self.assigned_flight_controllers.difference_update(mapping["flight_controller_id"] for mapping in mappings)
+
+    def finish(self) -> None:
+        log_bulk_write([Drone, BatteryToDrone])
+
+
+class FlightImporter(RecordImporter):
+    model = Flight
+    fields = {
+        "drone": to_text,
+        "type": to_text,
+        "date": to_datetime,
+        "battery": to_text,
+        "status": to_text,
+        "legal_rule": to_text,
+        "name": to_text,
+        "duration": to_float,
+        "distance_traveled": to_float,
+        "max_agl_altitude": to_float,
+        "location_latitude": to_float,
+        "location_longitude": to_float,
+        "address": to_text,
+        "night_flight": to_bool,
+        "external_case_id": to_text,
+        "utm_authorization": to_text,
+        "notes": to_text,
+    }
+    required = ["drone", "type", "date"]
+
+    def preload(self) -> None:
+        self.drones = {serial_number.lower(): id_ for serial_number, id_ in global_session.query(Drone.serial_number, Drone.id)}
+        self.batteries = {serial_number.lower(): id_ for serial_number, id_ in global_session.query(Battery.serial_number, Battery.id)}
+        self.drone_batteries = {(drone_id, battery_id) for drone_id, battery_id in global_session.query(BatteryToDrone.drone_id, BatteryToDrone.battery_id)}
+        self.types = {name.lower(): id_ for name, id_ in global_session.query(FlightType.name, FlightType.id)}
+        self.statuses = {name.lower(): id_ for name, id_ in global_session.query(FlightStatus.name, FlightStatus.id)}
+        self.legal_rules = {name.lower(): id_ for name, id_ in global_session.query(LegalRule.name, LegalRule.id)}
+        self.uuids = {uuid for uuid, in global_session.query(Flight.uuid)}
+        self.drone_ids = set() # type: set[int]
+
+    def build(self, values: dict) -> dict:
+        drone_id = self._lookup(self.drones, values.pop("drone"), "drone")
+        values["drone_id"] = drone_id
+        values["type_id"] = self._lookup(self.types, values.pop("type"), "flight type")
+        self.drone_ids.add(drone_id)
+
+        if "battery" in values:
+            battery_id = self._lookup(self.batteries, values.pop("battery"), "battery")
+            if (drone_id, battery_id) not in self.drone_batteries:
+                raise ImportRowError("Battery is not assigned to the drone.")
+            values["battery_id"] = battery_id
+        if "status" in values:
+            values["status_id"] = self._lookup(self.statuses, values.pop("status"), "flight status")
+        if "legal_rule" in values:
+            values["legal_rule_id"] = self._lookup(self.legal_rules, values.pop("legal_rule"), "legal rule")
+
+        values.setdefault("name", f"Flight {values['date']}")
+        values["geohash"] = geo.encode_or_none(values.get("location_latitude"), values.get("location_longitude"))
+        values["uuid"] = generate_unique_string(self.uuids)
+        return values
+
+    def release(self, mappings: list[dict]) -> None:
+        self.uuids.difference_update(mapping["uuid"] for mapping in mappings)
+
+    def finish(self) -> None:
+        DroneFlightTime.rebuild(list(self.drone_ids))
+        super().finish()
+
+
+IMPORTERS = {
+    "battery": BatteryImporter,
+    "equipment": EquipmentImporter,
+    "flight_controller": FlightControllerImporter,
+    "drone": DroneImporter,
+    "flight": FlightImporter,
+}
+"""Maps a record type to the importer class handling it."""
+
+
+def import_rows(rows: Iterator[dict], spec: ImportSpec, batch_size: int=BATCH_SIZE) -> ImportResult:
+    """Validates and inserts rows in batches, with one transaction per batch.
+
+    Args:
+        rows (Iterator[dict]): The rows to import, keyed by column header.
+        spec (ImportSpec): The record type and column mapping.
+        batch_size (int, Optional): The number of rows per transaction. Defaults to BATCH_SIZE.
+
+    Returns:
+        ImportResult: The number of imported rows and the rejected rows.
+    """
+    importer = IMPORTERS[spec.record_type](spec) # type: RecordImporter
+    importer.preload()
+    result = ImportResult(record_type=spec.record_type)
+    batch = [] # type: list[tuple[int, dict, dict]]
+
+    def flush() -> None:
+        try:
+            importer.insert([mapping for _, _, mapping in batch])
+            global_session.commit()
+            result.imported += len(batch)
+        except SQLAlchemyError as error:
+            global_session.rollback()
+            importer.release([mapping for _, _, mapping in batch])
+            for row_number, row, _ in batch:
+                result.rejected.append(RejectedRow(row_number, f"Batch failed: {error}", row))
+        batch.clear()
+
+    for row_number, row in enumerate(rows, start=2):
+        try:
+            mapping = importer.build(importer.values(row))
+        except ImportRowError as error:
+            result.rejected.append(RejectedRow(row_number, str(error), row))
+            continue
+
+        batch.append((row_number, row, mapping))
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+    if result.imported:
+        importer.finish()
+    return result
+
+
+def import_file(file_path: str, spec: ImportSpec, batch_size: int=BATCH_SIZE) -> ImportResult:
+    """Imports a CSV or Excel file.
+
+    Args:
+        file_path (str): The path to the file.
+        spec (ImportSpec): The record type and column mapping.
+        batch_size (int, Optional): The number of rows per transaction. Defaults to BATCH_SIZE.
+
+    Raises:
+        MissingRequiredSoftwareError: If the file is an Excel file and openpyxl is not installed.
+
+    Returns:
+        ImportResult: The number of imported rows and the rejected rows.
+    """
+    return import_rows(read_rows(file_path, spec.sheet_name), spec, batch_size=batch_size)
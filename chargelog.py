@@ -0,0 +1,140 @@
+"""Charge sessions reported by smart chargers, ingested in bulk into the battery charge event log."""
+from __future__ import annotations
+import datetime
+from dataclasses import dataclass, field
+
+from database import global_session, log_bulk_write, Battery, BatteryChargeEvent
+from errors import ImportRowError
+import bulkimport
+
+
+CSV_COLUMNS = {
+    "serial_number": ("serial_number", "serial number", "battery", "battery serial", "pack serial"),
+    "start_time": ("start_time", "start time", "start", "date"),
+    "end_time": ("end_time", "end time", "end"),
+    "charger": ("charger", "charger name", "station", "channel"),
+    "start_voltage": ("start_voltage", "start voltage", "start v"),
+    "end_voltage": ("end_voltage", "end voltage", "end v"),
+    "duration": ("duration", "duration (min)", "charge time"),
+    "temperature": ("temperature", "max temperature", "temperature (c)", "temp"),
+}
+"""Header names chargers are known to use for each field, matched case insensitively."""
+CSV_CONVERTERS = {
+    "serial_number": bulkimport.to_text,
+    "start_time": bulkimport.to_datetime,
+    "end_time": bulkimport.to_datetime,
+    "charger": bulkimport.to_text,
+    "start_voltage": bulkimport.to_float,
+    "end_voltage": bulkimport.to_float,
+    "duration": bulkimport.to_float,
+    "temperature": bulkimport.to_float,
+}
+
+
+@dataclass
+class ChargeSession:
+    """A charge session of a single pack, as reported by a charger."""
+    serial_number: str
+    start_time: datetime.datetime
+    end_time: datetime.datetime = None
+    charger: str = None
+    start_voltage: float = None
+    end_voltage: float = None
+    duration: float = None
+    """The charge time in minutes. Defaults to the time between start and end."""
+    temperature: float = None
+
+    def to_event(self, battery_id: int) -> dict:
+        duration = self.duration
+        if duration is None and self.end_time is not None:
+            duration = round((self.end_time - self.start_time).total_seconds() / 60, 2)
+        return {
+            "battery_id": battery_id,
+            "charger": self.charger,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "start_voltage": self.start_voltage,
+            "end_voltage": self.end_voltage,
+            "duration": duration,
+            "temperature": self.temperature,
+        }
+
+
+@dataclass
+class ChargeIngestResult:
+    added: int = 0
+    duplicates: int = 0
+    """Sessions that were already logged."""
+    unknown_serial_numbers: list[str] = field(default_factory=list)
+    rejected: list[bulkimport.RejectedRow] = field(default_factory=list)
+
+
+def read_sessions(file_path: str, result: ChargeIngestResult=None) -> list[ChargeSession]:
+    """Reads the charge sessions of a charger's CSV or Excel report. Rows that can not be read are added to the result's rejected rows."""
+    sessions = [] # type: list[ChargeSession]
+    headers = None # type: dict[str, str]
+    for row_number, row in enumerate(bulkimport.read_rows(file_path), start=2):
+        if headers is None:
+            names = {str(header).strip().lower(): header for header in row}
+            headers = {name: next((names[alias] for alias in aliases if alias in names), None) for name, aliases in CSV_COLUMNS.items()}
+
+        try:
+            values = {}
+            for name, header in headers.items():
+                raw_value = row.get(header) if header is not None else None
+                if raw_value is None or str(raw_value).strip() == "": continue
+                try:
+                    values[name] = CSV_CONVERTERS[name](raw_value)
+                except ValueError:
+                    raise ImportRowError(f"Invalid value '{raw_value}' for {name}.")
+            if "serial_number" not in values or "start_time" not in values:
+                raise ImportRowError("Missing required value for serial_number or start_time.")
+        except ImportRowError as error:
+            if result is not None:
+                result.rejected.append(bulkimport.RejectedRow(row_number, str(error), row))
+            continue
+        sessions.append(ChargeSession(**values))
+    return sessions
+
+
+def ingest_sessions(sessions: list[ChargeSession], result: ChargeIngestResult=None, batch_size: int=bulkimport.BATCH_SIZE) -> ChargeIngestResult:
+    """Logs the charge sessions of many packs at once, one transaction per batch.
+        Batteries are looked up by serial number once per batch and each battery's charge cycle count is updated once per batch.
+
+    Args:
+        sessions (list[ChargeSession]): The sessions to log, in any order.
+        result (ChargeIngestResult, Optional): A result to add to, like the one rows were rejected into while reading.
+        batch_size (int, Optional): Sessions per transaction. Defaults to bulkimport.BATCH_SIZE.
+    """
+    result = result or ChargeIngestResult()
+    unknown = set() # type: set[str]
+    for start in range(0, len(sessions), batch_size):
+        batch = sessions[start:start + batch_size]
+        battery_ids = dict(global_session.query(Battery.serial_number, Battery.id)
+                           .filter(Battery.serial_number.in_({session.serial_number for session in batch})))
+
+        events = []
+        for session in batch:
+            if session.serial_number not in battery_ids:
+                unknown.add(session.serial_number)
+                continue
+            events.append(session.to_event(battery_ids[session.serial_number]))
+
+        added = BatteryChargeEvent.add_events(events)
+        result.added += added
+        result.duplicates += len(events) - added
+
+    result.unknown_serial_numbers.extend(sorted(unknown))
+    if result.added:
+        log_bulk_write([BatteryChargeEvent, Battery])
+    return result
+
+
+def ingest_file(file_path: str) -> ChargeIngestResult:
+    """Logs the charge sessions of a charger's CSV or Excel report.
+
+    Raises:
+        MissingRequiredSoftwareError: If the file is an Excel file and openpyxl is not installed.
+    """
+    result = ChargeIngestResult()
+    return ingest_sessions(read_sessions(file_path, result), result)
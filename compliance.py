@@ -0,0 +1,126 @@
+"""Document compliance of the crew, from the document each role requires. Scanned across the roster and kept precomputed in the crew_compliance table for flight starts."""
+from __future__ import annotations
+import datetime
+from dataclasses import dataclass
+
+from sqlalchemy import and_, func, true, tuple_
+
+from database import (global_session, CrewCompliance, CrewMember, CrewMemberRole, CrewMemberToDocument, CrewMemberToFlight, CrewMemberToRole,
+                      Document, DocumentType, Flight)
+
+
+EXPIRY_WARNING = datetime.timedelta(days=30)
+"""Documents expiring within this period are reported by the scan."""
+NEVER_EXPIRES = datetime.datetime(9999, 12, 31)
+"""Stands in for the expiration date of documents that do not expire."""
+MISSING = "Missing"
+EXPIRED = "Expired"
+EXPIRING = "Expiring"
+
+
+@dataclass
+class ComplianceIssue:
+    """A required document a crew member is missing, or that has expired or expires soon."""
+    crew_member_id: int
+    crew_member_name: str
+    role: str
+    document_type: str
+    status: str
+    """One of MISSING, EXPIRED or EXPIRING."""
+    expiration_date: datetime.datetime = None
+    """Expiration date of the crew member's latest document of the type. None if it is missing."""
+
+    def __str__(self) -> str:
+        if self.status == MISSING:
+            return f"{self.crew_member_name} has no {self.document_type}, required for {self.role}."
+        verb = "expired" if self.status == EXPIRED else "expires"
+        return f"{self.crew_member_name}'s {self.document_type} {verb} on {self.expiration_date:%Y-%m-%d}, required for {self.role}."
+
+
+def _required_documents(pairs: list[tuple[int, int]]=None):
+    """Returns a query of each crew member and role with the role's required document, how many the member holds and the latest expiration date.
+
+    Args:
+        pairs (list[tuple[int, int]], Optional): The (crew member id, role id) to check. Defaults to the roles of every active crew member.
+    """
+    held = global_session.query(CrewMemberToDocument.crew_member_id, Document.type_id, Document.expiration_date)\
+        .join(Document, CrewMemberToDocument.document_id == Document.id)\
+        .subquery()
+    query = global_session.query(CrewMember.id, CrewMemberRole.id, CrewMember.first_name, CrewMember.last_name, CrewMemberRole.name, DocumentType.name,
+                                 func.count(held.c.type_id), func.max(func.coalesce(held.c.expiration_date, NEVER_EXPIRES)))
+    if pairs is None:
+        query = query.select_from(CrewMemberToRole)\
+            .join(CrewMember, CrewMemberToRole.crew_member_id == CrewMember.id)\
+            .join(CrewMemberRole, CrewMemberToRole.role_id == CrewMemberRole.id)\
+            .filter(CrewMember.active == True)
+    else:
+        query = query.select_from(CrewMember)\
+            .join(CrewMemberRole, true())\
+            .filter(tuple_(CrewMember.id, CrewMemberRole.id).in_(pairs))
+    return query\
+        .join(DocumentType, CrewMemberRole.required_document_type_id == DocumentType.id)\
+        .outerjoin(held, and_(held.c.crew_member_id == CrewMember.id, held.c.type_id == CrewMemberRole.required_document_type_id))\
+        .group_by(CrewMember.id, CrewMemberRole.id, CrewMember.first_name, CrewMember.last_name, CrewMemberRole.name, DocumentType.name)
+
+
+def _issue(row, warn_until: datetime.datetime, now: datetime.datetime) -> ComplianceIssue:
+    crew_member_id, role_id, first_name, last_name, role, document_type, documents, expiration_date = row
+    issue = ComplianceIssue(crew_member_id, f"{first_name} {last_name}", role, document_type, None, None if expiration_date == NEVER_EXPIRES else expiration_date)
+    if not documents:
+        issue.status, issue.expiration_date = MISSING, None
+    elif expiration_date <= now:
+        issue.status = EXPIRED
+    elif expiration_date <= warn_until:
+        issue.status = EXPIRING
+    return issue
+
+
+def scan(within: datetime.timedelta=EXPIRY_WARNING) -> list[ComplianceIssue]:
+    """Finds the required documents the active crew is missing, or that expired or expire within a period, in one query. Missing documents first, then by expiration date."""
+    now = datetime.datetime.now()
+    issues = [_issue(row, now + within, now) for row in _required_documents()]
+    issues = [issue for issue in issues if issue.status is not None]
+    return sorted(issues, key=lambda issue: (issue.status != MISSING, issue.expiration_date or now))
+
+
+def compute(pairs: list[tuple[int, int]]) -> list[CrewCompliance]:
+    """Computes and stores the compliance of crew members in roles. Does not commit.
+
+    Args:
+        pairs (list[tuple[int, int]]): The (crew member id, role id) to compute.
+    """
+    now = datetime.datetime.now()
+    results = {pair: CrewCompliance(crew_member_id=pair[0], role_id=pair[1], compliant=True, reasons="", valid_until=None) for pair in pairs}
+    for row in _required_documents(pairs):
+        issue = _issue(row, now, now)
+        result = results[(row[0], row[1])]
+        result.valid_until = issue.expiration_date
+        if issue.status is not None:
+            result.compliant = False
+            result.reasons = str(issue)
+    return [global_session.merge(result) for result in results.values()]
+
+
+def check_crew(pairs: list[tuple[int, int]]) -> list[str]:
+    """Returns why any of the crew members can not fly in their roles, or an empty list if all of them can.
+        Compliance is read with a single primary key lookup, only rows invalidated or expired since their last check are recomputed.
+    """
+    if not pairs: return []
+    now = datetime.datetime.now()
+    stored = global_session.query(CrewCompliance)\
+        .filter(tuple_(CrewCompliance.crew_member_id, CrewCompliance.role_id).in_(pairs))\
+        .all()
+    found = {(row.crew_member_id, row.role_id): row for row in stored if not row.is_stale(now)}
+
+    missing = [pair for pair in pairs if pair not in found]
+    if missing:
+        found.update({(row.crew_member_id, row.role_id): row for row in compute(missing)})
+        global_session.commit()
+
+    return [reason for pair in pairs for reason in found[pair].reason_list]
+
+
+def check_flight(flight: Flight) -> list[str]:
+    """Returns why the crew of a flight can not fly in their roles, or an empty list if all of them can."""
+    pairs = global_session.query(CrewMemberToFlight.crew_member_id, CrewMemberToFlight.role_id).filter(CrewMemberToFlight.flight_id == flight.id)
+    return check_crew([(crew_member_id, role_id) for crew_member_id, role_id in pairs])
@@ -0,0 +1,146 @@
+"""Program settings, read from a config file and the environment.
+
+The database is configured by the [database] section of dronelogbook.ini, found next to the program or at the path in DRONELOGBOOK_CONFIG.
+Environment variables override the file: DRONELOGBOOK_DATABASE_URL sets the whole SQLAlchemy URL, for example sqlite:///logbook.db in tests,
+DRONELOGBOOK_DATABASE_HOST and the like set the parts of the MySQL URL. Without a full URL, the host and password must be set in one or the other.
+The [weather] section, or DRONELOGBOOK_WEATHER_SOURCE and DRONELOGBOOK_WEATHER_LOCATION, sets where flights get their weather from.
+The [api] section, or DRONELOGBOOK_API_TOKEN, sets the token the API server requires of the requests writing to the logbook.
+"""
+from __future__ import annotations
+import configparser
+import os
+from dataclasses import dataclass
+from errors import DatabaseConfigError
+
+
+CONFIG_FILE_NAME = "dronelogbook.ini"
+CONFIG_FILE_ENVIRONMENT = "DRONELOGBOOK_CONFIG"
+"""Environment variable holding the path of the config file."""
+ENVIRONMENT_PREFIX = "DRONELOGBOOK_DATABASE_"
+"""Prefix of the environment variables overriding the [database] section, followed by the option name in capitals."""
+WEATHER_ENVIRONMENT_PREFIX = "DRONELOGBOOK_WEATHER_"
+"""Prefix of the environment variables overriding the [weather] section."""
+API_ENVIRONMENT_PREFIX = "DRONELOGBOOK_API_"
+"""Prefix of the environment variables overriding the [api] section."""
+
+
+@dataclass
+class DatabaseConfig:
+    """Where the database is. A MySQL server, whose host and password have no default."""
+    url: str = ""
+    """Full SQLAlchemy URL. When set, the other options are ignored."""
+    driver: str = "mysql+pymysql"
+    user: str = "root"
+    password: str = ""
+    host: str = ""
+    port: str = "3306"
+    schema: str = "dronelogbook"
+    echo: bool = False
+    """Log every SQL statement."""
+    pool_size: int = 5
+    """Connections kept open to a database server."""
+    replica: str = ""
+    """Path of a local SQLite replica. When set, the program works on the replica and syncs it with the database in the background."""
+    sync_interval: int = 60
+    """Seconds between two syncs of the replica."""
+
+    @property
+    def server_url(self) -> str:
+        """Returns the URL of the server without the schema, used to create the schema. Same as database_url for a full URL."""
+        if self.url: return self.url
+        missing = [name for name in ("host", "password") if not getattr(self, name)]
+        if missing:
+            variables = " and ".join(ENVIRONMENT_PREFIX + name.upper() for name in missing)
+            raise DatabaseConfigError(f"No database {' or '.join(missing)} set. Set {'it' if len(missing) == 1 else 'them'} in the [database] section of {config_file_path()} or with {variables}, "
+                                      "or set a full url.")
+        return f"{self.driver}://{self.user}:{self.password}@{self.host}:{self.port}"
+
+    @property
+    def database_url(self) -> str:
+        if self.url: return self.url
+        return f"{self.server_url}/{self.schema}"
+
+    @property
+    def is_sqlite(self) -> bool:
+        return self.database_url.startswith("sqlite")
+
+
+def config_file_path() -> str:
+    return os.environ.get(CONFIG_FILE_ENVIRONMENT) or os.path.join(os.path.dirname(os.path.abspath(__file__)), CONFIG_FILE_NAME)
+
+
+def _read_section(section: str, environment_prefix: str, file_path: str, environ: dict[str, str]) -> dict[str, str]:
+    """Returns the options of a section of the config file, overridden by the environment."""
+    environ = os.environ if environ is None else environ
+    parser = configparser.ConfigParser()
+    parser.read(file_path or config_file_path())
+    options = dict(parser[section]) if parser.has_section(section) else {}
+    options.update({name[len(environment_prefix):].lower(): value for name, value in environ.items() if name.startswith(environment_prefix)})
+    return options
+
+
+def load_database_config(file_path: str=None, environ: dict[str, str]=None) -> DatabaseConfig:
+    """Reads the database settings from the config file, then the environment.
+
+    Args:
+        file_path (str, Optional): The config file. Defaults to config_file_path(). A missing file is ignored.
+        environ (dict[str, str], Optional): The environment variables. Defaults to os.environ.
+    """
+    database_config = DatabaseConfig()
+    for name, value in _read_section("database", ENVIRONMENT_PREFIX, file_path, environ).items():
+        if not hasattr(database_config, name): continue
+        if name == "echo":
+            value = value.strip().lower() in ("1", "true", "yes", "on")
+        elif name in ("pool_size", "sync_interval"):
+            value = int(value)
+        setattr(database_config, name, value)
+    return database_config
+
+
+@dataclass
+class WeatherConfig:
+    """Where flights get their weather from when they are located or ended. No source by default, the weather is then entered by hand."""
+    source: str = ""
+    """Name of the source in weatherprovider.SOURCES, like metar, csv or service."""
+    location: str = ""
+    """Folder of the archive, or url of the service."""
+
+
+def load_weather_config(file_path: str=None, environ: dict[str, str]=None) -> WeatherConfig:
+    """Reads the weather settings from the config file, then the environment. Takes the same arguments as load_database_config."""
+    weather_config = WeatherConfig()
+    for name, value in _read_section("weather", WEATHER_ENVIRONMENT_PREFIX, file_path, environ).items():
+        if hasattr(weather_config, name):
+            setattr(weather_config, name, value.strip())
+    return weather_config
+
+
+@dataclass
+class ApiConfig:
+    """Settings of the API server."""
+    token: str = ""
+    """Shared token the clients send as a bearer token to write. No token by default, the server then refuses every write."""
+
+
+def load_api_config(file_path: str=None, environ: dict[str, str]=None) -> ApiConfig:
+    """Reads the API server settings from the config file, then the environment. Takes the same arguments as load_database_config."""
+    api_config = ApiConfig()
+    for name, value in _read_section("api", API_ENVIRONMENT_PREFIX, file_path, environ).items():
+        if hasattr(api_config, name):
+            setattr(api_config, name, value.strip())
+    return api_config
+
+
+def engine_options(database_config: DatabaseConfig) -> dict:
+    """Returns the create_engine keyword arguments for a database."""
+    options = {"echo": database_config.echo}
+    if database_config.is_sqlite:
+        from sqlalchemy.pool import StaticPool
+        # SQLite connections are also used from other threads, like the startup worker's. An in-memory database only lives as long as its connection.
+        options["connect_args"] = {"check_same_thread": False}
+        if database_config.database_url in ("sqlite://", "sqlite:///:memory:"):
+            options["poolclass"] = StaticPool
+    else:
+        options["pool_size"] = database_config.pool_size
+        options["pool_pre_ping"] = True
+    return options
@@ -0,0 +1,145 @@
+"""Logbook hours and currency of crew members, computed for the whole crew with grouped queries and cached."""
+from __future__ import annotations
+import datetime
+import threading
+from dataclasses import dataclass, field
+
+from sqlalchemy import and_, case, func
+
+from database import global_session, CrewMember, CrewMemberRole, CrewMemberToFlight, Flight, FlightStatus, FlightType
+import events
+
+
+CURRENCY_WINDOW = datetime.timedelta(days=90)
+"""Rolling period recent flights are counted over."""
+CURRENCY_FLIGHTS = 3
+"""Flights needed within the currency window to be current, night flights for night currency."""
+COMMERCIAL_PREFIX = "Commercial"
+"""Flight types whose name starts with this are commercial."""
+
+
+@dataclass
+class RoleHours:
+    role: str
+    flights: int = 0
+    hours: float = 0.00
+
+
+@dataclass
+class CrewStats:
+    """Logbook totals and currency of a crew member. Only completed flights count."""
+    crew_member_id: int
+    name: str
+    flights: int = 0
+    hours: float = 0.00
+    night_flights: int = 0
+    night_hours: float = 0.00
+    commercial_flights: int = 0
+    commercial_hours: float = 0.00
+    recent_flights: int = 0
+    """Flights within the currency window."""
+    recent_night_flights: int = 0
+    """Night flights within the currency window."""
+    last_flight_date: datetime.datetime = None
+    roles: dict[str, RoleHours] = field(default_factory=dict)
+    """Totals by the role the crew member had on the flights."""
+
+    @property
+    def current(self) -> bool:
+        return self.recent_flights >= CURRENCY_FLIGHTS
+
+    @property
+    def night_current(self) -> bool:
+        return self.recent_night_flights >= CURRENCY_FLIGHTS
+
+
+_cache = None # type: dict[int, CrewStats]
+_cache_date = None # type: datetime.date
+"""Day the cache was computed, the rolling counts are recomputed every day."""
+_lock = threading.Lock()
+"""Guards the cache, the statistics are served to several threads."""
+
+
+def invalidate() -> None:
+    """Drops the cached statistics. Committed writes to crew and flights invalidate automatically, those of the other workstations included,
+        bulk writes have to call this. A flight's crew changes along with the flight.
+    """
+    global _cache
+    with _lock:
+        _cache = None
+
+
+events.call_on_change([model.__tablename__ for model in (CrewMember, Flight, FlightType)], invalidate)
+
+
+def _compute(now: datetime.datetime) -> dict[int, CrewStats]:
+    stats = {crew_member_id: CrewStats(crew_member_id, f"{first_name} {last_name}")
+             for crew_member_id, first_name, last_name in global_session.query(CrewMember.id, CrewMember.first_name, CrewMember.last_name)}
+    completed = and_(Flight.active == True, Flight.status_id == FlightStatus.Completed.id)
+
+    roles = global_session.query(CrewMemberToFlight.crew_member_id, CrewMemberRole.name, func.count(Flight.id), func.coalesce(func.sum(Flight.duration), 0))\
+        .join(Flight, CrewMemberToFlight.flight_id == Flight.id)\
+        .join(CrewMemberRole, CrewMemberToFlight.role_id == CrewMemberRole.id)\
+        .filter(completed)\
+        .group_by(CrewMemberToFlight.crew_member_id, CrewMemberRole.name)
+    for crew_member_id, role, flights, minutes in roles:
+        if crew_member_id in stats:
+            stats[crew_member_id].roles[role] = RoleHours(role, flights, round(minutes / 60, 2))
+
+    # A crew member with more than one role on a flight is counted once for the flight.
+    crew_flights = global_session.query(CrewMemberToFlight.crew_member_id, CrewMemberToFlight.flight_id).distinct().subquery()
+    duration = func.coalesce(Flight.duration, 0)
+    night = Flight.night_flight == True
+    commercial = FlightType.name.like(f"{COMMERCIAL_PREFIX}%")
+    recent = Flight.date >= now - CURRENCY_WINDOW
+    totals = global_session.query(
+            crew_flights.c.crew_member_id,
+            func.count(Flight.id),
+            func.coalesce(func.sum(duration), 0),
+            func.coalesce(func.sum(case((night, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((night, duration), else_=0)), 0),
+            func.coalesce(func.sum(case((commercial, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((commercial, duration), else_=0)), 0),
+            func.coalesce(func.sum(case((recent, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((and_(recent, night), 1), else_=0)), 0),
+            func.max(Flight.date),
+        )\
+        .join(Flight, crew_flights.c.flight_id == Flight.id)\
+        .join(FlightType, Flight.type_id == FlightType.id)\
+        .filter(completed)\
+        .group_by(crew_flights.c.crew_member_id)
+    for crew_member_id, flights, minutes, night_flights, night_minutes, commercial_flights, commercial_minutes, recent_flights, recent_night_flights, last_flight_date in totals:
+        if crew_member_id not in stats: continue
+        member = stats[crew_member_id]
+        member.flights = flights
+        member.hours = round(minutes / 60, 2)
+        member.night_flights = night_flights
+        member.night_hours = round(night_minutes / 60, 2)
+        member.commercial_flights = commercial_flights
+        member.commercial_hours = round(commercial_minutes / 60, 2)
+        member.recent_flights = recent_flights
+        member.recent_night_flights = recent_night_flights
+        member.last_flight_date = last_flight_date
+    return stats
+
+
+def all_stats() -> dict[int, CrewStats]:
+    """Returns the statistics of every crew member by crew member id, computed in one batch and cached until crew or flights change."""
+    global _cache, _cache_date
+    now = datetime.datetime.now()
+    with _lock:
+        if _cache is None or _cache_date != now.date():
+            _cache = _compute(now)
+            _cache_date = now.date()
+        return _cache
+
+
+def crew_stats(crew_member: CrewMember) -> CrewStats:
+    """Returns the statistics of a single crew member."""
+    return all_stats().get(crew_member.id)
+
+
+def find_not_current(night: bool=False) -> list[CrewStats]:
+    """Returns the crew members who are not current, or not night current, least recently flown first."""
+    stats = [member for member in all_stats().values() if not (member.night_current if night else member.current)]
+    return sorted(stats, key=lambda member: member.last_flight_date or datetime.datetime.min)
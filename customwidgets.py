@@ -1,4 +1,5 @@
 from __future__ import annotations
+from typing import Any
 from PyQt5 import QtCore, QtGui, QtWidgets
 from database import global_session
 
@@ -145,6 +146,8 @@ class SearchWidget(QtWidgets.QWidget):
         """Record number to start at"""
         self.pagination_records = [] # type: list[list[str]]
         """List of all records to show"""
+        self.record_keys = [] # type: list[Any]
+        """Key of each record, in the same order as pagination_records. Used to update records in place."""
 
 
         self.setContentsMargins(0, 0, 0, 0)
@@ -186,6 +189,7 @@ class SearchWidget(QtWidgets.QWidget):
         self.results_table = CustomQTableWidget()
         self.results_table.setObjectName("results_table")
         self.results_table.set_table_headers(self.columns)
+        self.results_table.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
         self.main_layout.addWidget(self.results_table)
 
         self.view_button_layout = QtWidgets.QHBoxLayout()
@@ -198,7 +202,13 @@ class SearchWidget(QtWidgets.QWidget):
         self.results_table.itemSelectionChanged.connect(lambda: self.view_button.setEnabled(True))
         self.view_button.setFixedSize(50, 25)
         self.view_button.setObjectName("view_button")
+        self.print_labels_button = QtWidgets.QPushButton("Print Labels")
+        self.print_labels_button.setEnabled(False)
+        self.results_table.itemSelectionChanged.connect(lambda: self.print_labels_button.setEnabled(bool(self.results_table.selectedItems())))
+        self.print_labels_button.setFixedSize(75, 25)
+        self.print_labels_button.setObjectName("print_labels_button")
         self.view_button_layout.addStretch(1)
+        self.view_button_layout.addWidget(self.print_labels_button)
         self.view_button_layout.addWidget(self.view_button)
         self.main_layout.addLayout(self.view_button_layout)
 
@@ -241,11 +251,17 @@ class SearchWidget(QtWidgets.QWidget):
         self.update_pagination_label()
 
         # Update table
-        records = self.pagination_records[self.pagination_start_record - 1:self.pagination_start_record + self.pagination_record_limit - 1]
+        start = self.pagination_start_record - 1
+        records = self.pagination_records[start:start + self.pagination_record_limit]
+        keys = self.record_keys[start:start + self.pagination_record_limit]
         self.results_table.setRowCount(len(records))
         for row, record in enumerate(records):
             for col, value in enumerate(record):
-                self.results_table.setItem(row, col, QtWidgets.QTableWidgetItem(value))
+                item = QtWidgets.QTableWidgetItem(value)
+                if col == 0 and row < len(keys):
+                    # Kept on the item, so the row still finds its record once the table is sorted.
+                    item.setData(QtCore.Qt.UserRole, keys[row])
+                self.results_table.setItem(row, col, item)
     
     def next_page(self) -> None:
         """Moves to the next page"""
@@ -262,12 +278,40 @@ class SearchWidget(QtWidgets.QWidget):
         self.pagination_records.append(data)
         self.update_pagination()
     
-    def set_record_data(self, data: list[list[str]]):
-        self.pagination_records = [] # type: list[list[str]]
-        for record in data:
-            self.add_record(record)
+    def set_record_data(self, data: list[list[str]], keys: list[Any]=None):
+        """Replaces all records, only the current page is written to the table."""
+        self.pagination_records = list(data)
+        self.record_keys = list(keys) if keys is not None else []
+        self.update_pagination()
         self.results_table.horizontalHeader().resizeSections(QtWidgets.QHeaderView.ResizeToContents)
 
+    def update_records(self, changed: dict[Any, list[str]], removed: set[Any]=frozenset()) -> None:
+        """Updates records in place by key, appends the new ones and drops the removed ones. The other records keep their position.
+
+        Args:
+            changed (dict[Any, list[str]]): The data of the changed and new records, by key.
+            removed (set[Any], Optional): The keys of the removed records.
+        """
+        if removed:
+            kept = [(key, record) for key, record in zip(self.record_keys, self.pagination_records) if key not in removed]
+            self.record_keys = [key for key, _ in kept]
+            self.pagination_records = [record for _, record in kept]
+
+        positions = {key: index for index, key in enumerate(self.record_keys)}
+        for key, record in changed.items():
+            if key in positions:
+                self.pagination_records[positions[key]] = record
+            else:
+                self.record_keys.append(key)
+                self.pagination_records.append(record)
+        self.update_pagination()
+
+    def selected_keys(self) -> list[Any]:
+        """Returns the keys of the selected records of the current page, in table order."""
+        rows = sorted({index.row() for index in self.results_table.selectedIndexes()})
+        items = [self.results_table.item(row, 0) for row in rows]
+        return [item.data(QtCore.Qt.UserRole) for item in items if item is not None and item.data(QtCore.Qt.UserRole) is not None]
+
     def update_pagination_label(self):
         self.pagination_label.setText(f"Records {self.pagination_start_record} - {self.pagination_start_record + self.pagination_record_limit - 1} of {len(self.pagination_records)}")
     
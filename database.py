@@ -1,47 +1,77 @@
 from __future__ import annotations
-from ast import Not
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import datetime
 import os
 import enum
 import string
 import random
 import base64
+import contextlib
 from typing import overload
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.orm.session import Session as session_type_hint
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Boolean, Enum
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Boolean, Enum, Index, LargeBinary, UniqueConstraint, or_, and_, case, func, event, inspect, literal
 from sqlalchemy.orm import relationship
+from sqlalchemy.schema import AddConstraint
 from sqlalchemy.dialects.mysql import LONGBLOB
-from PyQt5.QtGui import QImage
 
 from errors import *
+import config
+import events
+import geo
 
 # FILE_NAME = "dronelogbook.db"
 # DATABASE_URL = f"sqlite:///{FILE_NAME}"
 # if os.path.exists(FILE_NAME):
 #     os.remove(FILE_NAME)
 
-SCHEMA = "dronelogbook"
-USER = "root"
-PASSWORD = "Redpurple23"
-HOST = "192.168.1.107"
-PORT = "3306"
-DATABASE_URL_WITHOUT_SCHEMA = f"mysql+pymysql://{USER}:{PASSWORD}@{HOST}:{PORT}"
-DATABASE_URL = f"{DATABASE_URL_WITHOUT_SCHEMA}/{SCHEMA}"
+DATABASE_CONFIG = config.load_database_config()
+"""Where the database is, from the config file or the environment."""
+SCHEMA = DATABASE_CONFIG.schema
+DATABASE_URL_WITHOUT_SCHEMA = DATABASE_CONFIG.server_url
+DATABASE_URL = DATABASE_CONFIG.database_url
 
 IMAGE_FOLDER = os.path.join(os.path.dirname(__file__), "images")
 DRONE_GEOMETRY_IMAGE_FOLDER = os.path.join(IMAGE_FOLDER, "drone_geometry")
 
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **config.engine_options(DATABASE_CONFIG))
 Session = sessionmaker(bind=engine)
-global_session = Session() # type: session_type_hint
+global_session = scoped_session(Session) # type: session_type_hint
+"""The session of the current thread, used by every model. use_session points it at another session."""
 Base = declarative_base()
-
-import databasebackup
+BLOB = LargeBinary().with_variant(LONGBLOB(), "mysql")
+"""Binary column type, LONGBLOB on MySQL."""
+
+
+def configure(database_config: config.DatabaseConfig) -> None:
+    """Binds the program to another database, like SQLite in tests and scripts. Closes the current session of this thread."""
+    global DATABASE_CONFIG, SCHEMA, DATABASE_URL_WITHOUT_SCHEMA, DATABASE_URL, engine
+    global_session.remove()
+    engine.dispose()
+    DATABASE_CONFIG = database_config
+    SCHEMA = database_config.schema
+    DATABASE_URL_WITHOUT_SCHEMA = database_config.server_url
+    DATABASE_URL = database_config.database_url
+    engine = create_engine(DATABASE_URL, **config.engine_options(database_config))
+    Session.configure(bind=engine)
+
+
+@contextlib.contextmanager
+def use_session(session: session_type_hint):
+    """Makes global_session refer to a session on this thread until the block exits, so the models run on an injected session."""
+    registry = global_session.registry
+    previous = registry() if registry.has() else None
+    registry.set(session)
+    try:
+        yield session
+    finally:
+        if previous is None:
+            registry.clear()
+        else:
+            registry.set(previous)
 
 def generate_random_string(check_table, limit=13) -> str:
     string_ = ''.join(random.choices(string.ascii_uppercase + string.digits + string.ascii_lowercase, k=limit))
@@ -49,6 +79,14 @@ def generate_random_string(check_table, limit=13) -> str:
         string_ = ''.join(random.choices(string.ascii_uppercase + string.digits + string.ascii_lowercase, k=limit))
     return string_
 
+def generate_unique_string(existing: set[str], limit=13) -> str:
+    """Same as generate_random_string, but checked against a set of strings already loaded from the table. The new string is added to the set."""
+    string_ = ''.join(random.choices(string.ascii_uppercase + string.digits + string.ascii_lowercase, k=limit))
+    while string_ in existing:
+        string_ = ''.join(random.choices(string.ascii_uppercase + string.digits + string.ascii_lowercase, k=limit))
+    existing.add(string_)
+    return string_
+
 def check_random_sting(string: str, table_name) -> bool:
     """Checks if the string is not in the table."""
     with Session() as session:
@@ -62,6 +100,7 @@ def check_random_sting(string: str, table_name) -> bool:
 
 
 def backup_database(folder_path: str):
+    import databasebackup
     databasebackup.create(engine, folder_path)
 
 
@@ -418,7 +457,7 @@ class FlightController(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     date_created = Column(DateTime, default=datetime.datetime.now)
-    date_modified = Column(DateTime, default=datetime.datetime.now)
+    date_modified = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
     serial_number = Column(String(256), unique=True)
     name = Column(String(50))
     purchase_date = Column(DateTime, default=datetime.datetime.now)
@@ -454,6 +493,11 @@ class FlightController(Base):
     @property
     def combobox_name(self) -> str:
         return f"[{self.serial_number}] {self.name}"
+
+    @property
+    def inventory_id(self) -> str:
+        """Returns the inventory ID of the flight controller. Used for adding barcodes to the flight controller."""
+        return self.serial_number
     
     def set_attribute(self, column: Column, value) -> None:
         """Sets the value of a column in the database.
@@ -463,6 +507,7 @@ class FlightController(Base):
             value: The value to set the column to.
         """
         setattr(self, column.name, value)
+        AssetReadiness.invalidate(AssetReadiness.Flight_Controller_Asset, [self.id])
         self.date_modified = datetime.datetime.now()
         global_session.commit()
     
@@ -487,10 +532,14 @@ class FlightController(Base):
         """Finds all flight controllers."""
         return global_session.query(FlightController).all()
  
-    def start_flight(self, flight: Flight):
+    def start_flight(self, flight: Flight) -> None:
         """Starts a flight."""
-        # TODO: Implement this.
-        pass
+
+        if flight.drone.flight_controller_id != self.id:
+            raise ValueError("The flight controller used for this flight does not match the flight controller of the drone.")
+
+        self.last_flight_date = flight.date
+        global_session.commit()
 
     def end_flight(self, flight: Flight) -> None:
         """Ends a flight."""
@@ -524,7 +573,7 @@ class Image(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(256), nullable=False, unique=True)
-    data = Column(LONGBLOB, nullable=False)
+    data = Column(BLOB, nullable=False)
     file_extention = Column(String(10), nullable=False)
     read_only = Column(Boolean, nullable=False, default=False)
 
@@ -532,7 +581,8 @@ class Image(Base):
         return f"<Image(name={self.name})>"
     
     def to_QImage(self) -> QImage:
-        """Converts the image to a QImage."""
+        """Converts the image to a QImage. Qt is imported here so the data layer does not need it."""
+        from PyQt5.QtGui import QImage
         return QImage.fromData(self.data, format=self.file_extention)
     
     @staticmethod
@@ -731,7 +781,7 @@ class Drone(Base):
     color = Column(String(25))
     brand = Column(String(50))
     date_created = Column(DateTime, default=datetime.datetime.now)
-    date_modified = Column(DateTime, default=datetime.datetime.now)
+    date_modified = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
     description = Column(String(256))
     flight_controller_id = Column(Integer, ForeignKey("flight_controller.id"), nullable=False)
     geometry_id = Column(Integer, ForeignKey("drone_geometry.id"), nullable=False)
@@ -768,6 +818,7 @@ class Drone(Base):
             value: The value to set the column to.
         """
         setattr(self, column.name, value)
+        AssetReadiness.invalidate(AssetReadiness.Drone_Asset, [self.id])
         self.date_modified = datetime.datetime.now()
         global_session.commit()
 
@@ -798,6 +849,7 @@ class Drone(Base):
 
         for battery_to_drone in self.batteries:
             global_session.delete(battery_to_drone)
+        global_session.query(DroneFlightTime).filter(DroneFlightTime.drone_id == self.id).delete(synchronize_session=False)
         global_session.commit()
         global_session.delete(self)
         global_session.commit()
@@ -843,6 +895,7 @@ class Drone(Base):
         if battery not in batteries:
             battery_to_drone = BatteryToDrone(drone_id=self.id, battery_id=battery.id)
             global_session.add(battery_to_drone)
+            self.date_modified = datetime.datetime.now()
             global_session.commit()
         
     def add_batteries(self, batteries: list[Battery]) -> None:
@@ -858,6 +911,7 @@ class Drone(Base):
         for battery_to_drone in self.batteries:
             if battery_to_drone.battery != battery: continue
             global_session.delete(battery_to_drone)
+            self.date_modified = datetime.datetime.now()
             global_session.commit()
             break
     
@@ -901,6 +955,8 @@ class Weather(Base):
         """
         setattr(self, column.name, value)
         self.date_modified = datetime.datetime.now()
+        # The flight's row in the exports holds its weather.
+        self.flight.date_modified = self.date_modified
         global_session.commit()
 
 
@@ -915,6 +971,8 @@ class Flight(Base):
     battery_id = Column(Integer, ForeignKey("battery.id"))
     battery_notes = Column(String(256))
     date = Column(DateTime, default=datetime.datetime.now)
+    date_modified = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now, index=True)
+    """Also set by bulk updates. Indexed for the incremental refresh of the flight search table."""
     distance_traveled = Column(Float, default=0.00)
     """The distance traveled in meters."""
     drone_id = Column(Integer, ForeignKey("drone.id"), nullable=False)
@@ -922,6 +980,8 @@ class Flight(Base):
     """The flight time in minutes."""
     encounter_with_law = Column(Boolean, default=False)
     external_case_id = Column(String(256), default="")
+    geohash = Column(String(12), index=True)
+    """Geohash of the flight's location, kept in sync with the latitude and longitude. Indexed for the location queries."""
     in_flight_notes = Column(String(256))
     location_latitude = Column(Float)
     """The latitude of the flight's location."""
@@ -931,6 +991,8 @@ class Flight(Base):
     legal_rule_details = Column(String(256), default="")
     max_agl_altitude = Column(Float, default=0.00)
     """The maximum altitude AGL in meters."""
+    min_battery_voltage = Column(Float)
+    """The lowest battery pack voltage recorded during the flight in volts."""
     name = Column(String(256))
     night_flight = Column(Boolean, default=False)
     notes = Column(String(256))
@@ -964,9 +1026,19 @@ class Flight(Base):
             column (Column): The column to set.
             value: The value to set the column to.
         """
+        previous_battery_id = self.battery_id
         setattr(self, column.name, value)
+        if column.name in ("location_latitude", "location_longitude"):
+            self.geohash = geo.encode_or_none(self.location_latitude, self.location_longitude)
         self.date_modified = datetime.datetime.now()
         global_session.commit()
+        if column.name in ("active", "battery_id", "date", "duration", "status_id"):
+            DroneFlightTime.rebuild([self.drone_id])
+            # A battery taken off the flight loses its cycles and flight time as well.
+            battery_ids = {previous_battery_id, self.battery_id} - {None}
+            if battery_ids:
+                AssetReadiness.invalidate(AssetReadiness.Battery_Asset, list(battery_ids))
+                global_session.commit()
     
     @staticmethod
     def create(drone: Drone, type_: FlightType, crew: list[tuple[CrewMember, CrewMemberRole]]=None) -> Flight:
@@ -992,6 +1064,8 @@ class Flight(Base):
         
         if self.weather:
             global_session.delete(self.weather)
+
+        global_session.query(FlightTelemetryBlock).filter(FlightTelemetryBlock.flight_uuid == self.uuid).delete(synchronize_session=False)
         
         global_session.commit()
         global_session.delete(self)
@@ -1029,7 +1103,7 @@ class Flight(Base):
     @property
     def battery_weight(self) -> float:
         """Returns the battery weight in kilograms."""
-        return self.battery.weight
+        return self.battery.weight if self.battery is not None else 0.00
     
     @property
     def total_crew_members(self) -> int:
@@ -1039,7 +1113,11 @@ class Flight(Base):
     @property
     def total_takeoff_weight(self) -> float:
         """Returns the total takeoff weight in kilograms."""
-        return round(self.drone.weight + self.total_equipment_weight + self.battery_weight, 4)
+        weight = weightbalance.flight_weight(self)
+        if weight is None:
+            # Not in the database yet, weighed from the loaded drone, battery and equipment instead.
+            return round(self.drone.weight + self.total_equipment_weight + self.battery_weight, 4)
+        return weight.takeoff_weight
     
     def add_equipment(self, equipment: Equipment) -> None:
         """Adds an equipment to the flight. If the equipment is already attached to the flight, it is ignored."""
@@ -1047,6 +1125,7 @@ class Flight(Base):
         if equipment not in used_equipment:
             equipment_to_flight = EquipmentToFlight(flight=self, equipment=equipment)
             self.used_equipment.append(equipment_to_flight)
+            self.date_modified = datetime.datetime.now()
             global_session.commit()
     
     def remove_equipment(self, equipment: Equipment) -> None:
@@ -1056,6 +1135,7 @@ class Flight(Base):
             for equipment_to_flight in self.used_equipment:
                 if equipment_to_flight.equipment == equipment:
                     global_session.delete(equipment_to_flight)
+                    self.date_modified = datetime.datetime.now()
                     global_session.commit()
                     break
         
@@ -1070,6 +1150,7 @@ class Flight(Base):
 
         crew_member_to_flight = CrewMemberToFlight(flight_id=self.id, crew_member_id=crew_member.id, role_id=role.id)
         global_session.add(crew_member_to_flight)
+        self.date_modified = datetime.datetime.now()
         global_session.commit()
     
     def remove_crew_member(self, crew_member: CrewMember) -> None:
@@ -1082,6 +1163,7 @@ class Flight(Base):
                 if role.required_for_flight:
                     raise RoleRemovalError(f"Could not remove crew member {crew_member.full_name} from flight. Role {role.name} is required for the flight.")
                 global_session.delete(crew_member_to_flight)
+                self.date_modified = datetime.datetime.now()
                 global_session.commit()
                 return
     
@@ -1091,20 +1173,79 @@ class Flight(Base):
         if battery.id not in useable_battery_ids:
             raise BatteryNotAssignedError(f"Could not add battery to flight. Battery {battery.serial_number} is not assigned to the drone.")
 
-        self.battery_id = battery.id
-        global_session.commit()
+        self.set_attribute(Flight.battery_id, battery.id)
     
     def set_weather(self, weather: Weather) -> None:
         """Sets the weather for this flight."""
         self.weather = weather
+        self.date_modified = datetime.datetime.now()
         global_session.commit()
     
     def set_location(self, location: Location) -> None:
         """Sets the location of the flight."""
         self.location_latitude = location.latitude
         self.location_longitude = location.longitude
+        self.geohash = geo.encode_or_none(location.latitude, location.longitude)
         self.address = location.address
         global_session.commit()
+
+    @staticmethod
+    def _query_bounding_box(box: geo.BoundingBox):
+        """Returns a query of the flights inside a bounding box. The geohash prefixes covering the box narrow the search down on the index."""
+        query = global_session.query(Flight)
+        prefixes = box.geohash_prefixes()
+        if prefixes:
+            # A range rather than LIKE, so every database can use the index. "~" sorts after every geohash character.
+            query = query.filter(or_(*[Flight.geohash.between(prefix, f"{prefix}~") for prefix in prefixes]))
+        query = query.filter(Flight.location_latitude.between(box.min_latitude, box.max_latitude))
+        return query.filter(or_(*[Flight.location_longitude.between(minimum, maximum) for minimum, maximum in box.longitude_ranges]))
+
+    @staticmethod
+    def find_in_bounding_box(box: geo.BoundingBox) -> list[Flight]:
+        """Finds the flights located inside a bounding box."""
+        return Flight._query_bounding_box(box).all()
+
+    @staticmethod
+    def find_within_radius(latitude: float, longitude: float, radius: float) -> list[Flight]:
+        """Finds the flights located within a distance of a coordinate.
+
+        Args:
+            latitude (float): Latitude of the center.
+            longitude (float): Longitude of the center.
+            radius (float): The distance in meters.
+        """
+        candidates = Flight._query_bounding_box(geo.BoundingBox.around(latitude, longitude, radius)).all()
+        return [flight for flight in candidates if geo.distance(latitude, longitude, flight.location_latitude, flight.location_longitude) <= radius]
+
+    @staticmethod
+    def find_in_polygon(polygon: list[tuple[float, float]]) -> list[Flight]:
+        """Finds the flights located inside a polygon, like a geofence.
+
+        Args:
+            polygon (list[tuple[float, float]]): The (latitude, longitude) vertices of the polygon.
+        """
+        candidates = Flight._query_bounding_box(geo.BoundingBox.of_polygon(polygon)).all()
+        return [flight for flight in candidates if geo.point_in_polygon(flight.location_latitude, flight.location_longitude, polygon)]
+
+    @staticmethod
+    def update_geohashes(batch_size: int=10000) -> int:
+        """Fills in the geohash of flights that have a location but no geohash, like flights entered before it existed.
+
+        Returns:
+            int: The number of flights updated.
+        """
+        query = global_session.query(Flight.id, Flight.location_latitude, Flight.location_longitude)\
+            .filter(Flight.geohash == None)\
+            .filter(Flight.location_latitude.between(-90, 90))\
+            .filter(Flight.location_longitude.between(-180, 180))
+        total = 0
+        while True:
+            rows = query.limit(batch_size).all()
+            if not rows: break
+            global_session.bulk_update_mappings(Flight, [{"id": id_, "geohash": geo.encode(latitude, longitude)} for id_, latitude, longitude in rows])
+            global_session.commit()
+            total += len(rows)
+        return total
     
     def start(self) -> None:
         """Starts the flight."""
@@ -1124,6 +1265,10 @@ class Flight(Base):
         for role in required_roles:
             if role not in current_roles:
                 raise MissingRequiredRoleError(f"Could not start flight. Missing required role {role.name}.")
+
+        reasons = readiness.check_flight(self) + compliance.check_flight(self) + weightbalance.check_flight(self)
+        if reasons:
+            raise FlightNotReadyError("Could not start flight.\n" + "\n".join(reasons))
         
         self.status_id = FlightStatus.InProgress.id
         global_session.commit()
@@ -1138,9 +1283,68 @@ class Flight(Base):
         self.duration = duration
         self.status_id = FlightStatus.Completed.id
         global_session.commit()
+        if self.active:
+            DroneFlightTime.add_flight_time(self.drone_id, duration)
+        if self.battery_id is not None:
+            AssetReadiness.invalidate(AssetReadiness.Battery_Asset, [self.battery_id])
+            global_session.commit()
         self.drone.flight_controller.end_flight(self)
 
 
+class FlightTelemetryBlock(Base):
+    """A compressed, columnar block of a flight's telemetry samples. Read and written through telemetrystore."""
+    __tablename__ = "flight_telemetry_block"
+    __table_args__ = (Index("ix_flight_telemetry_block_range", "flight_uuid", "level", "start_time"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    flight_uuid = Column(String(14), ForeignKey("flight.uuid"), nullable=False)
+    level = Column(Integer, nullable=False, default=0)
+    """0 for the full rate samples, 1 for the downsampled overview."""
+    start_time = Column(Float, nullable=False)
+    """Time of the first sample in the block, in seconds from the start of the log."""
+    end_time = Column(Float, nullable=False)
+    """Time of the last sample in the block, in seconds from the start of the log."""
+    sample_count = Column(Integer, nullable=False)
+    data = Column(BLOB, nullable=False) # type: bytes
+    """The block's channels as a compressed numpy archive, one array per channel."""
+
+
+class AssetReadiness(Base):
+    """Precomputed preflight readiness of a drone, battery, flight controller or equipment.
+        A row is deleted whenever a write could change its asset's readiness, and readiness recomputes it on the next check.
+    """
+    __tablename__ = "asset_readiness"
+
+    Drone_Asset = "drone"
+    Battery_Asset = "battery"
+    Flight_Controller_Asset = "flight_controller"
+    Equipment_Asset = "equipment"
+
+    asset_type = Column(String(20), primary_key=True)
+    asset_id = Column(Integer, primary_key=True)
+    ready = Column(Boolean, nullable=False)
+    reasons = Column(String(1024), nullable=False, default="")
+    """Why the asset is not ready, one reason per line."""
+    date_computed = Column(DateTime, default=datetime.datetime.now)
+
+    @property
+    def reason_list(self) -> list[str]:
+        return [reason for reason in self.reasons.split("\n") if reason]
+
+    @staticmethod
+    def invalidate(asset_type: str, asset_ids: list[int]=None) -> None:
+        """Deletes the readiness of assets so it is recomputed on the next check. Does not commit.
+
+        Args:
+            asset_type (str): One of the asset type constants.
+            asset_ids (list[int], Optional): The assets to invalidate. Defaults to every asset of the type.
+        """
+        query = global_session.query(AssetReadiness).filter(AssetReadiness.asset_type == asset_type)
+        if asset_ids is not None:
+            query = query.filter(AssetReadiness.asset_id.in_(asset_ids))
+        query.delete(synchronize_session=False)
+
+
 class EquipmentToFlight(Base):
     """Links equipment to a flight."""
     __tablename__ = "equipment_to_flight"
@@ -1309,10 +1513,10 @@ class Battery(Base):
     cell_count = Column(Integer, nullable=False)
     """The number of cells in the battery."""
     charge_cycle_count = Column(Integer, default=0)
-    """The number of times the battery has been charged."""
+    """The number of times the battery has been charged. Kept up to date as charge events are added and deleted, so it also counts charges made before the charge event log."""
     chemistry_id = Column(Integer, ForeignKey("battery_chemistry.id"), nullable=False, default=1)
     date_created = Column(DateTime, default=datetime.datetime.now)
-    date_modified = Column(DateTime, default=datetime.datetime.now)
+    date_modified = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
     notes = Column(String(256))
     item_value = Column(Float, default=0.00)
     """The value of the battery in US dollars."""
@@ -1332,6 +1536,7 @@ class Battery(Base):
 
     chemistry = relationship("BatteryChemistry", uselist=False) # type: BatteryChemistry
     flights = relationship("Flight", back_populates="battery") # type: list[Flight]
+    charge_events = relationship("BatteryChargeEvent", back_populates="battery", order_by="BatteryChargeEvent.start_time") # type: list[BatteryChargeEvent]
 
     def __str__(self) -> str:
         return f'Battery "{self.inventory_id}", {self.capacity}mAh, {self.cell_count} cells'
@@ -1344,6 +1549,7 @@ class Battery(Base):
             value: The value to set the column to.
         """
         setattr(self, column.name, value)
+        AssetReadiness.invalidate(AssetReadiness.Battery_Asset, [self.id])
         self.date_modified = datetime.datetime.now()
         global_session.commit()
 
@@ -1416,12 +1622,15 @@ class Battery(Base):
         if drones:
             raise DeleteBatteryError("Cannot delete battery linked to drones.")
         
+        global_session.query(BatteryChargeEvent).filter(BatteryChargeEvent.battery_id == self.id).delete(synchronize_session=False)
         global_session.delete(self)
         global_session.commit()
 
-    def add_charge_cycle(self):
-        """Adds a charge cycle to the battery."""
-        self.charge_cycle_count += 1
+    def add_charge_cycle(self, charger: str="Manual"):
+        """Adds a charge cycle to the battery, logged as a charge event starting now."""
+        global_session.add(BatteryChargeEvent(battery_id=self.id, charger=charger, start_time=datetime.datetime.now()))
+        self.charge_cycle_count = (self.charge_cycle_count or 0) + 1
+        AssetReadiness.invalidate(AssetReadiness.Battery_Asset, [self.id])
         global_session.commit()
     
     @staticmethod
@@ -1441,6 +1650,86 @@ class Battery(Base):
         return Battery.find_by_serial_number(serial_number)
 
 
+class BatteryChargeEvent(Base):
+    """A charge session of a battery, as reported by a charger or logged by hand.
+        Each event counts as one charge cycle, the battery's charge_cycle_count is updated in the same transaction the event is added or deleted in.
+    """
+    __tablename__ = "battery_charge_event"
+    __table_args__ = (UniqueConstraint("battery_id", "start_time", name="uq_battery_charge_event_start"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    battery_id = Column(Integer, ForeignKey("battery.id"), nullable=False)
+    charger = Column(String(100))
+    """The charger or charging station that charged the battery."""
+    start_time = Column(DateTime, nullable=False)
+    end_time = Column(DateTime)
+    start_voltage = Column(Float)
+    """The pack voltage in volts when charging started."""
+    end_voltage = Column(Float)
+    """The pack voltage in volts when charging ended."""
+    duration = Column(Float)
+    """The charge time in minutes."""
+    temperature = Column(Float)
+    """The highest pack temperature during the charge in degrees Celsius."""
+    date_created = Column(DateTime, default=datetime.datetime.now)
+
+    battery = relationship("Battery", back_populates="charge_events") # type: Battery
+
+    def delete(self) -> None:
+        """Deletes the charge event and removes its charge cycle from the battery."""
+        BatteryChargeEvent._add_to_counts({self.battery_id: -1})
+        global_session.delete(self)
+        global_session.commit()
+
+    @staticmethod
+    def _add_to_counts(counts: dict[int, int]) -> None:
+        """Adds to the charge cycle counts of batteries with one UPDATE per distinct amount. Does not commit.
+
+        Args:
+            counts (dict[int, int]): The amount to add by battery id.
+        """
+        battery_ids_by_count = {} # type: dict[int, list[int]]
+        for battery_id, count in counts.items():
+            battery_ids_by_count.setdefault(count, []).append(battery_id)
+        for count, battery_ids in battery_ids_by_count.items():
+            global_session.query(Battery)\
+                .filter(Battery.id.in_(battery_ids))\
+                .update({Battery.charge_cycle_count: func.coalesce(Battery.charge_cycle_count, 0) + count}, synchronize_session=False)
+        AssetReadiness.invalidate(AssetReadiness.Battery_Asset, list(counts))
+
+    @staticmethod
+    def add_events(events: list[dict]) -> int:
+        """Inserts charge events in bulk and adds them to their batteries' charge cycle counts in one transaction.
+            Events already logged, by battery and start time, are skipped so a charger's report can be ingested more than once.
+
+        Args:
+            events (list[dict]): Column values by column name. battery_id and start_time are required.
+
+        Returns:
+            int: The number of events added.
+        """
+        if not events: return 0
+        start_times = [event["start_time"] for event in events]
+        existing = global_session.query(BatteryChargeEvent.battery_id, BatteryChargeEvent.start_time)\
+            .filter(BatteryChargeEvent.battery_id.in_({event["battery_id"] for event in events}))\
+            .filter(BatteryChargeEvent.start_time.between(min(start_times), max(start_times)))
+        logged = {(battery_id, start_time) for battery_id, start_time in existing}
+
+        new_events, counts = [], {} # type: list[dict], dict[int, int]
+        for event in events:
+            key = (event["battery_id"], event["start_time"])
+            if key in logged: continue
+            logged.add(key)
+            new_events.append(event)
+            counts[event["battery_id"]] = counts.get(event["battery_id"], 0) + 1
+
+        if new_events:
+            global_session.bulk_insert_mappings(BatteryChargeEvent, new_events)
+            BatteryChargeEvent._add_to_counts(counts)
+        global_session.commit()
+        return len(new_events)
+
+
 class Equipment(Base):
     """Represents an item of equipment."""
     __tablename__ = "equipment"
@@ -1449,7 +1738,7 @@ class Equipment(Base):
     name = Column(String(50), nullable=False)
     description = Column(String(256))
     date_created = Column(DateTime, default=datetime.datetime.now)
-    date_modified = Column(DateTime, default=datetime.datetime.now)
+    date_modified = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
     serial_number = Column(String(256), unique=True, nullable=False)
     purchase_date = Column(DateTime, default=datetime.datetime.now)
     status = Column(Enum(*Airworthyness.all()), default=Airworthyness.Airworthy.name) # type: Airworthyness
@@ -1471,6 +1760,7 @@ class Equipment(Base):
             value: The value to set the column to.
         """
         setattr(self, column.name, value)
+        AssetReadiness.invalidate(AssetReadiness.Equipment_Asset, [self.id])
         self.date_modified = datetime.datetime.now()
         global_session.commit()
 
@@ -1566,6 +1856,12 @@ class DroneMaintenance(Base):
     status = relationship("MaintenanceStatus") # type: MaintenanceStatus
     tasks = relationship("DroneMaintenanceTask", back_populates="maintenance") # type: list[DroneMaintenanceTask]
 
+    def complete(self) -> None:
+        """Marks the maintenance as completed, which restarts the drone's service interval and scheduled task counters."""
+        self.status_id = MaintenanceStatus.Completed.id
+        global_session.commit()
+        DroneFlightTime.rebuild([self.drone_id])
+
 
 class DroneMaintenanceTask(Base):
     """Represents a task for a drone maintenance event."""
@@ -1618,6 +1914,8 @@ class DroneScheduledTask(Base):
     maintenance_task_id = Column(Integer, ForeignKey("drone_maintenance_task.id"), unique=True)
     used = Column(Boolean, default=False)
     """Whether or not the task has been used."""
+    flight_time_since_done = Column(Float, nullable=False, default=0.00)
+    """Flight time of the drone in minutes since the maintenance holding the task was completed. Kept up to date by DroneFlightTime."""
 
     drone_maintenance_task = relationship("DroneMaintenanceTask") # type: DroneMaintenanceTask
 
@@ -1642,10 +1940,105 @@ class DroneScheduledTask(Base):
         new_task = DroneScheduledTask(maintenance_task_id=task.id, interval=interval)
         global_session.add(new_task)
         global_session.commit()
+        DroneFlightTime.rebuild([task.maintenance.drone_id])
         
         return new_task
 
 
+class DroneFlightTime(Base):
+    """Running flight time counters of a drone, so maintenance due dates never have to add up the drone's flights.
+        Flight.end adds to the counters, rebuild recomputes them from the flight log in SQL.
+    """
+    __tablename__ = "drone_flight_time"
+
+    drone_id = Column(Integer, ForeignKey("drone.id"), primary_key=True)
+    total_flight_time = Column(Float, nullable=False, default=0.00)
+    """Flight time in minutes of all the drone's completed flights."""
+    flight_time_since_service = Column(Float, nullable=False, default=0.00)
+    """Flight time in minutes since the drone's last completed maintenance."""
+    last_service_date = Column(DateTime)
+    """Date of the drone's last completed maintenance."""
+
+    @staticmethod
+    def add_flight_time(drone_id: int, duration: float) -> None:
+        """Adds a completed flight's time to the counters of its drone and of the drone's scheduled tasks.
+
+        Args:
+            drone_id (int): The drone that flew.
+            duration (float): The flight time in minutes.
+        """
+        AssetReadiness.invalidate(AssetReadiness.Drone_Asset, [drone_id])
+        updated = global_session.query(DroneFlightTime)\
+            .filter(DroneFlightTime.drone_id == drone_id)\
+            .update({
+                DroneFlightTime.total_flight_time: DroneFlightTime.total_flight_time + duration,
+                DroneFlightTime.flight_time_since_service: DroneFlightTime.flight_time_since_service + duration,
+            }, synchronize_session=False)
+        if not updated:
+            DroneFlightTime.rebuild([drone_id])
+            return
+
+        task_ids = global_session.query(DroneScheduledTask.id)\
+            .join(DroneMaintenanceTask, DroneScheduledTask.maintenance_task_id == DroneMaintenanceTask.id)\
+            .join(DroneMaintenance, DroneMaintenanceTask.drone_maintenance_id == DroneMaintenance.id)\
+            .filter(DroneMaintenance.drone_id == drone_id)\
+            .filter(DroneMaintenance.status_id == MaintenanceStatus.Completed.id)\
+            .filter(DroneScheduledTask.used == False)
+        global_session.query(DroneScheduledTask)\
+            .filter(DroneScheduledTask.id.in_([task_id for task_id, in task_ids]))\
+            .update({DroneScheduledTask.flight_time_since_done: DroneScheduledTask.flight_time_since_done + duration}, synchronize_session=False)
+        global_session.commit()
+
+    @staticmethod
+    def rebuild(drone_ids: list[int]=None) -> None:
+        """Recomputes the counters from the flight log with grouped queries. Needed after flights are changed in bulk.
+
+        Args:
+            drone_ids (list[int], Optional): The drones to recompute. Defaults to every drone.
+        """
+        completed_flight = and_(Flight.active == True, Flight.status_id == FlightStatus.Completed.id)
+        last_service = global_session.query(DroneMaintenance.drone_id, func.max(DroneMaintenance.date_scheduled).label("date"))\
+            .filter(DroneMaintenance.status_id == MaintenanceStatus.Completed.id)\
+            .group_by(DroneMaintenance.drone_id)\
+            .subquery()
+
+        query = global_session.query(
+                Drone.id,
+                last_service.c.date,
+                func.coalesce(func.sum(Flight.duration), 0),
+                func.coalesce(func.sum(case((or_(last_service.c.date == None, Flight.date > last_service.c.date), Flight.duration), else_=0)), 0),
+            )\
+            .outerjoin(last_service, last_service.c.drone_id == Drone.id)\
+            .outerjoin(Flight, and_(Flight.drone_id == Drone.id, completed_flight))\
+            .group_by(Drone.id, last_service.c.date)
+        if drone_ids is not None:
+            query = query.filter(Drone.id.in_(drone_ids))
+        counters = [
+            {"drone_id": drone_id, "last_service_date": last_service_date, "total_flight_time": total, "flight_time_since_service": since_service}
+            for drone_id, last_service_date, total, since_service in query
+        ]
+
+        tasks = global_session.query(DroneScheduledTask.id, func.coalesce(func.sum(Flight.duration), 0))\
+            .join(DroneMaintenanceTask, DroneScheduledTask.maintenance_task_id == DroneMaintenanceTask.id)\
+            .join(DroneMaintenance, DroneMaintenanceTask.drone_maintenance_id == DroneMaintenance.id)\
+            .outerjoin(Flight, and_(Flight.drone_id == DroneMaintenance.drone_id, Flight.date > DroneMaintenance.date_scheduled, completed_flight))\
+            .filter(DroneScheduledTask.used == False)\
+            .filter(DroneMaintenance.status_id == MaintenanceStatus.Completed.id)\
+            .group_by(DroneScheduledTask.id)
+        if drone_ids is not None:
+            tasks = tasks.filter(DroneMaintenance.drone_id.in_(drone_ids))
+        task_counters = [{"id": task_id, "flight_time_since_done": since_done} for task_id, since_done in tasks]
+
+        delete = global_session.query(DroneFlightTime)
+        if drone_ids is not None:
+            delete = delete.filter(DroneFlightTime.drone_id.in_(drone_ids))
+        delete.delete(synchronize_session=False)
+        AssetReadiness.invalidate(AssetReadiness.Drone_Asset, drone_ids)
+        global_session.bulk_insert_mappings(DroneFlightTime, counters)
+        global_session.bulk_update_mappings(DroneScheduledTask, task_counters)
+        global_session.commit()
+
+
 class CrewMemberRole(Base):
     """Represents a role a crew member can have."""
 
@@ -1672,10 +2065,25 @@ class CrewMemberRole(Base):
     name = Column(String(50), nullable=False, unique=True)
     description = Column(String(256))
     required_for_flight = Column(Boolean, default=False)
+    required_document_type_id = Column(Integer, ForeignKey("document_type.id"))
+    """The document a crew member needs, unexpired, to fly in this role. None if the role needs no document."""
+
+    required_document_type = relationship("DocumentType") # type: DocumentType
+
+    def set_required_document_type(self, document_type: DocumentType) -> None:
+        """Sets the document crew members need to fly in this role.
+
+        Args:
+            document_type (DocumentType): The document type, or None if the role needs no document.
+        """
+        self.required_document_type_id = document_type.id if document_type is not None else None
+        CrewCompliance.invalidate(role_ids=[self.id])
+        global_session.commit()
 
     @staticmethod
     def create_defaults() -> None:
-        """Creates the default roles."""
+        """Creates the default roles. Needs the default document types."""
+        remote_pilot_certificate = DocumentType.find_by_name("Remote Pilot Certificate")
         data = [
             CrewMemberRole(name=CrewMemberRole.Approved_Delegate, description="A crew member who is approved to fly a drone."),
             CrewMemberRole(name=CrewMemberRole.Ground_Support, description="A crew member who is responsible for ground support."),
@@ -1684,7 +2092,7 @@ class CrewMemberRole(Base):
             CrewMemberRole(name=CrewMemberRole.Payload_Controller, description="A crew member who is responsible for payload control."),
             CrewMemberRole(name=CrewMemberRole.Pilot, description="A crew member who is responsible for flying the drone."),
             CrewMemberRole(name=CrewMemberRole.Student, description="A crew member who is a student learning."),
-            CrewMemberRole(name=CrewMemberRole.Remote_Pilot_In_Command, required_for_flight=True, description="A crew member who holds a remote pilot certificate with an sUAS rating and has the final authority and responsibility for the operation and safety of an sUAS operation conducted under part 107.")
+            CrewMemberRole(name=CrewMemberRole.Remote_Pilot_In_Command, required_for_flight=True, required_document_type=remote_pilot_certificate, description="A crew member who holds a remote pilot certificate with an sUAS rating and has the final authority and responsibility for the operation and safety of an sUAS operation conducted under part 107.")
         ]
 
         for role in data:
@@ -1784,16 +2192,30 @@ class Document(Base):
     """The description of the document."""
     file_extension = Column(String(10), nullable=False)
     """The file extension of the document."""
-    file_data = Column(LONGBLOB, nullable=False) # type: bytes
+    file_data = Column(BLOB, nullable=False) # type: bytes
     """The file data of the document. As represented by a base64 encoded bytes object."""
     creator_id = Column(Integer, ForeignKey("crew_member.id"))
     """The crew member who uploaded the document."""
     type_id = Column(Integer, ForeignKey("document_type.id"), nullable=False)
+    expiration_date = Column(DateTime, index=True)
+    """The date the document expires. None if it does not expire."""
 
 
     creator = relationship("CrewMember") # type: CrewMember
     type_ = relationship("DocumentType") # type: DocumentType
 
+    @property
+    def expired(self) -> bool:
+        return self.expiration_date is not None and self.expiration_date <= datetime.datetime.now()
+
+    def set_expiration_date(self, expiration_date: datetime.datetime) -> None:
+        """Sets the date the document expires, None if it does not expire."""
+        self.expiration_date = expiration_date
+        self.date_modified = datetime.datetime.now()
+        crew_member_ids = [crew_member_id for crew_member_id, in global_session.query(CrewMemberToDocument.crew_member_id).filter(CrewMemberToDocument.document_id == self.id)]
+        CrewCompliance.invalidate(crew_member_ids)
+        global_session.commit()
+
     @staticmethod
     def convert_to_bytes(file_path: str) -> bytes:
         """Converts a file to bytes.
@@ -1808,7 +2230,7 @@ class Document(Base):
             return base64.b64encode(file.read())
 
     @staticmethod
-    def upload(name: str, file_path: str, document_type: DocumentType, creator: CrewMember, description: str=None) -> Document:
+    def upload(name: str, file_path: str, document_type: DocumentType, creator: CrewMember, description: str=None, expiration_date: datetime.datetime=None) -> Document:
         """Uploads a document.
 
         Args:
@@ -1817,6 +2239,7 @@ class Document(Base):
             document_type (DocumentType): The document type.
             creator (CrewMember): The crew member who uploaded the document.
             description (str, Optional): The description of the document. Defaults to None.
+            expiration_date (datetime.datetime, Optional): The date the document expires. Defaults to None, for documents that do not expire.
 
         Returns:
             Document: The uploaded document.
@@ -1825,7 +2248,8 @@ class Document(Base):
         file_data = Document.convert_to_bytes(file_path)
         x = global_session.query(Document).filter(Document.name == name, Document.type_ == document_type).first()
         if x: raise DocumentExistsError(f"A document with the name {name} already exists.")
-        new_document = Document(name=name, file_extension=file_extension, file_data=file_data, creator=creator, type_=document_type, description=description)
+        new_document = Document(name=name, file_extension=file_extension, file_data=file_data, creator=creator, type_=document_type, description=description,
+                                expiration_date=expiration_date)
         global_session.add(new_document)
         global_session.commit()
 
@@ -1862,6 +2286,46 @@ class CrewMemberToDocument(Base):
     document = relationship("Document") # type: Document
 
 
+class CrewCompliance(Base):
+    """Precomputed document compliance of a crew member in a role.
+        A row is deleted whenever the crew member's documents or roles change, and compliance recomputes it on the next check.
+        A row also goes stale once its earliest expiring document expires.
+    """
+    __tablename__ = "crew_compliance"
+
+    crew_member_id = Column(Integer, ForeignKey("crew_member.id"), primary_key=True)
+    role_id = Column(Integer, ForeignKey("crew_member_role.id"), primary_key=True)
+    compliant = Column(Boolean, nullable=False)
+    reasons = Column(String(1024), nullable=False, default="")
+    """Why the crew member is not compliant, one reason per line."""
+    valid_until = Column(DateTime)
+    """Expiration date of the required document. None if the role needs no document or the document does not expire."""
+    date_computed = Column(DateTime, default=datetime.datetime.now)
+
+    @property
+    def reason_list(self) -> list[str]:
+        return [reason for reason in self.reasons.split("\n") if reason]
+
+    def is_stale(self, now: datetime.datetime) -> bool:
+        """Returns whether the required document expired since the row was computed."""
+        return self.compliant and self.valid_until is not None and self.valid_until <= now
+
+    @staticmethod
+    def invalidate(crew_member_ids: list[int]=None, role_ids: list[int]=None) -> None:
+        """Deletes the compliance of crew members so it is recomputed on the next check. Does not commit.
+
+        Args:
+            crew_member_ids (list[int], Optional): The crew members to invalidate. Defaults to every crew member.
+            role_ids (list[int], Optional): Only invalidate these roles. Defaults to every role.
+        """
+        query = global_session.query(CrewCompliance)
+        if crew_member_ids is not None:
+            query = query.filter(CrewCompliance.crew_member_id.in_(crew_member_ids))
+        if role_ids is not None:
+            query = query.filter(CrewCompliance.role_id.in_(role_ids))
+        query.delete(synchronize_session=False)
+
+
 class CrewMember(Base):
     """Represents a crew member."""
     __tablename__ = "crew_member"
@@ -1908,6 +2372,7 @@ class CrewMember(Base):
         x = global_session.query(CrewMemberToDocument).filter(CrewMemberToDocument.crew_member_id == self.id, CrewMemberToDocument.document_id == document.id).first()
         if x: return
         global_session.add(CrewMemberToDocument(crew_member_id=self.id, document_id=document.id))
+        CrewCompliance.invalidate([self.id])
         global_session.commit()
     
     def remove_document(self, document: Document) -> None:
@@ -1920,6 +2385,7 @@ class CrewMember(Base):
         x = global_session.query(CrewMemberToDocument).filter(CrewMemberToDocument.crew_member_id == self.id, CrewMemberToDocument.document_id == document.id).first()
         if not x: return
         global_session.delete(x)
+        CrewCompliance.invalidate([self.id])
         global_session.commit()
     
     def add_role(self, role: CrewMemberRole) -> None:
@@ -1931,6 +2397,7 @@ class CrewMember(Base):
         x = global_session.query(CrewMemberToRole).filter(CrewMemberToRole.crew_member_id == self.id, CrewMemberToRole.role_id == role.id).first()
         if x: return
         global_session.add(CrewMemberToRole(crew_member_id=self.id, role_id=role.id))
+        CrewCompliance.invalidate([self.id])
         global_session.commit()
     
     def remove_role(self, role: CrewMemberRole) -> None:
@@ -1943,6 +2410,7 @@ class CrewMember(Base):
         x = global_session.query(CrewMemberToRole).filter(CrewMemberToRole.crew_member_id == self.id, CrewMemberToRole.role_id == role.id).first()
         if not x: return
         global_session.delete(x)
+        CrewCompliance.invalidate([self.id])
         global_session.commit()
     
     @staticmethod
@@ -1981,15 +2449,249 @@ class CrewMember(Base):
 
 
 
+class ChangeLog(Base):
+    """A committed write to a record, logged by the session hooks below so the other workstations can refresh their views."""
+    __tablename__ = "change_log"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    client_id = Column(String(16), nullable=False)
+    """The process that made the write, see events.CLIENT_ID."""
+    table_name = Column(String(64), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    operation = Column(String(6), nullable=False)
+    fields = Column(String(1024), nullable=False, default="")
+    """Columns an update changed, comma separated."""
+    date_created = Column(DateTime, default=datetime.datetime.now, index=True)
+
+    @property
+    def change_event(self) -> events.ChangeEvent:
+        return events.ChangeEvent(self.table_name, self.row_id, self.operation, frozenset(filter(None, self.fields.split(","))), self.client_id != events.CLIENT_ID)
+
+    @staticmethod
+    def latest_id() -> int:
+        """Returns the id of the last write logged, 0 if none."""
+        return global_session.query(func.max(ChangeLog.id)).scalar() or 0
+
+    @staticmethod
+    def since(cursor: ChangeLogCursor, limit: int=500) -> list[ChangeLog]:
+        """Returns the writes logged that a reader did not read yet, oldest first."""
+        return global_session.query(ChangeLog).filter(cursor.unread()).order_by(ChangeLog.id).limit(limit).all()
+
+    @staticmethod
+    def prune(before: datetime.datetime) -> None:
+        """Deletes the writes logged before a date, which every open workstation has read by then."""
+        global_session.query(ChangeLog).filter(ChangeLog.date_created < before).delete(synchronize_session=False)
+        global_session.commit()
+
+
+CHANGE_LOG_GAP_TIMEOUT = datetime.timedelta(minutes=10)
+"""How long a reader of the change log waits for an id it skipped, see ChangeLogCursor."""
+
+
+@dataclass
+class ChangeLogCursor:
+    """How far a reader got in the change log. Ids are handed out before their transactions commit, so an entry can show up after a higher one.
+        The ids skipped are read again until they show up, or for CHANGE_LOG_GAP_TIMEOUT: the transactions rolled back leave gaps for good.
+    """
+    last_id: int = 0
+    gaps: dict[int, datetime.datetime] = field(default_factory=dict)
+    """Ids below last_id not read yet, with when they were first skipped."""
+
+    def unread(self):
+        """Returns the filter of the change log entries not read yet."""
+        if not self.gaps:
+            return ChangeLog.id > self.last_id
+        return or_(ChangeLog.id > self.last_id, ChangeLog.id.in_(list(self.gaps)))
+
+    def advance(self, ids: list[int], now: datetime.datetime=None) -> None:
+        """Moves past the entries read, in id order."""
+        now = now or datetime.datetime.now()
+        for id_ in ids:
+            if id_ > self.last_id:
+                self.gaps.update((skipped, now) for skipped in range(self.last_id + 1, id_))
+                self.last_id = id_
+            else:
+                self.gaps.pop(id_, None)
+        self.gaps = {id_: skipped_at for id_, skipped_at in self.gaps.items() if now - skipped_at < CHANGE_LOG_GAP_TIMEOUT}
+
+
+UNLOGGED_TABLES = ("change_log", "asset_readiness", "crew_compliance", "drone_flight_time", "flight_telemetry_block")
+"""Tables whose writes are not published: the change log itself, the caches derived from other tables, and the telemetry samples."""
+
+
+def is_logged(table) -> bool:
+    """Returns whether writes to a table are published. Only tables keyed by id are, see changes_of for the link tables."""
+    return table.name not in UNLOGGED_TABLES and [column.name for column in table.primary_key] == ["id"]
+
+
+def changes_of(table, row, operation: str, fields: frozenset[str]=frozenset()) -> list[events.ChangeEvent]:
+    """Returns the events of a write to a row, given as a mapping of its columns.
+        A link row, keyed by the ids of the records it links, is published as an update of each of those records, with the link table as field.
+    """
+    if is_logged(table):
+        return [events.ChangeEvent(table.name, row["id"], operation, fields)]
+    if table.name in UNLOGGED_TABLES: return []
+    return [events.ChangeEvent(foreign_key.column.table.name, row[foreign_key.parent.name], events.UPDATE, frozenset({table.name}))
+            for foreign_key in table.foreign_keys
+            if foreign_key.parent.primary_key and is_logged(foreign_key.column.table) and row[foreign_key.parent.name] is not None]
+
+
+def log_changes(connection, changes: list[events.ChangeEvent]) -> None:
+    """Inserts writes in change_log, on the connection of the transaction that makes them. Does not publish them."""
+    if not changes: return
+    now = datetime.datetime.now()
+    connection.execute(ChangeLog.__table__.insert(), [
+        {"client_id": events.CLIENT_ID, "table_name": change.entity, "row_id": change.id, "operation": change.operation,
+         "fields": ",".join(sorted(change.fields))[:1024], "date_created": now}
+        for change in changes
+    ])
+
+
+def log_bulk_write(models: list) -> None:
+    """Logs and publishes the writes of bulk inserts and updates, which skip the session hooks, as an update of each whole table.
+        Commits global_session, after the bulk writes committed.
+    """
+    changes = [events.ChangeEvent(model.__tablename__, events.TABLE_ID, events.UPDATE) for model in models]
+    global_session.info.setdefault("changes", []).extend(changes)
+    if not _is_replica(global_session):
+        log_changes(global_session.connection(), changes)
+    global_session.commit()
+
+
+def _changed_fields(record) -> frozenset[str]:
+    state = inspect(record)
+    return frozenset(attribute.key for attribute in state.mapper.column_attrs if state.attrs[attribute.key].history.has_changes())
+
+
+def _is_replica(session: session_type_hint) -> bool:
+    """Returns whether a session works on the program's replica. Its writes are logged in the database's change log when the sync pushes them."""
+    replica = offlinesync.active_replica
+    return replica is not None and str(session.get_bind().url) == replica.local_config.database_url
+
+
+@event.listens_for(Session, "after_flush")
+def _log_changes(session: session_type_hint, flush_context) -> None:
+    """Logs the records written by a flush in change_log, in the same transaction, and keeps their events until it commits.
+        On the replica the events are only kept, nothing reads its change log.
+    """
+    changes = [] # type: list[events.ChangeEvent]
+    for operation, records in ((events.INSERT, session.new), (events.UPDATE, session.dirty), (events.DELETE, session.deleted)):
+        for record in records:
+            table = getattr(record, "__table__", None)
+            if table is None: continue
+            fields = frozenset()
+            if operation == events.UPDATE:
+                fields = _changed_fields(record)
+                if not fields: continue
+            changes += changes_of(table, {column.name: getattr(record, column.key) for column in table.primary_key}, operation, fields)
+    if not changes: return
+    session.info.setdefault("changes", []).extend(changes)
+    if not _is_replica(session):
+        log_changes(session.connection(), changes)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session: session_type_hint) -> None:
+    events.publish(session.info.pop("changes", []))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session: session_type_hint) -> None:
+    session.info.pop("changes", None)
+
+
+
+import readiness
+import compliance
+import weightbalance
+import offlinesync
+
+
 def create_tables():
     Base.metadata.create_all(engine)
     create_default_data()
 
+def _backfill_flight_date_modified() -> None:
+    # Flights last changed before the column existed count as changed on the day they flew.
+    global_session.query(Flight).filter(Flight.date_modified == None)\
+        .update({Flight.date_modified: func.coalesce(Flight.date, datetime.datetime.now())}, synchronize_session=False)
+    global_session.commit()
+
+MIGRATION_BACKFILLS = {
+    "flight.date_modified": _backfill_flight_date_modified,
+    "flight.geohash": Flight.update_geohashes,
+    "drone_scheduled_task.flight_time_since_done": DroneFlightTime.rebuild,
+}
+"""Fill in a column added by migrate on the existing rows, by table.column."""
+
+
+def _column_definition(column: Column, dialect) -> str:
+    """Returns the definition of a column for ALTER TABLE ADD COLUMN."""
+    definition = f"{dialect.identifier_preparer.format_column(column)} {column.type.compile(dialect=dialect)}"
+    if not column.nullable:
+        # The existing rows need a value, the column's default or its backfill.
+        default = column.default.arg if column.default is not None and column.default.is_scalar else None
+        if default is not None:
+            definition += " DEFAULT " + str(literal(default, column.type).compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+        definition += " NOT NULL"
+    if dialect.name == "sqlite":
+        # SQLite can not add a constraint to a table, only a column along with its own.
+        for foreign_key in column.foreign_keys:
+            definition += f" REFERENCES {dialect.identifier_preparer.format_table(foreign_key.column.table)} ({dialect.identifier_preparer.format_column(foreign_key.column)})"
+    return definition
+
+def migrate(bind=None) -> list[str]:
+    """Adds the columns and indexes of the models missing from the tables of a database created by an earlier version, which create_all
+        leaves as they are, then fills in the added columns of the existing rows. Run after create_all.
+
+    Args:
+        bind (Optional): The engine of the database. Defaults to the program's.
+
+    Returns:
+        list[str]: The columns added, as table.column.
+    """
+    bind = bind if bind is not None else engine
+    inspector = inspect(bind)
+    tables = set(inspector.get_table_names())
+    added = []
+    with bind.begin() as connection:
+        table_name = connection.dialect.identifier_preparer.format_table
+        for table in Base.metadata.sorted_tables:
+            if table.name not in tables: continue
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            new_columns = set()
+            for column in table.columns:
+                if column.name in columns: continue
+                connection.exec_driver_sql(f"ALTER TABLE {table_name(table)} ADD COLUMN {_column_definition(column, connection.dialect)}")
+                added.append(f"{table.name}.{column.name}")
+                new_columns.add(column.name)
+            if new_columns and connection.dialect.name != "sqlite":
+                for constraint in table.foreign_key_constraints:
+                    if {column.name for column in constraint.columns} <= new_columns:
+                        connection.execute(AddConstraint(constraint))
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(connection)
+    if added:
+        with Session(bind=bind) as session, use_session(session):
+            for column in added:
+                if column in MIGRATION_BACKFILLS:
+                    MIGRATION_BACKFILLS[column]()
+    return added
+
+def check_default_data():
+    """Creates missing tables and columns, and the default data if it was never created. Cheaper than create_tables on a database that is already set up."""
+    Base.metadata.create_all(engine)
+    migrate()
+    if global_session.query(FlightStatus.id).first() is None:
+        create_default_data()
+
 def drop_tables():
     Base.metadata.drop_all(engine)
 
 def create_test_data():
-    with Session() as session:
+    with Session() as session, use_session(session):
         batteries = [
             Battery(
                 charge_cycle_count=10,
@@ -2092,8 +2794,8 @@ def create_default_data():
     FlightOperationType.create_defaults()
     FlightType.create_defaults()
     FlightStatus.create_defaults()
-    CrewMemberRole.create_defaults()
     DocumentType.create_defaults()
+    CrewMemberRole.create_defaults()
     BatteryChemistry.create_defaults()
     Image.create_defaults()
     DroneGeometry.create_defaults()
@@ -2101,7 +2803,7 @@ def create_default_data():
 
 
 def force_recreate():
-    if DATABASE_URL.startswith("mysql"):
+    if DATABASE_CONFIG.database_url.startswith("mysql"):
         temp_engine = create_engine(DATABASE_URL_WITHOUT_SCHEMA)
         temp_engine.execute(f"CREATE DATABASE IF NOT EXISTS {SCHEMA} DEFAULT CHARACTER SET utf8 COLLATE utf8_bin")
         temp_engine.dispose()
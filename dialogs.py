@@ -4,7 +4,9 @@ from dataclasses import dataclass, field
 from PyQt5 import QtCore, QtGui, QtWidgets
 
 
+import os
 import utilities
+import bulkimport
 from database import global_session, generate_random_string, Battery, Drone, DroneGeometry, Flight, FlightController, BatteryChemistry, Equipment, EquipmentType, Equipment
 from customwidgets import CustomQTableWidget
 from app import THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT
@@ -704,4 +706,72 @@ class SelectFlightEquipmentDialog(QtWidgets.QDialog):
         if self.equipment and self.equipment.id != new_equipment.id:
             self.flight.remove_equipment(self.equipment)
         self.flight.add_equipment(new_equipment)
-        self.close()
\ No newline at end of file
+        self.close()
+
+
+class ImportDialog(QtWidgets.QDialog):
+    RECORD_TYPES = {
+        "Batteries": "battery",
+        "Equipment": "equipment",
+        "Flight Controllers": "flight_controller",
+        "Drones": "drone",
+        "Flights": "flight",
+    }
+
+    def __init__(self, parent=None):
+        super(ImportDialog, self).__init__(parent)
+        self.setWindowTitle("Import Records")
+
+        self.result = None # type: bulkimport.ImportResult
+
+        self.main_layout = QtWidgets.QVBoxLayout()
+        self.setLayout(self.main_layout)
+        self.main_layout.addWidget(QtWidgets.QLabel("Import records from a CSV or Excel file. Column headers must match the field names."))
+
+        self.record_type_combobox = QtWidgets.QComboBox()
+        self.record_type_combobox.addItems(list(self.RECORD_TYPES.keys()))
+        self.file_path_input = QtWidgets.QLineEdit()
+        self.browse_button = QtWidgets.QPushButton("Browse")
+        self.browse_button.setFixedWidth(75)
+        self.browse_button.clicked.connect(self.browse)
+
+        form_layout = QtWidgets.QFormLayout()
+        form_layout.addRow(QtWidgets.QLabel("Record Type:"), self.record_type_combobox)
+        h_layout = QtWidgets.QHBoxLayout()
+        h_layout.addWidget(self.file_path_input, stretch=1)
+        h_layout.addWidget(self.browse_button)
+        form_layout.addRow(QtWidgets.QLabel("File:"), h_layout)
+        self.main_layout.addLayout(form_layout)
+
+        self.import_button = QtWidgets.QPushButton("Import")
+        self.import_button.clicked.connect(self.save)
+        self.main_layout.addWidget(self.import_button)
+
+    def browse(self) -> None:
+        file_path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Select File", "", "Data Files (*.csv *.xlsx)")
+        if file_path:
+            self.file_path_input.setText(file_path)
+
+    def save(self) -> None:
+        file_path = self.file_path_input.text().strip()
+        if not os.path.isfile(file_path):
+            QtWidgets.QMessageBox.warning(self, "Error", "Please select a file to import.")
+            return
+
+        spec = bulkimport.ImportSpec(record_type=self.RECORD_TYPES[self.record_type_combobox.currentText()])
+        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            self.result = bulkimport.import_file(file_path, spec)
+        except Exception as error:
+            QtWidgets.QApplication.restoreOverrideCursor()
+            QtWidgets.QMessageBox.critical(self, "Error", str(error))
+            return
+        QtWidgets.QApplication.restoreOverrideCursor()
+
+        message = f"Imported {self.result.imported} of {self.result.total_rows} rows."
+        if self.result.rejected:
+            report_path = os.path.splitext(file_path)[0] + "_rejected.csv"
+            self.result.write_rejected_report(report_path)
+            message += f"\n{len(self.result.rejected)} rows were rejected. See {report_path}."
+        QtWidgets.QMessageBox.information(self, "Import Complete", message)
+        self.close()
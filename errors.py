@@ -64,4 +64,40 @@ class DeleteEquipmentError(Error):
 
 class DeleteDroneError(Error):
     """Raised when a drone can not be deleted from the database."""
-    pass
\ No newline at end of file
+    pass
+
+class ImportRowError(Error):
+    """Raised when a row of an imported file is invalid."""
+    pass
+
+class TelemetryLogError(Error):
+    """Raised when a telemetry log can not be read."""
+    pass
+
+class FlightNotReadyError(Error):
+    """Raised when a flight can not start because an asset is not airworthy or is overdue for maintenance, a crew member is missing a required document or the payload is too heavy."""
+    pass
+
+class WeatherSourceError(Error):
+    """Raised when a weather source can not be read."""
+    pass
+
+class RecordNotFoundError(Error):
+    """Raised when a record looked up by id does not exist."""
+    pass
+
+class InvalidArgumentError(Error):
+    """Raised when an operation is given an argument it does not accept."""
+    pass
+
+class ReplicaError(Error):
+    """Raised when the local replica of the database can not be created or used."""
+    pass
+
+class LabelPrintError(Error):
+    """Raised when a label can not be printed or written to a file."""
+    pass
+
+class DatabaseConfigError(Error):
+    """Raised when the settings of the database are missing from the config file and the environment."""
+    pass
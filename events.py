@@ -0,0 +1,72 @@
+"""Change notifications, so open views patch the records that changed instead of reloading.
+
+The session hooks of the database module publish a ChangeEvent for each record inserted, updated or deleted once its transaction commits,
+and log it in the change_log table. ChangeLog.since reads the log back, which the GUI polls to publish the writes of the other workstations.
+Bulk writes, like the imports, skip the session hooks. database.log_bulk_write logs and publishes them as one event per table written,
+with the id TABLE_ID: the subscribers reload the table instead of patching records.
+"""
+from __future__ import annotations
+import logging
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, Iterable
+
+
+INSERT = "insert"
+UPDATE = "update"
+DELETE = "delete"
+TABLE_ID = 0
+"""Id of the events of bulk writes, which may have changed any record of their table. Record ids start at 1."""
+CLIENT_ID = uuid.uuid4().hex[:16]
+"""Identifies this process in the change log, so it can skip its own writes there."""
+
+logger = logging.getLogger(__name__)
+_subscribers = {} # type: dict[str, list[Callable[[list[ChangeEvent]], None]]]
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    """A committed write to a record."""
+    entity: str
+    """Table name of the record."""
+    id: int
+    operation: str
+    """INSERT, UPDATE or DELETE."""
+    fields: frozenset[str] = field(default_factory=frozenset)
+    """Columns an update changed. Empty for inserts and deletes."""
+    remote: bool = False
+    """Whether another workstation made the write."""
+
+
+def subscribe(entity: str, callback: Callable[[list[ChangeEvent]], None]) -> None:
+    """Calls back with the events of a table each time writes to it are published, on the thread that committed them."""
+    callbacks = _subscribers.setdefault(entity, [])
+    if callback not in callbacks:
+        callbacks.append(callback)
+
+
+def unsubscribe(entity: str, callback: Callable[[list[ChangeEvent]], None]) -> None:
+    if callback in _subscribers.get(entity, []):
+        _subscribers[entity].remove(callback)
+
+
+def call_on_change(entities: Iterable[str], function: Callable[[], None]) -> Callable[[list[ChangeEvent]], None]:
+    """Subscribes a function without arguments, like a cache's invalidate, to the writes of several tables. Returns the callback subscribed."""
+    def callback(changes: list[ChangeEvent]) -> None:
+        function()
+    for entity in entities:
+        subscribe(entity, callback)
+    return callback
+
+
+def publish(events: list[ChangeEvent]) -> None:
+    """Calls the subscribers of each table once with its events, in order. A failing subscriber is logged, the write is already committed."""
+    by_entity = {} # type: dict[str, list[ChangeEvent]]
+    for change in events:
+        by_entity.setdefault(change.entity, []).append(change)
+    for entity, entity_events in by_entity.items():
+        for callback in list(_subscribers.get(entity, [])):
+            try:
+                callback(entity_events)
+            except Exception:
+                logger.exception("Change subscriber of %s failed", entity)
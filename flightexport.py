@@ -0,0 +1,316 @@
+"""Columnar (Parquet) export of the flight log for analytics."""
+from __future__ import annotations
+import datetime
+import json
+import os
+
+from sqlalchemy import and_, or_
+
+from database import (global_session, Flight, Drone, Battery, BatteryChemistry, Weather, FlightType, FlightStatus, LegalRule,
+                      FlightOperationType, FlightOperationApproval, CrewMember, CrewMemberToFlight, CrewMemberRole, SCHEMA)
+from errors import MissingRequiredSoftwareError
+
+pyarrow = None
+"""Imported by _check_pyarrow on the first export."""
+
+
+ROW_GROUP_SIZE = 50000
+"""Number of flights written per Parquet row group."""
+STATE_FILE_NAME = "_export_state.json"
+"""Keeps track of the last change exported to an incremental dataset folder, and of its part files in export order."""
+
+
+def _string():
+    return pyarrow.string()
+
+def _category():
+    return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+
+def _float():
+    return pyarrow.float64()
+
+def _int():
+    return pyarrow.int32()
+
+def _long():
+    return pyarrow.int64()
+
+def _bool():
+    return pyarrow.bool_()
+
+def _timestamp():
+    return pyarrow.timestamp("ms")
+
+
+# (column name, query expression, arrow type)
+# Categorical fields with a small set of values are dictionary encoded.
+COLUMNS = [
+    ("flight_id", Flight.id, _long),
+    ("uuid", Flight.uuid, _string),
+    ("name", Flight.name, _string),
+    ("date", Flight.date, _timestamp),
+    ("active", Flight.active, _bool),
+    ("duration", Flight.duration, _float),
+    ("distance_traveled", Flight.distance_traveled, _float),
+    ("max_agl_altitude", Flight.max_agl_altitude, _float),
+    ("location_latitude", Flight.location_latitude, _float),
+    ("location_longitude", Flight.location_longitude, _float),
+    ("address", Flight.address, _string),
+    ("night_flight", Flight.night_flight, _bool),
+    ("encounter_with_law", Flight.encounter_with_law, _bool),
+    ("external_case_id", Flight.external_case_id, _string),
+    ("utm_authorization", Flight.utm_authorization, _string),
+    ("flight_type", FlightType.name, _category),
+    ("flight_status", FlightStatus.name, _category),
+    ("legal_rule", LegalRule.name, _category),
+    ("operation_type", FlightOperationType.name, _category),
+    ("operation_approval", FlightOperationApproval.name, _category),
+    ("drone_serial_number", Drone.serial_number, _category),
+    ("drone_name", Drone.name, _category),
+    ("drone_brand", Drone.brand, _category),
+    ("drone_model", Drone.model, _category),
+    ("drone_weight", Drone.weight, _float),
+    ("battery_serial_number", Battery.serial_number, _category),
+    ("battery_name", Battery.name, _category),
+    ("battery_chemistry", BatteryChemistry.code, _category),
+    ("battery_capacity", Battery.capacity, _int),
+    ("battery_cell_count", Battery.cell_count, _int),
+    ("battery_weight", Battery.weight, _float),
+    ("weather_temperature", Weather.temperature, _float),
+    ("weather_wind_speed", Weather.wind_speed, _float),
+    ("weather_wind_direction", Weather.wind_direction, _float),
+    ("weather_humidity", Weather.humidity, _float),
+    ("weather_pressure", Weather.pressure, _float),
+    ("weather_visibility", Weather.visibility, _float),
+    ("weather_cloud_cover", Weather.cloud_cover, _float),
+]
+
+CREW_COLUMN = "crew"
+"""List of the crew members on the flight, as structs of username, full name and role."""
+
+
+def schema() -> pyarrow.Schema:
+    """Returns the Arrow schema of the exported flight log."""
+    _check_pyarrow()
+    fields = [pyarrow.field(name, type_()) for name, _, type_ in COLUMNS]
+    crew_type = pyarrow.list_(pyarrow.struct([
+        ("username", pyarrow.string()),
+        ("full_name", pyarrow.string()),
+        ("role", pyarrow.string()),
+    ]))
+    fields.append(pyarrow.field(CREW_COLUMN, crew_type))
+    return pyarrow.schema(fields)
+
+
+def _check_pyarrow() -> None:
+    """Imports pyarrow on first use, it is slow to import."""
+    global pyarrow
+    if pyarrow is not None: return
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise MissingRequiredSoftwareError("Missing required python package pyarrow. Please install it to export the flight log.")
+
+
+def _flight_query(after: tuple[datetime.datetime, int]=None):
+    """Returns a query of the flight log joined with its lookup tables, as plain rows of the COLUMNS followed by the flight's date_modified.
+
+    Args:
+        after (tuple[datetime.datetime, int], Optional): Only the flights modified after this (date_modified, flight id), ordered by them.
+            A date_modified of None starts before every flight. Defaults to every flight, ordered by id.
+    """
+    query = global_session.query(*[expression for _, expression, _ in COLUMNS], Flight.date_modified)\
+        .select_from(Flight)\
+        .join(Drone, Flight.drone_id == Drone.id)\
+        .join(FlightType, Flight.type_id == FlightType.id)\
+        .join(FlightStatus, Flight.status_id == FlightStatus.id)\
+        .join(LegalRule, Flight.legal_rule_id == LegalRule.id)\
+        .join(FlightOperationType, Flight.operation_type_id == FlightOperationType.id)\
+        .join(FlightOperationApproval, Flight.operation_approval_id == FlightOperationApproval.id)\
+        .outerjoin(Battery, Flight.battery_id == Battery.id)\
+        .outerjoin(BatteryChemistry, Battery.chemistry_id == BatteryChemistry.id)\
+        .outerjoin(Weather, Weather.flight_id == Flight.id)
+
+    if after is None:
+        return query.order_by(Flight.id)
+    date_modified, flight_id = after
+    if date_modified is None:
+        # Flights without a date_modified sort first.
+        query = query.filter(or_(Flight.date_modified != None, Flight.id > flight_id))
+    else:
+        # Flights modified within the same instant are told apart by their id.
+        query = query.filter(or_(Flight.date_modified > date_modified, and_(Flight.date_modified == date_modified, Flight.id > flight_id)))
+    return query.order_by(Flight.date_modified, Flight.id)
+
+
+def _flight_batches(after: tuple[datetime.datetime, int]=None, batch_size: int=ROW_GROUP_SIZE):
+    """Yields the rows of _flight_query in batches, each loaded by its own keyset query.
+        Unlike a streamed result, no query is left open while a batch is written, so the crew of the batch can be queried on the same connection.
+
+    Args:
+        after (tuple[datetime.datetime, int], Optional): See _flight_query.
+    """
+    last_id = 0
+    while True:
+        if after is None:
+            rows = _flight_query().filter(Flight.id > last_id).limit(batch_size).all()
+        else:
+            rows = _flight_query(after).limit(batch_size).all()
+        if not rows: return
+        yield rows
+        last_id = rows[-1][0]
+        if after is not None:
+            after = (rows[-1][-1], last_id)
+
+
+def _crew_by_flight(flight_ids: list[int]) -> dict[int, list[dict]]:
+    """Loads the crew of a batch of flights with a single query."""
+    crew = {} # type: dict[int, list[dict]]
+    rows = global_session.query(CrewMemberToFlight.flight_id, CrewMember.username, CrewMember.first_name, CrewMember.last_name, CrewMemberRole.name)\
+        .join(CrewMember, CrewMemberToFlight.crew_member_id == CrewMember.id)\
+        .join(CrewMemberRole, CrewMemberToFlight.role_id == CrewMemberRole.id)\
+        .filter(CrewMemberToFlight.flight_id.in_(flight_ids))\
+        .all()
+    for flight_id, username, first_name, last_name, role in rows:
+        crew.setdefault(flight_id, []).append({"username": username, "full_name": f"{first_name} {last_name}", "role": role})
+    return crew
+
+
+def _write_row_group(writer: pyarrow.parquet.ParquetWriter, rows: list[tuple]) -> None:
+    """Converts a batch of query rows to columns and writes them as one row group."""
+    columns = {name: [row[index] for row in rows] for index, (name, _, _) in enumerate(COLUMNS)}
+    crew = _crew_by_flight(columns["flight_id"])
+    columns[CREW_COLUMN] = [crew.get(flight_id, []) for flight_id in columns["flight_id"]]
+    writer.write_table(pyarrow.Table.from_pydict(columns, schema=writer.schema))
+
+
+def _write(file_path: str, after: tuple[datetime.datetime, int]=None, row_group_size: int=ROW_GROUP_SIZE) -> tuple[int, tuple[datetime.datetime, int]]:
+    """Streams the flight log into a Parquet file.
+
+    Args:
+        after (tuple[datetime.datetime, int], Optional): See _flight_query.
+
+    Returns:
+        tuple[int, tuple[datetime.datetime, int]]: The number of flights written and the (date_modified, flight id) of the last one written.
+    """
+    _check_pyarrow()
+    total = 0
+    last = after
+
+    with pyarrow.parquet.ParquetWriter(file_path, schema(), compression="zstd") as writer:
+        for rows in _flight_batches(after, row_group_size):
+            _write_row_group(writer, rows)
+            total += len(rows)
+            last = (rows[-1][-1], rows[-1][0])
+
+    return total, last
+
+
+def export_flights(file_path: str, row_group_size: int=ROW_GROUP_SIZE) -> int:
+    """Exports the entire flight log to a single Parquet file.
+
+    Args:
+        file_path (str): The path of the Parquet file to write.
+        row_group_size (int, Optional): The number of flights per row group. Defaults to ROW_GROUP_SIZE.
+
+    Raises:
+        MissingRequiredSoftwareError: If pyarrow is not installed.
+
+    Returns:
+        int: The number of flights exported.
+    """
+    total, _ = _write(file_path, row_group_size=row_group_size)
+    return total
+
+
+def read_export_state(folder_path: str) -> dict:
+    """Returns the state of an incremental export folder, or an empty dict if nothing was exported yet."""
+    state_path = os.path.join(folder_path, STATE_FILE_NAME)
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, "r") as f:
+        return json.load(f)
+
+
+def _deleted_flight_ids(folder_path: str, state: dict) -> list[int]:
+    """Returns the ids of the flights exported to a folder that were deleted since, including those already recorded in its state."""
+    exported = set(state.get("deleted_flight_ids", []))
+    for file_name in state.get("parts", []):
+        table = pyarrow.parquet.read_table(os.path.join(folder_path, file_name), columns=["flight_id"])
+        exported.update(table["flight_id"].to_pylist())
+    if not exported:
+        return []
+    existing = {flight_id for flight_id, in global_session.query(Flight.id)}
+    return sorted(exported - existing)
+
+
+def export_flights_incremental(folder_path: str, row_group_size: int=ROW_GROUP_SIZE) -> str:
+    """Exports the flights added or modified since the last export to a Parquet dataset folder.
+        Each run writes a new part file. A flight modified after it was exported is in several parts, read_flights keeps its latest row.
+        The flights deleted since they were exported are recorded in the folder's state, read_flights leaves them out.
+
+    Args:
+        folder_path (str): The dataset folder.
+        row_group_size (int, Optional): The number of flights per row group. Defaults to ROW_GROUP_SIZE.
+
+    Raises:
+        MissingRequiredSoftwareError: If pyarrow is not installed.
+
+    Returns:
+        str: The path of the new part file, or None if no flight was added or modified.
+    """
+    _check_pyarrow()
+    if not os.path.exists(folder_path):
+        os.makedirs(folder_path)
+
+    state = read_export_state(folder_path)
+    deleted_flight_ids = _deleted_flight_ids(folder_path, state)
+    last_modified = state.get("last_modified")
+    after = (datetime.datetime.fromisoformat(last_modified) if last_modified else None, state.get("last_flight_id", 0))
+
+    now = datetime.datetime.now()
+    file_name = f"{SCHEMA}_flights_{now:%Y%m%d%H%M%S%f}.parquet"
+    file_path = os.path.join(folder_path, file_name)
+    total, last = _write(file_path, after=after, row_group_size=row_group_size)
+
+    if total == 0:
+        os.remove(file_path)
+        file_path = None
+        if deleted_flight_ids == state.get("deleted_flight_ids", []):
+            return None
+
+    last_modified, last_flight_id = last
+    state = {
+        "last_modified": last_modified.isoformat() if last_modified is not None else None,
+        "last_flight_id": last_flight_id,
+        "last_export_date": now.isoformat(),
+        "total_rows": state.get("total_rows", 0) + total,
+        "parts": state.get("parts", []) + ([file_name] if file_path else []),
+        "deleted_flight_ids": deleted_flight_ids,
+    }
+    with open(os.path.join(folder_path, STATE_FILE_NAME), "w") as f:
+        json.dump(state, f, indent=4)
+    return file_path
+
+
+def read_flights(folder_path: str) -> pyarrow.Table:
+    """Reads an incremental export folder, with the latest exported row of each flight that was not deleted.
+
+    Raises:
+        MissingRequiredSoftwareError: If pyarrow is not installed.
+    """
+    _check_pyarrow()
+    import pyarrow.compute
+    state = read_export_state(folder_path)
+    seen = pyarrow.array(state.get("deleted_flight_ids", []), pyarrow.int64())
+    tables = []
+    # Newest part first, so a flight's latest row is the first one met.
+    for file_name in reversed(state.get("parts", [])):
+        table = pyarrow.parquet.read_table(os.path.join(folder_path, file_name), schema=schema())
+        table = table.filter(pyarrow.compute.invert(pyarrow.compute.is_in(table["flight_id"], value_set=seen)))
+        seen = pyarrow.concat_arrays([seen, table["flight_id"].combine_chunks()])
+        tables.append(table)
+    if not tables:
+        return schema().empty_table()
+    return pyarrow.concat_tables(reversed(tables)).sort_by("flight_id")
@@ -0,0 +1,158 @@
+"""Geohash encoding and the geometry used by the flight location queries."""
+from __future__ import annotations
+import math
+from dataclasses import dataclass
+
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 9
+"""Number of characters of a stored geohash. A 9 character cell is about 5 by 5 meters."""
+MAX_PREFIXES = 32
+"""Maximum number of geohash prefixes a query area is covered with."""
+EARTH_RADIUS = 6371008.8
+"""Mean radius of the earth in meters."""
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+
+def encode(latitude: float, longitude: float, precision: int=GEOHASH_PRECISION) -> str:
+    """Encodes a coordinate as a geohash.
+
+    Raises:
+        ValueError: If the coordinate is out of range.
+    """
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ValueError(f"Invalid coordinate {latitude}, {longitude}.")
+
+    latitude_range, longitude_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, value, even = [], 0, 0, True
+    while len(geohash) < precision:
+        # Bits alternate between longitude and latitude, starting with longitude.
+        interval, coordinate = (longitude_range, longitude) if even else (latitude_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            geohash.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(geohash)
+
+
+def encode_or_none(latitude: float, longitude: float) -> str:
+    """Same as encode, but returns None for a missing or invalid coordinate instead of raising."""
+    if latitude is None or longitude is None: return None
+    try:
+        return encode(latitude, longitude)
+    except ValueError:
+        return None
+
+
+def cell_size(precision: int) -> tuple[float, float]:
+    """Returns the height and width in degrees of a geohash cell."""
+    longitude_bits = math.ceil(precision * 5 / 2)
+    latitude_bits = precision * 5 // 2
+    return 180 / 2 ** latitude_bits, 360 / 2 ** longitude_bits
+
+
+def distance(latitude_1: float, longitude_1: float, latitude_2: float, longitude_2: float) -> float:
+    """Returns the great circle distance in meters between two coordinates."""
+    latitude_1, longitude_1, latitude_2, longitude_2 = map(math.radians, (latitude_1, longitude_1, latitude_2, longitude_2))
+    a = math.sin((latitude_2 - latitude_1) / 2) ** 2 + math.cos(latitude_1) * math.cos(latitude_2) * math.sin((longitude_2 - longitude_1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def point_in_polygon(latitude: float, longitude: float, polygon: list[tuple[float, float]]) -> bool:
+    """Returns whether a coordinate is inside a polygon of (latitude, longitude) vertices, using ray casting."""
+    inside = False
+    previous_latitude, previous_longitude = polygon[-1]
+    for vertex_latitude, vertex_longitude in polygon:
+        if (vertex_latitude > latitude) != (previous_latitude > latitude):
+            crossing = (previous_longitude - vertex_longitude) * (latitude - vertex_latitude) / (previous_latitude - vertex_latitude) + vertex_longitude
+            if longitude < crossing:
+                inside = not inside
+        previous_latitude, previous_longitude = vertex_latitude, vertex_longitude
+    return inside
+
+
+@dataclass
+class BoundingBox:
+    """An area between two latitudes and two longitudes in degrees. If min_longitude is greater than max_longitude the box crosses the antimeridian."""
+    min_latitude: float
+    min_longitude: float
+    max_latitude: float
+    max_longitude: float
+
+    @staticmethod
+    def around(latitude: float, longitude: float, radius: float) -> BoundingBox:
+        """Returns the smallest box holding a circle.
+
+        Args:
+            latitude (float): Latitude of the center.
+            longitude (float): Longitude of the center.
+            radius (float): Radius of the circle in meters.
+        """
+        latitude_delta = radius / METERS_PER_DEGREE
+        if abs(latitude) + latitude_delta >= 90:
+            # The circle holds a pole, so it spans every longitude.
+            return BoundingBox(max(latitude - latitude_delta, -90), -180, min(latitude + latitude_delta, 90), 180)
+
+        longitude_delta = latitude_delta / math.cos(math.radians(abs(latitude) + latitude_delta))
+        if longitude_delta >= 180:
+            return BoundingBox(latitude - latitude_delta, -180, latitude + latitude_delta, 180)
+        min_longitude = (longitude - longitude_delta + 180) % 360 - 180
+        max_longitude = (longitude + longitude_delta + 180) % 360 - 180
+        return BoundingBox(latitude - latitude_delta, min_longitude, latitude + latitude_delta, max_longitude)
+
+    @staticmethod
+    def of_polygon(polygon: list[tuple[float, float]]) -> BoundingBox:
+        """Returns the smallest box holding a polygon of (latitude, longitude) vertices. Polygons crossing the antimeridian are not supported."""
+        latitudes = [latitude for latitude, _ in polygon]
+        longitudes = [longitude for _, longitude in polygon]
+        return BoundingBox(min(latitudes), min(longitudes), max(latitudes), max(longitudes))
+
+    @property
+    def longitude_ranges(self) -> list[tuple[float, float]]:
+        """Returns the longitude ranges of the box, two if it crosses the antimeridian."""
+        if self.min_longitude <= self.max_longitude:
+            return [(self.min_longitude, self.max_longitude)]
+        return [(self.min_longitude, 180.0), (-180.0, self.max_longitude)]
+
+    def contains(self, latitude: float, longitude: float) -> bool:
+        if not self.min_latitude <= latitude <= self.max_latitude: return False
+        return any(minimum <= longitude <= maximum for minimum, maximum in self.longitude_ranges)
+
+    def geohash_prefixes(self, max_prefixes: int=MAX_PREFIXES) -> list[str]:
+        """Returns the geohash prefixes of the cells covering the box, using the longest prefixes that need at most max_prefixes cells.
+            Returns an empty list if the box is too big to be narrowed down by a prefix.
+        """
+        for precision in range(self._start_precision(max_prefixes), 0, -1):
+            height, width = cell_size(precision)
+            rows = self._cell_indexes(self.min_latitude + 90, self.max_latitude + 90, height, 180)
+            column_ranges = [self._cell_indexes(minimum + 180, maximum + 180, width, 360) for minimum, maximum in self.longitude_ranges]
+            # Counted before the cells are listed, there are millions of them at the precisions that do not fit.
+            if len(rows) * sum(len(columns) for columns in column_ranges) > max_prefixes: continue
+            return sorted({encode(-90 + (row + 0.5) * height, -180 + (column + 0.5) * width, precision)
+                           for row in rows for columns in column_ranges for column in columns})
+        return []
+
+    def _start_precision(self, max_prefixes: int) -> int:
+        """Returns the longest precision whose cells could cover the box in max_prefixes cells, going by the box's size.
+            Cells not aligned with the box can need a precision or two less.
+        """
+        latitude_span = self.max_latitude - self.min_latitude
+        longitude_span = sum(maximum - minimum for minimum, maximum in self.longitude_ranges)
+        for precision in range(GEOHASH_PRECISION, 0, -1):
+            height, width = cell_size(precision)
+            if latitude_span / height * longitude_span / width <= max_prefixes:
+                return precision
+        return 1
+
+    @staticmethod
+    def _cell_indexes(minimum: float, maximum: float, size: float, total: float) -> range:
+        last = round(total / size) - 1
+        return range(min(int(minimum // size), last), min(int(maximum // size), last) + 1)
@@ -0,0 +1,97 @@
+"""Measures the import time of the program's modules with python -X importtime, and checks them against a time budget and the modules they must not import.
+
+Run with: python importbenchmark.py [--runs=5] [--top=15] [module ...]
+Exits with status 1 if a module is over its budget or imports a module it must not.
+"""
+from __future__ import annotations
+import optparse
+import os
+import subprocess
+import sys
+from dataclasses import dataclass
+
+
+BUDGETS = {
+    "database": 0.75,
+    "app": 1.00,
+}
+"""Import time budget in seconds by module. Generous, to catch a heavy import creeping in rather than small regressions."""
+FORBIDDEN = {
+    "database": ["PyQt5", "win32com", "numpy", "pyarrow", "databasebackup"],
+    "app": ["win32com", "labelprinter", "numpy", "pyarrow", "openpyxl", "databasebackup"],
+}
+"""Modules that must only be imported on first use, by the module importing them at startup."""
+
+
+@dataclass
+class ImportTime:
+    name: str
+    depth: int
+    """Nesting level, 0 for the module imported by the command."""
+    self_time: float
+    """Seconds spent in the module itself."""
+    cumulative_time: float
+    """Seconds spent in the module and the modules it imported."""
+
+
+def parse_importtime(output: str) -> list[ImportTime]:
+    """Parses the lines python -X importtime writes to stderr."""
+    times = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"): continue
+        self_time, cumulative_time, name = line[len("import time:"):].split("|", 2)
+        if not self_time.strip().isdigit(): continue # Header line.
+        stripped = name.lstrip()
+        times.append(ImportTime(stripped.strip(), (len(name) - len(stripped) - 1) // 2, int(self_time) / 1e6, int(cumulative_time) / 1e6))
+    return times
+
+
+def measure(module: str) -> list[ImportTime]:
+    """Imports a module in a new interpreter and returns the import time of every module it loaded."""
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    if process.returncode != 0:
+        raise RuntimeError(f"Could not import {module}.\n{process.stderr[-2000:]}")
+    return parse_importtime(process.stderr)
+
+
+def fastest(module: str, runs: int) -> list[ImportTime]:
+    """Measures a module several times and returns the fastest run, the others include disk cache and scheduling noise."""
+    results = [measure(module) for _ in range(runs)]
+    return min(results, key=lambda times: times[-1].cumulative_time)
+
+
+def report(module: str, times: list[ImportTime], top: int) -> list[str]:
+    """Prints the import time of a module and its slowest imports, and returns what is wrong with it."""
+    total = times[-1].cumulative_time
+    budget = BUDGETS.get(module)
+    print(f"{module}: {total * 1000:.1f} ms" + (f" (budget {budget * 1000:.0f} ms)" if budget else ""))
+    for entry in sorted(times[:-1], key=lambda entry: entry.self_time, reverse=True)[:top]:
+        print(f"    {entry.self_time * 1000:8.1f} ms self {entry.cumulative_time * 1000:8.1f} ms cumulative  {entry.name}")
+
+    problems = []
+    if budget is not None and total > budget:
+        problems.append(f"{module} took {total * 1000:.1f} ms to import, over its budget of {budget * 1000:.0f} ms.")
+    loaded = {entry.name for entry in times}
+    for name in FORBIDDEN.get(module, []):
+        if any(loaded_name == name or loaded_name.startswith(name + ".") for loaded_name in loaded):
+            problems.append(f"{module} imports {name} at startup.")
+    return problems
+
+
+def main() -> int:
+    parser = optparse.OptionParser(usage="%prog [options] [module ...]")
+    parser.add_option("--runs", dest="runs", type="int", default=5, help="Runs per module, the fastest is kept")
+    parser.add_option("--top", dest="top", type="int", default=15, help="Slowest imports listed per module")
+    opts, modules = parser.parse_args()
+
+    problems = []
+    for module in modules or list(BUDGETS):
+        problems += report(module, fastest(module, opts.runs), opts.top)
+    for problem in problems:
+        print(problem)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
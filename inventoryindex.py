@@ -0,0 +1,136 @@
+"""Lookup of the drone, battery, equipment, flight controller or flight an inventory id belongs to, fast enough for handheld scanners.
+
+The ids are the serial numbers of the assets and the uuids of the flights, the values their labels encode. They are loaded into a map
+with one query on the first lookup, and kept up to date from the change events. A bulk write to a table drops the map. A scanned id missing
+from the map is looked up in the database in one query over the unique indexes.
+"""
+from __future__ import annotations
+import threading
+from dataclasses import dataclass
+
+from sqlalchemy import literal
+
+from database import global_session, Battery, Drone, Equipment, Flight, FlightController
+import events
+
+
+INVENTORY_COLUMNS = {
+    Drone: Drone.serial_number,
+    Battery: Battery.serial_number,
+    Equipment: Equipment.serial_number,
+    FlightController: FlightController.serial_number,
+    Flight: Flight.uuid,
+}
+"""Column holding the inventory id of each model."""
+MODELS = {model.__tablename__: model for model in INVENTORY_COLUMNS}
+"""The models by table name."""
+
+
+@dataclass(frozen=True)
+class InventoryItem:
+    entity: str
+    """Table name of the record."""
+    id: int
+
+    @property
+    def model(self):
+        return MODELS[self.entity]
+
+    def record(self):
+        """Returns the record, None if it was deleted."""
+        return global_session.get(self.model, self.id)
+
+
+_lock = threading.Lock()
+_items = None # type: dict[str, InventoryItem]
+"""Record of each inventory id. None until the first lookup."""
+_ids = {} # type: dict[InventoryItem, str]
+"""Inventory id of each record in _items."""
+_stale = set() # type: set[InventoryItem]
+"""Records written since their id was loaded, reloaded on the next lookup."""
+
+
+def invalidate() -> None:
+    """Drops the map, reloaded on the next lookup. ORM writes keep it up to date, bulk writes are found by the database lookup."""
+    global _items
+    with _lock:
+        _items = None
+        _ids.clear()
+        _stale.clear()
+
+
+def _on_changes(changes: list[events.ChangeEvent]) -> None:
+    # Published on the thread that committed, which may be another one's.
+    global _items
+    column = INVENTORY_COLUMNS[MODELS[changes[0].entity]]
+    with _lock:
+        if _items is None: return
+        if any(change.id == events.TABLE_ID for change in changes):
+            _items = None
+            _ids.clear()
+            _stale.clear()
+            return
+        for change in changes:
+            if change.operation == events.UPDATE and column.key not in change.fields: continue
+            item = InventoryItem(change.entity, change.id)
+            code = _ids.pop(item, None)
+            if code is not None:
+                del _items[code]
+            if change.operation == events.DELETE:
+                _stale.discard(item)
+            else:
+                _stale.add(item)
+
+
+for _model in INVENTORY_COLUMNS:
+    events.subscribe(_model.__tablename__, _on_changes)
+
+
+def _query(filter_code: str=None, stale: set[InventoryItem]=None):
+    """Returns a query of the (inventory id, table name, record id) of every model, in a single statement."""
+    selects = []
+    for model, column in INVENTORY_COLUMNS.items():
+        if stale is not None:
+            ids = [item.id for item in stale if item.entity == model.__tablename__]
+            if not ids: continue
+        select_ = global_session.query(column, literal(model.__tablename__), model.id).filter(column != None)
+        if filter_code is not None:
+            select_ = select_.filter(column == filter_code)
+        if stale is not None:
+            select_ = select_.filter(model.id.in_(ids))
+        selects.append(select_)
+    return selects[0].union_all(*selects[1:]) if selects else None
+
+
+def _add(rows) -> None:
+    for code, entity, id_ in rows:
+        item = InventoryItem(entity, id_)
+        previous = _ids.get(item)
+        if previous is not None and previous != code:
+            # Changed by a write that published no event.
+            del _items[previous]
+        _items[code] = item
+        _ids[item] = code
+
+
+def find(code: str) -> InventoryItem:
+    """Returns the record an inventory id belongs to, None if there is none. Surrounding whitespace, which some scanners send, is ignored."""
+    global _items
+    code = code.strip()
+    if not code: return None
+    with _lock:
+        if _items is None:
+            _items = {}
+            _add(_query().all())
+        elif _stale:
+            query = _query(stale=_stale)
+            _stale.clear()
+            if query is not None:
+                _add(query.all())
+        item = _items.get(code)
+        if item is None:
+            rows = _query(filter_code=code).all()
+            _add(rows)
+            # The database may compare without case, the id found is the one stored.
+            item = InventoryItem(rows[0][1], rows[0][2]) if rows else None
+    return item
@@ -0,0 +1,62 @@
+"""Printing of labels on Dymo label printers through the Dymo Label Software COM components. Windows only."""
+from __future__ import annotations
+from typing import Any
+
+from errors import MissingRequiredSoftwareError, SetLabelFileError
+
+try:
+    from win32com.client import Dispatch
+    import pythoncom
+except ImportError:
+    Dispatch = None
+
+
+class DymoLabelPrinter:
+    def __init__(self) -> object:
+        self.printer_name = None
+        self.label_file_path = None
+        self.is_open = False
+        if Dispatch is None:
+            raise MissingRequiredSoftwareError("Missing required python package pywin32. Please install it to print labels.")
+        # COM has to be initialized on every thread using it, like the label queue's.
+        pythoncom.CoInitialize()
+        try:
+            self.printer_engine = Dispatch('Dymo.DymoAddIn')
+            self.label_engine = Dispatch('Dymo.DymoLabels')
+        except Exception as error:
+            if getattr(error, "strerror", None) == "Invalid class string":
+                raise MissingRequiredSoftwareError("Missing required software program. Please install DLS8Setup.8.7.exe.")
+            raise
+
+        printers = self.printer_engine.GetDymoPrinters()
+        self.PRINTERS = [printer for printer in printers.split('|') if printer]
+
+    def __enter__(self):
+        self.printer_engine.StartPrintJob()
+        return self.printer_engine
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Log the exception if one was raised
+        self.printer_engine.EndPrintJob()
+
+    def set_printer(self, printer_name: str):
+        if printer_name not in self.PRINTERS:
+            raise Exception('Printer not found')
+        self.printer_engine.SelectPrinter(printer_name)
+
+    def print_labels(self, copies: int = 1):
+        with self as label_engine:
+            label_engine.Print(copies, False)
+
+    def print_label(self, copies: int = 1):
+        """Prints the label as part of the print job started by entering the printer, to print many labels in one job."""
+        self.printer_engine.Print(copies, False)
+
+    def set_field(self, field_name: str, field_value: Any):
+        self.label_engine.SetField(field_name, field_value)
+
+    def register_label_file(self, label_file_path: str) -> object:
+        self.label_file_path = label_file_path
+        self.is_open = self.printer_engine.Open(label_file_path)
+        if not self.is_open:
+            raise SetLabelFileError('Could not open label file.')
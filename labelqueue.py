@@ -0,0 +1,178 @@
+"""Queue of labels printed in batches on a worker thread, so labelling a shipment does not block the window.
+
+Labels go to a backend: a Dymo printer, or files for testing and for computers without the Dymo software. The Dymo backend opens the label
+template once and keeps it open for the following batches, the labels of a batch are printed in a single print job.
+"""
+from __future__ import annotations
+import contextlib
+import os
+import queue
+import re
+from dataclasses import dataclass, field
+
+from PyQt5 import QtCore, QtGui
+
+import labelrenderer
+from errors import LabelPrintError
+
+
+INVENTORY_BARCODE_FIELDS = ("barcode_upper_left", "barcode_upper_right", "barcode_lower_left", "barcode_lower_right")
+"""Barcode fields of the inventory label template, each encoding the inventory id."""
+INVENTORY_NAME_FIELD = "center_waste_text"
+"""Text field of the inventory label template, between the barcodes."""
+
+
+@dataclass
+class LabelJob:
+    name: str
+    """Printed as text between the barcodes."""
+    inventory_id: str
+    """Encoded in the barcodes."""
+    copies: int = 1
+
+    @property
+    def fields(self) -> dict[str, str]:
+        """The values of the inventory label template's fields."""
+        fields = {field_name: self.inventory_id for field_name in INVENTORY_BARCODE_FIELDS}
+        fields[INVENTORY_NAME_FIELD] = self.name
+        return fields
+
+
+@dataclass
+class PrintResult:
+    printed: int = 0
+    """Labels printed, not counting copies."""
+    failed: list[tuple[LabelJob, str]] = field(default_factory=list)
+    """The labels that could not be printed, with the reason."""
+
+
+class LabelBackend:
+    """Where labels are printed. Called on the queue's thread only: open before the labels of a batch, close after them."""
+
+    def open(self, template_path: str) -> None:
+        pass
+
+    def print_label(self, job: LabelJob) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class DymoBackend(LabelBackend):
+    """Prints on a Dymo label printer. Its COM components are created on the queue's thread, which then owns them, the first time a batch is printed."""
+
+    def __init__(self, printer_name: str):
+        self.printer_name = printer_name
+        self.printer = None # type: labelprinter.DymoLabelPrinter
+        self._print_job = None # type: contextlib.ExitStack
+
+    def open(self, template_path: str) -> None:
+        import labelprinter
+        if self.printer is None:
+            self.printer = labelprinter.DymoLabelPrinter()
+            self.printer.set_printer(self.printer_name)
+        if not self.printer.is_open or self.printer.label_file_path != template_path:
+            self.printer.register_label_file(template_path)
+        self._print_job = contextlib.ExitStack()
+        self._print_job.enter_context(self.printer)
+
+    def print_label(self, job: LabelJob) -> None:
+        for field_name, value in job.fields.items():
+            self.printer.set_field(field_name, value)
+        self.printer.print_label(job.copies)
+
+    def close(self) -> None:
+        if self._print_job is not None:
+            self._print_job.close()
+            self._print_job = None
+
+
+class FileBackend(LabelBackend):
+    """Renders the labels to files with labelrenderer instead of a printer. A path ending in .pdf gets the labels of a single batch,
+        one per page or tiled on pages of a page size, any other path is a folder that gets a PNG image per label, named by inventory id.
+    """
+
+    def __init__(self, path: str, page_size: QtGui.QPageSize.PageSizeId=None, resolution: int=300):
+        self.path = path
+        self.page_size = page_size
+        self.resolution = resolution
+        self.is_pdf = path.lower().endswith(".pdf")
+        self.renderer = None # type: labelrenderer.LabelRenderer
+        self._sheet = None # type: labelrenderer.LabelSheetWriter
+
+    def open(self, template_path: str) -> None:
+        self.renderer = labelrenderer.LabelRenderer(labelrenderer.compile_template(template_path))
+        if self.is_pdf:
+            self._sheet = labelrenderer.LabelSheetWriter(self.path, self.renderer, self.page_size, self.resolution)
+        else:
+            os.makedirs(self.path, exist_ok=True)
+
+    def print_label(self, job: LabelJob) -> None:
+        if self.is_pdf:
+            self._sheet.add(job.fields, job.copies)
+            return
+        file_path = os.path.join(self.path, re.sub(r"[^\w.-]", "_", job.inventory_id) + ".png")
+        if not self.renderer.render_image(job.fields, self.resolution).save(file_path):
+            raise LabelPrintError(f"Could not write {file_path}.")
+
+    def close(self) -> None:
+        if self._sheet is not None:
+            self._sheet.close()
+            self._sheet = None
+
+
+class LabelQueue(QtCore.QObject):
+    """Prints the submitted batches of labels on the thread it is moved to. submit can be called from any thread.
+        Batches submitted while one prints are printed right after it and reported along with it.
+    """
+    progress = QtCore.pyqtSignal(int, int)
+    """Labels done and labels submitted so far."""
+    finished = QtCore.pyqtSignal(object)
+    """The PrintResult of the batches, once the queue is empty."""
+
+    def __init__(self, template_path: str):
+        super().__init__()
+        self.template_path = template_path
+        self.batches = queue.Queue() # type: queue.Queue[tuple[LabelBackend, list[LabelJob]]]
+
+    def submit(self, jobs: list[LabelJob], backend: LabelBackend) -> None:
+        self.batches.put((backend, list(jobs)))
+        QtCore.QMetaObject.invokeMethod(self, "process", QtCore.Qt.QueuedConnection)
+
+    @QtCore.pyqtSlot()
+    def process(self) -> None:
+        result = PrintResult()
+        done = total = 0
+        while True:
+            try:
+                backend, jobs = self.batches.get_nowait()
+            except queue.Empty:
+                break
+            total += len(jobs)
+            try:
+                backend.open(self.template_path)
+            except Exception as error:
+                result.failed += [(job, str(error)) for job in jobs]
+                done += len(jobs)
+                self.progress.emit(done, total)
+                continue
+            printed = [] # type: list[LabelJob]
+            for job in jobs:
+                try:
+                    backend.print_label(job)
+                    printed.append(job)
+                except Exception as error:
+                    result.failed.append((job, str(error)))
+                done += 1
+                self.progress.emit(done, total)
+            try:
+                backend.close()
+            except Exception as error:
+                # Some backends only write the labels when closed, like the pages of a PDF, so none of the batch's labels is printed.
+                result.failed += [(job, str(error)) for job in printed]
+                printed = []
+            result.printed += len(printed)
+        # Batches submitted together are all printed by the first call.
+        if total:
+            self.finished.emit(result)
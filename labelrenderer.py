@@ -0,0 +1,293 @@
+"""Rendering of Dymo label templates to images and PDF files with Qt, on any platform and without the Dymo software.
+
+A template is parsed once into a CompiledLabel, the position, type and style of each of its objects, cached by file.
+Rendering a label only fills the fields into the compiled layout. QR codes are made with segno and cached by value,
+so the labels of one inventory id, printed again or in several copies, encode it once.
+"""
+from __future__ import annotations
+import functools
+import os
+import xml.etree.ElementTree as ElementTree
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from PyQt5 import QtCore, QtGui
+
+from errors import LabelPrintError, MissingRequiredSoftwareError
+import label_template_data
+
+segno = None
+"""Imported by _check_segno on the first QR code."""
+
+
+TWIPS_PER_INCH = 1440
+QR_CACHE_SIZE = 4096
+"""QR code images kept, by value."""
+QR_MASK = 0
+"""Mask pattern of the QR codes. Scoring the eight patterns for the best one takes most of the encoding time,
+any of them gives a valid code and the short inventory ids scan fine with a fixed one."""
+SHEET_GAP = 144
+"""Twips between the labels tiled on a sheet."""
+PAPER_SIZES = {"Small30335": (1440, 1709)}
+"""Label size in twips of the Dymo papers whose templates draw no outline."""
+
+
+@dataclass(frozen=True)
+class LabelObject:
+    """A barcode or a text of a template. Positions and sizes are in twips."""
+    name: str
+    kind: str
+    """"barcode" or "text"."""
+    bounds: tuple[float, float, float, float]
+    """X, y, width and height."""
+    text: str = ""
+    """The template's value, used when a label does not fill the field."""
+    barcode_type: str = "QRCode"
+    horizontal_alignment: str = "Center"
+    vertical_alignment: str = "Middle"
+    font_family: str = "Arial"
+    font_size: float = 8
+    """In points."""
+    bold: bool = False
+    shrink_to_fit: bool = False
+
+
+@dataclass
+class CompiledLabel:
+    """A template parsed once, ready to be filled."""
+    width: float
+    height: float
+    outlines: list[tuple[float, float, float, float, float, float]] = field(default_factory=list)
+    """Rounded rectangles drawn on the label, as x, y, width, height, x radius and y radius."""
+    objects: list[LabelObject] = field(default_factory=list)
+
+    @property
+    def field_names(self) -> list[str]:
+        return [label_object.name for label_object in self.objects]
+
+
+def _check_segno() -> None:
+    """Imports segno on first use."""
+    global segno
+    if segno is not None: return
+    try:
+        import segno
+    except ImportError:
+        raise MissingRequiredSoftwareError("Missing required python package segno. Please install it to render QR codes.")
+
+
+def _float(element: ElementTree.Element, name: str, default: float=0) -> float:
+    value = element.get(name)
+    return float(value) if value is not None else default
+
+
+def parse_template(xml: str) -> CompiledLabel:
+    """Parses the XML of a Dymo label template.
+
+    Raises:
+        LabelPrintError: If the XML is not a Dymo die cut label.
+    """
+    try:
+        root = ElementTree.fromstring(xml.strip())
+    except ElementTree.ParseError as error:
+        raise LabelPrintError(f"Could not read the label template. {error}")
+    if root.tag != "DieCutLabel":
+        raise LabelPrintError(f"Label templates of type {root.tag} are not supported.")
+
+    outlines = [(_float(rectangle, "X"), _float(rectangle, "Y"), _float(rectangle, "Width"), _float(rectangle, "Height"), _float(rectangle, "Rx"), _float(rectangle, "Ry"))
+                for rectangle in root.iter("RoundRectangle")]
+    objects = []
+    for object_info in root.iter("ObjectInfo"):
+        bounds_element = object_info.find("Bounds")
+        bounds = (_float(bounds_element, "X"), _float(bounds_element, "Y"), _float(bounds_element, "Width"), _float(bounds_element, "Height"))
+        barcode = object_info.find("BarcodeObject")
+        text = object_info.find("TextObject")
+        if barcode is not None:
+            font = barcode.find("TextFont")
+            objects.append(LabelObject(
+                name=barcode.findtext("Name", ""), kind="barcode", bounds=bounds, text=barcode.findtext("Text", ""),
+                barcode_type=barcode.findtext("Type", "QRCode"), horizontal_alignment=barcode.findtext("HorizontalAlignment", "Center"),
+                font_family=font.get("Family", "Arial") if font is not None else "Arial", font_size=_float(font, "Size", 8) if font is not None else 8,
+            ))
+        elif text is not None:
+            font = text.find(".//Font")
+            objects.append(LabelObject(
+                name=text.findtext("Name", ""), kind="text", bounds=bounds, text="".join(string.text or "" for string in text.iter("String")),
+                horizontal_alignment=text.findtext("HorizontalAlignment", "Left"), vertical_alignment=text.findtext("VerticalAlignment", "Top"),
+                font_family=font.get("Family", "Arial") if font is not None else "Arial", font_size=_float(font, "Size", 8) if font is not None else 8,
+                bold=font is not None and font.get("Bold") == "True", shrink_to_fit=text.findtext("TextFitMode") == "ShrinkToFit",
+            ))
+
+    if outlines:
+        width = max(x + width for x, _, width, _, _, _ in outlines)
+        height = max(y + height for _, y, _, height, _, _ in outlines)
+    elif root.findtext("Id") in PAPER_SIZES:
+        width, height = PAPER_SIZES[root.findtext("Id")]
+    else:
+        width = max((x + width for x, _, width, _ in (label_object.bounds for label_object in objects)), default=TWIPS_PER_INCH)
+        height = max((y + height for _, y, _, height in (label_object.bounds for label_object in objects)), default=TWIPS_PER_INCH)
+    return CompiledLabel(width, height, outlines, objects)
+
+
+@functools.lru_cache(maxsize=16)
+def _compile_file(path: str, modified: float, size: int) -> CompiledLabel:
+    with open(path, encoding="utf-8-sig") as file:
+        return parse_template(file.read())
+
+
+def compile_template(path: str=None) -> CompiledLabel:
+    """Returns the compiled template of a label file, parsed again only once the file changed. Defaults to the built in inventory label.
+
+    Raises:
+        LabelPrintError: If the file can not be read.
+    """
+    if path is None:
+        return _inventory_template()
+    try:
+        status = os.stat(path)
+    except OSError as error:
+        raise LabelPrintError(f"Could not open the label template {path}. {error.strerror}")
+    return _compile_file(os.path.abspath(path), status.st_mtime, status.st_size)
+
+
+@functools.lru_cache(maxsize=1)
+def _inventory_template() -> CompiledLabel:
+    return parse_template(label_template_data.INVENTORY_BARCODE_TEMPLATE["Data"])
+
+
+@functools.lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_image(value: str) -> QtGui.QImage:
+    """Returns the QR code of a value with one pixel per module and a quiet zone of one module, scaled without smoothing when drawn."""
+    _check_segno()
+    matrix = segno.make(value, error="m", micro=False, mask=QR_MASK).matrix
+    size = len(matrix) + 2
+    # Image rows are aligned to 4 bytes.
+    stride = (size + 3) // 4 * 4
+    blank = b"\xff" * stride
+    rows = [blank] + [bytes(0 if dark else 255 for dark in (0, *row, 0)).ljust(stride, b"\xff") for row in matrix] + [blank]
+    data = b"".join(rows)
+    # Copied, the image does not own the buffer it is made from.
+    return QtGui.QImage(data, size, size, stride, QtGui.QImage.Format_Grayscale8).copy()
+
+
+class LabelRenderer:
+    """Draws the labels of a compiled template, filled with the values of their fields."""
+
+    def __init__(self, template: CompiledLabel):
+        self.template = template
+
+    def paint(self, painter: QtGui.QPainter, fields: dict[str, str], target: QtCore.QRectF) -> None:
+        """Draws a label into a rectangle of the painter's device. Fields left out keep the template's value."""
+        template = self.template
+        painter.save()
+        painter.translate(target.topLeft())
+        painter.scale(target.width() / template.width, target.height() / template.height)
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, False)
+        painter.setPen(QtGui.QPen(QtCore.Qt.black, 10))
+        for x, y, width, height, x_radius, y_radius in template.outlines:
+            painter.drawRoundedRect(QtCore.QRectF(x + 5, y + 5, width - 10, height - 10), x_radius, y_radius)
+        for label_object in template.objects:
+            value = fields.get(label_object.name, label_object.text)
+            if not value: continue
+            if label_object.kind == "barcode" and label_object.barcode_type == "QRCode":
+                self._paint_qr_code(painter, label_object, value)
+            else:
+                # Other barcode types are drawn as their text.
+                self._paint_text(painter, label_object, value)
+        painter.restore()
+
+    @staticmethod
+    def _paint_qr_code(painter: QtGui.QPainter, label_object: LabelObject, value: str) -> None:
+        x, y, width, height = label_object.bounds
+        side = min(width, height)
+        left = x + (width - side) / 2 if label_object.horizontal_alignment == "Center" else x + width - side if label_object.horizontal_alignment == "Right" else x
+        painter.drawImage(QtCore.QRectF(left, y + (height - side) / 2, side, side), qr_image(value))
+
+    @staticmethod
+    def _paint_text(painter: QtGui.QPainter, label_object: LabelObject, value: str) -> None:
+        x, y, width, height = label_object.bounds
+        font = QtGui.QFont(label_object.font_family)
+        font.setBold(label_object.bold)
+        # Twips are 1/20 of a point.
+        font.setPixelSize(max(1, round(label_object.font_size * 20)))
+        if label_object.shrink_to_fit:
+            metrics = QtGui.QFontMetricsF(font)
+            scale = min(1, width / max(metrics.horizontalAdvance(value), 1), height / max(metrics.height(), 1))
+            font.setPixelSize(max(1, int(font.pixelSize() * scale)))
+        painter.setFont(font)
+        horizontal = {"Left": QtCore.Qt.AlignLeft, "Right": QtCore.Qt.AlignRight}.get(label_object.horizontal_alignment, QtCore.Qt.AlignHCenter)
+        vertical = {"Top": QtCore.Qt.AlignTop, "Bottom": QtCore.Qt.AlignBottom}.get(label_object.vertical_alignment, QtCore.Qt.AlignVCenter)
+        painter.drawText(QtCore.QRectF(x, y, width, height), horizontal | vertical | QtCore.Qt.TextWordWrap, value)
+
+    def render_image(self, fields: dict[str, str], resolution: int=300) -> QtGui.QImage:
+        """Returns a label as an image, at a resolution in dots per inch."""
+        image = QtGui.QImage(round(self.template.width / TWIPS_PER_INCH * resolution), round(self.template.height / TWIPS_PER_INCH * resolution),
+                             QtGui.QImage.Format_RGB32)
+        image.fill(QtCore.Qt.white)
+        painter = QtGui.QPainter(image)
+        self.paint(painter, fields, QtCore.QRectF(0, 0, image.width(), image.height()))
+        painter.end()
+        return image
+
+
+class LabelSheetWriter:
+    """Writes labels to a PDF file as they come. Without a page size each label gets a page of its own size, for label printers,
+        with one the labels are tiled on the pages, for sheet printers.
+    """
+
+    def __init__(self, path: str, renderer: LabelRenderer, page_size: QtGui.QPageSize.PageSizeId=None, resolution: int=300):
+        template = renderer.template
+        self.renderer = renderer
+        self.writer = QtGui.QPdfWriter(path)
+        self.writer.setResolution(resolution)
+        if page_size is None:
+            self.writer.setPageSize(QtGui.QPageSize(QtCore.QSizeF(template.width / TWIPS_PER_INCH * 25.4, template.height / TWIPS_PER_INCH * 25.4),
+                                                    QtGui.QPageSize.Millimeter))
+            self.writer.setPageMargins(QtCore.QMarginsF(0, 0, 0, 0))
+        else:
+            self.writer.setPageSize(QtGui.QPageSize(page_size))
+            self.writer.setPageMargins(QtCore.QMarginsF(10, 10, 10, 10), QtGui.QPageLayout.Millimeter)
+        self.painter = QtGui.QPainter(self.writer)
+        if not self.painter.isActive():
+            raise LabelPrintError(f"Could not write {path}.")
+
+        dots_per_twip = resolution / TWIPS_PER_INCH
+        self.label_size = QtCore.QSizeF(template.width * dots_per_twip, template.height * dots_per_twip)
+        self.gap = SHEET_GAP * dots_per_twip if page_size is not None else 0
+        page = self.writer.pageLayout().paintRectPixels(resolution)
+        self.columns = max(1, int((page.width() + self.gap) // (self.label_size.width() + self.gap)))
+        self.rows = max(1, int((page.height() + self.gap) // (self.label_size.height() + self.gap)))
+        self.count = 0
+
+    def add(self, fields: dict[str, str], copies: int=1) -> None:
+        for _ in range(copies):
+            slot = self.count % (self.columns * self.rows)
+            if self.count and slot == 0:
+                self.writer.newPage()
+            row, column = divmod(slot, self.columns)
+            origin = QtCore.QPointF(column * (self.label_size.width() + self.gap), row * (self.label_size.height() + self.gap))
+            self.renderer.paint(self.painter, fields, QtCore.QRectF(origin, self.label_size))
+            self.count += 1
+
+    def close(self) -> None:
+        if self.painter.isActive():
+            self.painter.end()
+
+
+def render_pdf(labels: Iterable[dict[str, str]], path: str, template: CompiledLabel=None, page_size: QtGui.QPageSize.PageSizeId=None) -> int:
+    """Writes labels to a PDF file, see LabelSheetWriter.
+
+    Args:
+        labels (Iterable[dict[str, str]]): The values of the fields of each label, by field name.
+        template (CompiledLabel, Optional): Defaults to the built in inventory label.
+
+    Returns:
+        int: The number of labels written.
+    """
+    writer = LabelSheetWriter(path, LabelRenderer(template or compile_template()), page_size)
+    try:
+        for fields in labels:
+            writer.add(fields)
+    finally:
+        writer.close()
+    return writer.count
@@ -0,0 +1,82 @@
+"""Maintenance due dates of the fleet, from the drones' flight hours since their last service."""
+from __future__ import annotations
+from dataclasses import dataclass
+
+from database import (global_session, Drone, DroneFlightTime, DroneMaintenance, DroneMaintenanceTask, DroneScheduledTask,
+                      MaintenanceStatus)
+
+
+DUE_SOON = 0.9
+"""Fraction of an interval after which maintenance is reported as due."""
+
+
+@dataclass
+class MaintenanceDue:
+    """Maintenance a drone needs, either its service interval or a scheduled task."""
+    drone_id: int
+    drone_name: str
+    description: str
+    interval: float
+    """The interval in flight hours."""
+    flight_hours: float
+    """Flight hours since the service or the task was last done."""
+    scheduled_task_id: int = None
+    """The scheduled task, or None for the drone's service interval."""
+
+    @property
+    def remaining_hours(self) -> float:
+        """Returns the flight hours left before the maintenance is overdue, negative once it is."""
+        return round(self.interval - self.flight_hours, 2)
+
+    @property
+    def overdue(self) -> bool:
+        return self.flight_hours >= self.interval
+
+
+def _rebuild_missing_counters() -> None:
+    """Creates the flight time counters of drones that do not have one yet, like drones added since the counters were last rebuilt."""
+    missing = global_session.query(Drone.id)\
+        .outerjoin(DroneFlightTime, DroneFlightTime.drone_id == Drone.id)\
+        .filter(DroneFlightTime.drone_id == None)\
+        .all()
+    if missing:
+        DroneFlightTime.rebuild([drone_id for drone_id, in missing])
+
+
+def find_due(due_soon: float=DUE_SOON, drone: Drone=None) -> list[MaintenanceDue]:
+    """Finds the maintenance due across the fleet, most overdue first. Only the flight time counters are read, never the flights.
+
+    Args:
+        due_soon (float, Optional): Fraction of an interval after which maintenance is due. Defaults to DUE_SOON.
+        drone (Drone, Optional): Only find the maintenance due for this drone. Defaults to every drone.
+    """
+    _rebuild_missing_counters()
+    due = [] # type: list[MaintenanceDue]
+
+    service = global_session.query(Drone.id, Drone.serial_number, Drone.name, Drone.max_service_interval, DroneFlightTime.flight_time_since_service)\
+        .join(DroneFlightTime, DroneFlightTime.drone_id == Drone.id)\
+        .filter(DroneFlightTime.flight_time_since_service >= Drone.max_service_interval * 60 * due_soon)
+    if drone is not None:
+        service = service.filter(Drone.id == drone.id)
+    for drone_id, serial_number, name, interval, flight_time in service:
+        due.append(MaintenanceDue(drone_id, f"[{serial_number}] {name}", "Service interval", interval, round(flight_time / 60, 2)))
+
+    tasks = global_session.query(Drone.id, Drone.serial_number, Drone.name, DroneMaintenanceTask.description, DroneScheduledTask.interval,
+                                 DroneScheduledTask.flight_time_since_done, DroneScheduledTask.id)\
+        .join(DroneMaintenanceTask, DroneScheduledTask.maintenance_task_id == DroneMaintenanceTask.id)\
+        .join(DroneMaintenance, DroneMaintenanceTask.drone_maintenance_id == DroneMaintenance.id)\
+        .join(Drone, DroneMaintenance.drone_id == Drone.id)\
+        .filter(DroneScheduledTask.used == False)\
+        .filter(DroneMaintenance.status_id == MaintenanceStatus.Completed.id)\
+        .filter(DroneScheduledTask.flight_time_since_done >= DroneScheduledTask.interval * 60 * due_soon)
+    if drone is not None:
+        tasks = tasks.filter(Drone.id == drone.id)
+    for drone_id, serial_number, name, description, interval, flight_time, task_id in tasks:
+        due.append(MaintenanceDue(drone_id, f"[{serial_number}] {name}", description or "Scheduled task", interval, round(flight_time / 60, 2), task_id))
+
+    return sorted(due, key=lambda item: item.remaining_hours)
+
+
+def find_overdue(drone: Drone=None) -> list[MaintenanceDue]:
+    """Finds the maintenance past its interval across the fleet, or for a single drone."""
+    return find_due(due_soon=1.0, drone=drone)
@@ -0,0 +1,608 @@
+"""Offline-first local replica of the database, synced with it in the background.
+
+With a replica configured, the program reads and writes a local SQLite copy of the database, so it keeps working when the server can not
+be reached and no query waits on the network. Triggers in the replica record every write in a change journal, whatever made it: the
+models, bulk mappings or plain SQL. A sync pushes the journal to the database, then pulls the rows changed there since the last sync.
+
+Pushing sends the changes of a row at once, parents before children and deletes last. Rows added offline get ids from LOCAL_ID_START
+up, so they never clash with rows pulled from the database, and are renumbered to the database's id once inserted, along with the
+foreign keys pointing at them. An update or delete is checked against the row as it was before its first local change: a column changed
+on both sides to different values is a conflict, changes made on the database to other columns are merged into the replica. Conflicts
+stay in the journal and their rows are not pulled until they are resolved.
+
+Pulling reads the database's change log from the last entry pulled, and copies or deletes the rows it names. A link row is pulled along
+with the records it links, see database.changes_of. The first pull, and a pull after the change log was pruned past the last entry pulled,
+compare every table in full instead. Derived tables are never synced, each side recomputes them, and the telemetry blocks stay on the database.
+"""
+from __future__ import annotations
+import contextlib
+import dataclasses
+import datetime
+import functools
+import json
+import math
+import os
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from sqlalchemy import Column, Integer, LargeBinary, MetaData, String, Table, Text, and_, create_engine, func, select, tuple_
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError, InterfaceError, OperationalError
+
+import config
+import database
+import events
+from errors import ReplicaError
+
+
+LOCAL_ID_START = 10 ** 12
+"""First id of the rows added to the replica. Rows with a lower id came from the database."""
+DERIVED_TABLES = ("asset_readiness", "crew_compliance", "drone_flight_time")
+"""Caches recomputed from the other tables, on each side."""
+SERVER_ONLY_TABLES = ("flight_telemetry_block", "change_log")
+"""Tables not copied. The telemetry is too large, reading and importing it needs the database. Each side keeps its own change log,
+the writes pushed are logged in the database's."""
+DERIVED_COLUMNS = {"drone_scheduled_task": ("flight_time_since_done",)}
+"""Counters recomputed by DroneFlightTime.rebuild, never pushed."""
+VERSION_COLUMNS = ("date_created", "date_modified")
+"""Columns every write changes, left out of conflict checks."""
+BATCH_SIZE = 500
+"""Rows written to the replica or compared per statement."""
+
+PENDING = "pending"
+CONFLICT = "conflict"
+
+sync_metadata = MetaData()
+journal = Table(
+    "sync_journal", sync_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("table_name", String(64), nullable=False),
+    Column("operation", String(6), nullable=False),
+    Column("row_key", Text, nullable=False),
+    Column("before", Text),
+    Column("status", String(8), nullable=False, default=PENDING),
+    Column("error", Text),
+    Column("date_created", String(26)),
+)
+"""Change journal, one entry per write to a synced table of the replica. row_key is a JSON array of the primary key values, before a JSON
+object of the row's columns before an update or delete, except the binary ones."""
+control = Table(
+    "sync_control", sync_metadata,
+    Column("applying", Integer, nullable=False),
+    Column("pulled_change_id", Integer),
+    Column("change_log_gaps", Text),
+)
+"""A single row. applying is set while a sync writes to the replica, so the triggers do not journal the sync's own writes.
+pulled_change_id and change_log_gaps keep the database.ChangeLogCursor of the pull, None before the first pull. The gaps are a JSON object
+of the ids skipped and when."""
+FULL_PULL_GAP_WINDOW = 100
+"""Change log ids below the latest one that a full pull still waits for, in case their transactions were open while it read the tables."""
+
+_SQLITE = sqlite.dialect()
+
+active_replica = None # type: Replica
+"""The replica the program works on, None when it works on the database directly."""
+
+
+@dataclass
+class SyncResult:
+    online: bool = True
+    """False if the database could not be reached."""
+    pushed: int = 0
+    """Rows added, changed or deleted on the database."""
+    pulled: int = 0
+    """Rows added, changed or deleted in the replica."""
+    renumbered: int = 0
+    """Rows added offline that got the database's id."""
+    pending: int = 0
+    """Rows with changes waiting to be pushed."""
+    conflicts: int = 0
+    """Rows waiting for a conflict to be resolved."""
+    error: str = None
+
+
+@dataclass
+class Conflict:
+    table_name: str
+    row_key: list
+    message: str
+    entry_ids: list[int] = field(default_factory=list)
+
+
+def synced_tables() -> list[Table]:
+    """Returns the tables copied to the replica, parents before children."""
+    return [table for table in database.Base.metadata.sorted_tables if table.name not in DERIVED_TABLES + SERVER_ONLY_TABLES]
+
+
+def replica_config(database_config: config.DatabaseConfig) -> config.DatabaseConfig:
+    return config.DatabaseConfig(url=f"sqlite:///{os.path.abspath(database_config.replica)}", echo=database_config.echo)
+
+
+def _is_binary(column: Column) -> bool:
+    type_ = column.type
+    return isinstance(getattr(type_, "impl", type_), LargeBinary)
+
+
+def _has_local_ids(table: Table) -> bool:
+    return table._autoincrement_column is not None
+
+
+@functools.lru_cache(maxsize=None)
+def _bind_processor(column: Column):
+    return column.type.dialect_impl(_SQLITE).bind_processor(_SQLITE)
+
+
+def _stored(column: Column, value):
+    """Returns a value the way SQLite stores it, as the triggers see it."""
+    if value is None: return None
+    processor = _bind_processor(column)
+    return processor(value) if processor else value
+
+
+def _same(a, b) -> bool:
+    # SQLite writes reals to JSON with 15 significant digits.
+    if isinstance(a, float) or isinstance(b, float):
+        return a is not None and b is not None and math.isclose(a, b, rel_tol=1e-9)
+    return a == b
+
+
+def _compared_columns(table: Table) -> list[Column]:
+    """Returns the columns of a table checked for conflicts."""
+    skipped = set(VERSION_COLUMNS) | set(DERIVED_COLUMNS.get(table.name, ()))
+    return [column for column in table.columns if not column.primary_key and not _is_binary(column) and column.name not in skipped]
+
+
+def _snapshot(table: Table, row) -> str:
+    """Returns a row as the before column of a journal entry."""
+    return json.dumps({column.name: _stored(column, row[column.name]) for column in table.columns if not _is_binary(column)})
+
+
+def _key(table: Table, row) -> tuple:
+    return tuple(row[column.name] for column in table.primary_key.columns)
+
+
+def _key_filter(table: Table, key) -> object:
+    return and_(*(column == value for column, value in zip(table.primary_key.columns, key)))
+
+
+def _keys_filter(table: Table, keys: list[tuple]) -> object:
+    columns = list(table.primary_key.columns)
+    if len(columns) == 1:
+        return columns[0].in_([key[0] for key in keys])
+    return tuple_(*columns).in_(keys)
+
+
+def _trigger_statements(table: Table) -> list[str]:
+    """Returns the statements creating the triggers that journal the writes to a table."""
+    quote = _SQLITE.identifier_preparer.quote
+
+    def key(row: str) -> str:
+        return "json_array(" + ", ".join(f"{row}.{quote(column.name)}" for column in table.primary_key.columns) + ")"
+
+    before = "json_object(" + ", ".join(f"'{column.name}', OLD.{quote(column.name)}" for column in table.columns if not _is_binary(column)) + ")"
+
+    def trigger(operation: str, row: str, before_sql: str) -> str:
+        return (f"CREATE TRIGGER IF NOT EXISTS sync_{table.name}_{operation} AFTER {operation.upper()} ON {quote(table.name)} "
+                f"WHEN (SELECT applying FROM sync_control) = 0 BEGIN "
+                f"INSERT INTO sync_journal (table_name, operation, row_key, before, status, date_created) "
+                f"VALUES ('{table.name}', '{operation}', {key(row)}, {before_sql}, '{PENDING}', strftime('%Y-%m-%d %H:%M:%f', 'now')); END")
+
+    return [trigger("insert", "NEW", "NULL"), trigger("update", "OLD", before), trigger("delete", "OLD", before)]
+
+
+class Replica:
+    """A local SQLite copy of the database and its change journal."""
+    def __init__(self, database_config: config.DatabaseConfig=None):
+        """
+        Args:
+            database_config (config.DatabaseConfig, Optional): The database, with the path of its replica. Defaults to the program's database.
+        """
+        self.server_config = database_config or database.DATABASE_CONFIG
+        self.local_config = replica_config(self.server_config)
+        self.path = os.path.abspath(self.server_config.replica)
+        self.engine = create_engine(self.local_config.database_url, **config.engine_options(self.local_config))
+        self.server_engine = create_engine(self.server_config.database_url, **config.engine_options(self.server_config))
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def create(self) -> SyncResult:
+        """Creates the replica and copies the database into it.
+
+        Raises:
+            ReplicaError: If the database can not be reached. The replica is only created from the database.
+        """
+        try:
+            with self.server_engine.connect():
+                pass
+        except (OperationalError, InterfaceError) as error:
+            raise ReplicaError(f"Could not create the local replica, the database can not be reached.\n{error.orig}")
+        # The replica gets the columns of this version, a database set up by an earlier one needs them too.
+        database.migrate(self.server_engine)
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            with self.engine.connect() as connection:
+                # Readers do not block the sync's writes and the other way around.
+                connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+            with self.engine.begin() as connection:
+                for table in database.Base.metadata.sorted_tables:
+                    # AUTOINCREMENT never reuses ids, so the ids of rows added offline stay above LOCAL_ID_START.
+                    table.dialect_options["sqlite"]["autoincrement"] = _has_local_ids(table)
+                    try:
+                        table.create(connection)
+                    finally:
+                        table.dialect_options["sqlite"]["autoincrement"] = False
+                sync_metadata.create_all(connection)
+                connection.execute(control.insert().values(applying=0))
+                connection.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES " +
+                                           ", ".join(f"('{table.name}', {LOCAL_ID_START - 1})" for table in synced_tables() if _has_local_ids(table)))
+                for table in synced_tables():
+                    for statement in _trigger_statements(table):
+                        connection.exec_driver_sql(statement)
+            return self.sync()
+        except Exception:
+            self.engine.dispose()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
+            raise
+
+    @contextlib.contextmanager
+    def _applying(self):
+        """Opens a transaction on the replica whose writes are not journaled."""
+        with self.engine.begin() as connection:
+            connection.execute(control.update().values(applying=1))
+            yield connection
+            connection.execute(control.update().values(applying=0))
+
+    def sync(self) -> SyncResult:
+        """Pushes the journal to the database, then pulls the database's changes and publishes them. Does nothing but count the journal if the
+        database can not be reached."""
+        result = SyncResult()
+        changes = [] # type: list[events.ChangeEvent]
+        try:
+            with self.server_engine.connect() as server:
+                self._push(server, result)
+                changes = self._pull(server, result)
+        except (OperationalError, InterfaceError) as error:
+            result.online = False
+            result.error = str(error.orig)
+        result.pending, result.conflicts = self.counts()
+        events.publish(changes)
+        return result
+
+    def counts(self) -> tuple[int, int]:
+        """Returns the number of rows with changes waiting to be pushed and of rows waiting for a conflict to be resolved."""
+        counts = defaultdict(set)
+        with self.engine.connect() as connection:
+            for status, table_name, row_key in connection.execute(select(journal.c.status, journal.c.table_name, journal.c.row_key)):
+                counts[status].add((table_name, row_key))
+        return len(counts[PENDING] - counts[CONFLICT]), len(counts[CONFLICT])
+
+    def _entries(self, status: str) -> dict[str, dict[tuple, list]]:
+        """Returns the journal entries with a status by table name and row key, in the order they were made."""
+        entries = defaultdict(dict)
+        with self.engine.connect() as connection:
+            for entry in connection.execute(select(journal).where(journal.c.status == status).order_by(journal.c.id)):
+                entries[entry.table_name].setdefault(tuple(json.loads(entry.row_key)), []).append(entry)
+        return entries
+
+    def _local_row(self, table: Table, key: tuple):
+        with self.engine.connect() as connection:
+            return connection.execute(select(table).where(_key_filter(table, key))).mappings().first()
+
+    def _delete_entries(self, connection: Connection, entries: list) -> None:
+        connection.execute(journal.delete().where(journal.c.id.in_([entry.id for entry in entries])))
+
+    def _mark_conflict(self, entries: list, message: str, result: SyncResult) -> None:
+        with self.engine.begin() as connection:
+            connection.execute(journal.update().where(journal.c.id.in_([entry.id for entry in entries])).values(status=CONFLICT, error=message))
+        result.conflicts += 1
+
+    def _renumber(self, connection: Connection, table: Table, old_id: int, new_id: int) -> None:
+        """Gives a row added offline the id the database gave it, in the row, the foreign keys pointing at it and the journal."""
+        id_column = table._autoincrement_column
+        connection.execute(table.update().where(id_column == old_id).values({id_column.name: new_id}))
+        connection.execute(journal.update()
+                           .where(journal.c.table_name == table.name, journal.c.row_key == json.dumps([old_id], separators=(",", ":")))
+                           .values(row_key=json.dumps([new_id], separators=(",", ":"))))
+        for child in database.Base.metadata.sorted_tables:
+            for foreign_key in child.foreign_keys:
+                if foreign_key.column is not id_column: continue
+                column = foreign_key.parent
+                connection.execute(child.update().where(column == old_id).values({column.name: new_id}))
+                if column.primary_key and child.name not in DERIVED_TABLES:
+                    index = list(child.primary_key.columns).index(column)
+                    connection.exec_driver_sql(
+                        f"UPDATE sync_journal SET row_key = json_set(row_key, '$[{index}]', ?) WHERE table_name = ? AND json_extract(row_key, '$[{index}]') = ?",
+                        (new_id, child.name, old_id))
+
+    def _renumbered_key(self, table: Table, key: tuple, renumbered: dict[tuple[str, int], int]) -> tuple:
+        """Returns a row key loaded from the journal with the ids renumbered during this push."""
+        key = list(key)
+        for index, column in enumerate(table.primary_key.columns):
+            if _has_local_ids(table) and column is table._autoincrement_column:
+                key[index] = renumbered.get((table.name, key[index]), key[index])
+            for foreign_key in column.foreign_keys:
+                key[index] = renumbered.get((foreign_key.column.table.name, key[index]), key[index])
+        return tuple(key)
+
+    def _changes(self, table: Table, before: dict, local, server) -> tuple[set[str], set[str]]:
+        """Returns the columns changed in the replica and in the database since before."""
+        local_changed, server_changed = set(), set()
+        for column in _compared_columns(table):
+            if column.name not in before: continue
+            if local is not None and not _same(_stored(column, local[column.name]), before[column.name]):
+                local_changed.add(column.name)
+            if server is not None and not _same(_stored(column, server[column.name]), before[column.name]):
+                server_changed.add(column.name)
+        return local_changed, server_changed
+
+    def _push(self, server: Connection, result: SyncResult) -> None:
+        pending = self._entries(PENDING)
+        if not pending: return
+        conflicts = self._entries(CONFLICT)
+        renumbered = {} # type: dict[tuple[str, int], int]
+        deletes = []
+        for table in synced_tables():
+            for key, entries in pending.get(table.name, {}).items():
+                # Later changes of a row in conflict wait for the conflict to be resolved.
+                if key in conflicts.get(table.name, {}): continue
+                key = self._renumbered_key(table, key, renumbered)
+                local = self._local_row(table, key)
+                if local is None:
+                    deletes.append((table, key, entries))
+                elif entries[0].operation == "insert":
+                    self._push_insert(server, table, key, entries, local, renumbered, result)
+                else:
+                    self._push_update(server, table, key, entries, local, result)
+        for table, key, entries in reversed(deletes):
+            self._push_delete(server, table, key, entries, result)
+        if result.pushed:
+            self._refresh_derived(self.server_engine)
+
+    def _push_insert(self, server: Connection, table: Table, key: tuple, entries: list, local, renumbered: dict[tuple[str, int], int],
+                     result: SyncResult) -> None:
+        values = dict(local)
+        local_id = _has_local_ids(table) and key[0] >= LOCAL_ID_START
+        if local_id:
+            del values[table._autoincrement_column.name]
+        try:
+            with server.begin():
+                inserted = server.execute(table.insert().values(values))
+                row = dict(values, **{column.name: value for column, value in zip(table.primary_key.columns, inserted.inserted_primary_key)})
+                database.log_changes(server, database.changes_of(table, row, events.INSERT))
+        except IntegrityError as error:
+            self._mark_conflict(entries, f"Could not be added to the database. {error.orig}", result)
+            return
+        with self._applying() as connection:
+            if local_id:
+                new_id = inserted.inserted_primary_key[0]
+                self._renumber(connection, table, key[0], new_id)
+                renumbered[(table.name, key[0])] = new_id
+                result.renumbered += 1
+            self._delete_entries(connection, entries)
+        result.pushed += 1
+
+    def _push_update(self, server: Connection, table: Table, key: tuple, entries: list, local, result: SyncResult) -> None:
+        before = json.loads(entries[0].before)
+        server_row = server.execute(select(table).where(_key_filter(table, key))).mappings().first()
+        if server_row is None:
+            self._mark_conflict(entries, "Deleted from the database.", result)
+            return
+        local_changed, server_changed = self._changes(table, before, local, server_row)
+        conflicting = {name for name in local_changed & server_changed if not _same(_stored(table.c[name], local[name]), _stored(table.c[name], server_row[name]))}
+        # The value of binary columns before the change is not journaled: the replica's wins unless the database changed the row as well.
+        for column in table.columns:
+            if _is_binary(column) and local[column.name] != server_row[column.name]:
+                (conflicting if server_changed else local_changed).add(column.name)
+        if conflicting:
+            self._mark_conflict(entries, f"Changed in the database as well: {', '.join(sorted(conflicting))}.", result)
+            return
+
+        pushed = {name: local[name] for name in local_changed if name not in server_changed}
+        if pushed:
+            if "date_modified" in table.c:
+                pushed["date_modified"] = local["date_modified"]
+            try:
+                with server.begin():
+                    server.execute(table.update().where(_key_filter(table, key)).values(pushed))
+                    database.log_changes(server, database.changes_of(table, local, events.UPDATE, frozenset(pushed)))
+            except IntegrityError as error:
+                self._mark_conflict(entries, f"Could not be changed in the database. {error.orig}", result)
+                return
+            result.pushed += 1
+        merged = {name: server_row[name] for name in server_changed - local_changed}
+        with self._applying() as connection:
+            if merged:
+                connection.execute(table.update().where(_key_filter(table, key)).values(merged))
+                result.pulled += 1
+            self._delete_entries(connection, entries)
+
+    def _push_delete(self, server: Connection, table: Table, key: tuple, entries: list, result: SyncResult) -> None:
+        if entries[0].operation != "insert":
+            before = json.loads(entries[0].before)
+            server_row = server.execute(select(table).where(_key_filter(table, key))).mappings().first()
+            if server_row is not None:
+                _, server_changed = self._changes(table, before, None, server_row)
+                if server_changed:
+                    self._mark_conflict(entries, f"Changed in the database after it was deleted: {', '.join(sorted(server_changed))}.", result)
+                    return
+                try:
+                    with server.begin():
+                        if table is database.Flight.__table__:
+                            telemetry = database.FlightTelemetryBlock.__table__
+                            server.execute(telemetry.delete().where(telemetry.c.flight_uuid == server_row["uuid"]))
+                        server.execute(table.delete().where(_key_filter(table, key)))
+                        database.log_changes(server, database.changes_of(table, server_row, events.DELETE))
+                except IntegrityError as error:
+                    self._mark_conflict(entries, f"Could not be deleted from the database. {error.orig}", result)
+                    return
+                result.pushed += 1
+        with self.engine.begin() as connection:
+            self._delete_entries(connection, entries)
+
+    def _journaled_keys(self) -> dict[str, set[tuple]]:
+        """Returns the keys of the rows with journal entries by table name. They are not pulled, their changes are pushed first."""
+        keys = defaultdict(set)
+        with self.engine.connect() as connection:
+            for table_name, row_key in connection.execute(select(journal.c.table_name, journal.c.row_key)):
+                keys[table_name].add(tuple(json.loads(row_key)))
+        return keys
+
+    def _differs(self, table: Table, server_row, local_row) -> bool:
+        if local_row is None: return True
+        return any(not _same(server_row[column.name], local_row[column.name]) for column in table.columns)
+
+    def _pull_cursor(self) -> database.ChangeLogCursor:
+        """Returns the change log cursor of the pull, None before the first pull."""
+        with self.engine.connect() as connection:
+            pulled_change_id, gaps = connection.execute(select(control.c.pulled_change_id, control.c.change_log_gaps)).one()
+        if pulled_change_id is None: return None
+        return database.ChangeLogCursor(pulled_change_id, {int(id_): datetime.datetime.fromisoformat(skipped_at)
+                                                           for id_, skipped_at in json.loads(gaps or "{}").items()})
+
+    def _save_pull_cursor(self, cursor: database.ChangeLogCursor) -> None:
+        gaps = json.dumps({str(id_): skipped_at.isoformat() for id_, skipped_at in cursor.gaps.items()})
+        with self.engine.begin() as connection:
+            connection.execute(control.update().values(pulled_change_id=cursor.last_id, change_log_gaps=gaps))
+
+    def _pull_rows(self, server: Connection, table: Table, column: Column, values: set, journaled: set[tuple], deleted: set[tuple],
+                   result: SyncResult) -> list[events.ChangeEvent]:
+        """Copies the rows of a table whose column has one of the values from the database, or every row without a column.
+            The keys of the rows the database no longer has are added to deleted, the rows with journal entries are left alone.
+
+        Returns:
+            list[events.ChangeEvent]: The events of the rows copied.
+        """
+        changes = [] # type: list[events.ChangeEvent]
+        values = sorted(values)
+        for start in range(0, len(values), BATCH_SIZE) if column is not None else [None]:
+            if column is None:
+                query = select(table)
+            else:
+                query = select(table).where(column.in_(values[start:start + BATCH_SIZE]))
+            server_rows = {_key(table, row): row for row in server.execute(query).mappings()}
+            with self.engine.connect() as connection:
+                local_rows = {_key(table, row): row for row in connection.execute(query).mappings()}
+            changed = [dict(row) for key, row in server_rows.items() if key not in journaled and self._differs(table, row, local_rows.get(key))]
+            if changed:
+                with self._applying() as connection:
+                    connection.execute(table.insert().prefix_with("OR REPLACE"), changed)
+                result.pulled += len(changed)
+                for row in changed:
+                    changes += database.changes_of(table, row, events.UPDATE if _key(table, row) in local_rows else events.INSERT)
+            deleted.update(key for key in local_rows.keys() - server_rows.keys() - journaled if not (_has_local_ids(table) and key[0] >= LOCAL_ID_START))
+        return changes
+
+    def _pull(self, server: Connection, result: SyncResult) -> list[events.ChangeEvent]:
+        """Copies the changes of the database to the replica. Returns their events, as writes of another workstation."""
+        journaled = self._journaled_keys()
+        change_log = database.ChangeLog.__table__
+        cursor = self._pull_cursor()
+        oldest, latest = server.execute(select(func.min(change_log.c.id), func.max(change_log.c.id))).one()
+        deleted = defaultdict(set) # type: dict[str, set[tuple]]
+        changes = [] # type: list[events.ChangeEvent]
+
+        if cursor is None or (oldest is not None and (oldest > cursor.last_id + 1 or latest < cursor.last_id)):
+            # Nothing to read the changes from: first pull, or the entries after the last one pulled were pruned, and their ids maybe reused.
+            latest = latest or 0
+            present = {id_ for id_, in server.execute(select(change_log.c.id).where(change_log.c.id > latest - FULL_PULL_GAP_WINDOW))}
+            now = datetime.datetime.now()
+            cursor = database.ChangeLogCursor(latest, {id_: now for id_ in range(max(latest - FULL_PULL_GAP_WINDOW, 0) + 1, latest) if id_ not in present})
+            for table in synced_tables():
+                changes += self._pull_rows(server, table, None, set(), journaled[table.name], deleted[table.name], result)
+        else:
+            entries = server.execute(select(change_log.c.id, change_log.c.table_name, change_log.c.row_id).where(cursor.unread()).order_by(change_log.c.id)).all()
+            changed = defaultdict(set) # type: dict[str, set[int]]
+            for _, table_name, row_id in entries:
+                changed[table_name].add(row_id)
+            for table in synced_tables():
+                if events.TABLE_ID in changed[table.name]:
+                    # Written in bulk, any row may have changed.
+                    changes += self._pull_rows(server, table, None, set(), journaled[table.name], deleted[table.name], result)
+                elif database.is_logged(table):
+                    changes += self._pull_rows(server, table, table.c.id, changed[table.name], journaled[table.name], deleted[table.name], result)
+                else:
+                    for foreign_key in table.foreign_keys:
+                        if foreign_key.parent.primary_key and changed[foreign_key.column.table.name]:
+                            changes += self._pull_rows(server, table, foreign_key.parent, changed[foreign_key.column.table.name], journaled[table.name],
+                                                       deleted[table.name], result)
+            cursor.advance([id_ for id_, _, _ in entries])
+
+        for table in reversed(synced_tables()):
+            keys = sorted(deleted[table.name])
+            for start in range(0, len(keys), BATCH_SIZE):
+                with self._applying() as connection:
+                    connection.execute(table.delete().where(_keys_filter(table, keys[start:start + BATCH_SIZE])))
+            result.pulled += len(keys)
+            changes += [change for key in keys for change in database.changes_of(table, dict(zip(table.primary_key.columns.keys(), key)), events.DELETE)]
+        self._save_pull_cursor(cursor)
+
+        if result.pulled:
+            self._refresh_derived(self.engine)
+        return [dataclasses.replace(change, remote=True) for change in changes]
+
+    def _refresh_derived(self, engine) -> None:
+        """Recomputes the flight time counters and drops the readiness and compliance caches of a side, after rows were copied to it."""
+        session = database.Session(bind=engine)
+        try:
+            with database.use_session(session):
+                database.DroneFlightTime.rebuild()
+                session.query(database.AssetReadiness).delete(synchronize_session=False)
+                session.query(database.CrewCompliance).delete(synchronize_session=False)
+                session.commit()
+        finally:
+            session.close()
+
+    def conflicts(self) -> list[Conflict]:
+        conflicts = []
+        for table_name, rows in self._entries(CONFLICT).items():
+            for key, entries in rows.items():
+                conflicts.append(Conflict(table_name, list(key), entries[0].error, [entry.id for entry in entries]))
+        return conflicts
+
+    def resolve(self, conflict: Conflict, keep_local: bool) -> None:
+        """Resolves a conflict. Keeping the replica's row pushes it over the database's on the next sync, keeping the database's copies it
+        to the replica now. Both need the database.
+        """
+        table = database.Base.metadata.tables[conflict.table_name]
+        key = tuple(conflict.row_key)
+        with self.server_engine.connect() as server:
+            server_row = server.execute(select(table).where(_key_filter(table, key))).mappings().first()
+
+        with self._applying() as connection:
+            entries = and_(journal.c.table_name == table.name, journal.c.row_key == json.dumps(list(key), separators=(",", ":")))
+            if keep_local:
+                # Rebased on the database's row, every column changed in the replica is pushed.
+                first = min(conflict.entry_ids)
+                if server_row is None:
+                    connection.execute(journal.update().where(journal.c.id == first).values(operation="insert", before=None))
+                else:
+                    connection.execute(journal.update().where(journal.c.id == first)
+                                       .values(operation="update", before=_snapshot(table, server_row)))
+                connection.execute(journal.update().where(entries, journal.c.status == CONFLICT).values(status=PENDING, error=None))
+            else:
+                if server_row is None:
+                    connection.execute(table.delete().where(_key_filter(table, key)))
+                else:
+                    connection.execute(table.insert().prefix_with("OR REPLACE").values(dict(server_row)))
+                connection.execute(journal.delete().where(entries))
+
+
+def open_replica(database_config: config.DatabaseConfig=None) -> Replica:
+    """Switches the program to the replica of its database, creating it the first time.
+
+    Raises:
+        ReplicaError: If the replica does not exist yet and the database can not be reached.
+    """
+    global active_replica
+    replica = Replica(database_config)
+    if not replica.exists:
+        replica.create()
+    database.configure(replica.local_config)
+    active_replica = replica
+    return replica
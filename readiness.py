@@ -0,0 +1,100 @@
+"""Preflight readiness of the assets used by a flight, kept precomputed in the asset_readiness table."""
+from __future__ import annotations
+
+from sqlalchemy import func, tuple_
+
+from database import (global_session, Airworthyness, AssetReadiness, Battery, Drone, Equipment, EquipmentGroup, EquipmentToFlight,
+                      EquipmentType, Flight, FlightController)
+import maintenance
+
+
+def _status_reasons(label: str, status: str) -> list[str]:
+    if status in (None, Airworthyness.Airworthy.value): return []
+    return [f"{label} is {status}."]
+
+
+def _drone_reasons(drone_id: int) -> list[str]:
+    drone = global_session.get(Drone, drone_id) # type: Drone
+    label = f"Drone {drone.serial_number}"
+    reasons = _status_reasons(label, drone.status)
+    for item in maintenance.find_overdue(drone):
+        reasons.append(f"{label} is overdue: {item.description} ({item.flight_hours} of {item.interval} flight hours).")
+    return reasons
+
+
+def _battery_reasons(battery_id: int) -> list[str]:
+    battery = global_session.get(Battery, battery_id) # type: Battery
+    label = f"Battery {battery.serial_number}"
+    reasons = _status_reasons(label, battery.status)
+    if battery.remaining_charge_cycles <= 0:
+        reasons.append(f"{label} has no charge cycles left.")
+    total_flights = global_session.query(func.count(Flight.id)).filter(Flight.battery_id == battery_id, Flight.active == True).scalar()
+    if total_flights >= battery.max_flights:
+        reasons.append(f"{label} has no flights left.")
+    return reasons
+
+
+def _flight_controller_reasons(flight_controller_id: int) -> list[str]:
+    flight_controller = global_session.get(FlightController, flight_controller_id) # type: FlightController
+    return _status_reasons(f"Flight controller {flight_controller.serial_number}", flight_controller.status)
+
+
+def _equipment_reasons(equipment_id: int) -> list[str]:
+    equipment = global_session.get(Equipment, equipment_id) # type: Equipment
+    return _status_reasons(f"Equipment {equipment.serial_number}", equipment.status)
+
+
+REASONS = {
+    AssetReadiness.Drone_Asset: _drone_reasons,
+    AssetReadiness.Battery_Asset: _battery_reasons,
+    AssetReadiness.Flight_Controller_Asset: _flight_controller_reasons,
+    AssetReadiness.Equipment_Asset: _equipment_reasons,
+}
+"""Maps an asset type to the function listing why an asset of that type is not ready."""
+
+
+def compute(asset_type: str, asset_id: int) -> AssetReadiness:
+    """Computes and stores the readiness of an asset. Does not commit."""
+    reasons = REASONS[asset_type](asset_id)
+    readiness = AssetReadiness(asset_type=asset_type, asset_id=asset_id, ready=not reasons, reasons="\n".join(reasons))
+    global_session.merge(readiness)
+    return readiness
+
+
+def flight_assets(flight: Flight) -> list[tuple[str, int]]:
+    """Returns the (asset type, asset id) of the drone, flight controller, battery and airborne equipment used by a flight."""
+    assets = [(AssetReadiness.Drone_Asset, flight.drone_id), (AssetReadiness.Flight_Controller_Asset, flight.drone.flight_controller_id)]
+    if flight.battery_id is not None:
+        assets.append((AssetReadiness.Battery_Asset, flight.battery_id))
+
+    equipment = global_session.query(EquipmentToFlight.equipment_id)\
+        .join(Equipment, EquipmentToFlight.equipment_id == Equipment.id)\
+        .join(EquipmentType, Equipment.type_id == EquipmentType.id)\
+        .filter(EquipmentToFlight.flight_id == flight.id)\
+        .filter(EquipmentType.group == EquipmentGroup.Airborne_Equipment.value)
+    assets.extend((AssetReadiness.Equipment_Asset, equipment_id) for equipment_id, in equipment)
+    return assets
+
+
+def check_assets(assets: list[tuple[str, int]]) -> list[str]:
+    """Returns why any of the assets is not ready, or an empty list if all of them are.
+        Readiness is read with a single primary key lookup, only assets invalidated since their last check are recomputed.
+    """
+    if not assets: return []
+    stored = global_session.query(AssetReadiness)\
+        .filter(tuple_(AssetReadiness.asset_type, AssetReadiness.asset_id).in_(assets))\
+        .all()
+    found = {(readiness.asset_type, readiness.asset_id): readiness for readiness in stored}
+
+    missing = [asset for asset in assets if asset not in found]
+    for asset_type, asset_id in missing:
+        found[(asset_type, asset_id)] = compute(asset_type, asset_id)
+    if missing:
+        global_session.commit()
+
+    return [reason for asset in assets for reason in found[asset].reason_list]
+
+
+def check_flight(flight: Flight) -> list[str]:
+    """Returns why a flight can not start, or an empty list if every asset it uses is ready."""
+    return check_assets(flight_assets(flight))
@@ -0,0 +1,235 @@
+"""Fleet utilization and cost reports by month: flight hours per asset, maintenance spend, depreciation and cost per flight hour."""
+from __future__ import annotations
+import csv
+import datetime
+import threading
+from dataclasses import dataclass, field
+
+from sqlalchemy import and_, extract, func
+
+from database import (global_session, Battery, Drone, DroneMaintenance, Equipment, EquipmentBatteryMaintenance, EquipmentToFlight, Flight,
+                      FlightController, FlightStatus, MaintenanceStatus)
+import events
+
+
+DRONE = "drone"
+BATTERY = "battery"
+FLIGHT_CONTROLLER = "flight_controller"
+EQUIPMENT = "equipment"
+ASSET_MODELS = {
+    DRONE: Drone,
+    BATTERY: Battery,
+    FLIGHT_CONTROLLER: FlightController,
+    EQUIPMENT: Equipment,
+}
+DEPRECIATION_YEARS = {
+    DRONE: 5,
+    BATTERY: 3,
+    FLIGHT_CONTROLLER: 5,
+    EQUIPMENT: 5,
+}
+"""Straight line depreciation period of each asset type in years, from the purchase date."""
+
+
+@dataclass
+class AssetUsage:
+    """Utilization and cost of a single asset in a month."""
+    asset_type: str
+    asset_id: int
+    serial_number: str
+    name: str
+    flights: int = 0
+    hours: float = 0.00
+    maintenance_cost: float = 0.00
+    depreciation: float = 0.00
+    """Value lost in the month in US dollars."""
+    book_value: float = 0.00
+    """Value left at the end of the month in US dollars."""
+
+    @property
+    def cost(self) -> float:
+        return self.maintenance_cost + self.depreciation
+
+    @property
+    def cost_per_flight_hour(self) -> float:
+        """Returns the cost per flight hour in US dollars, or None if the asset did not fly."""
+        return round(self.cost / self.hours, 2) if self.hours else None
+
+
+@dataclass
+class PeriodReport:
+    """Utilization and cost of the fleet in a month."""
+    start: datetime.date
+    """First day of the month."""
+    assets: list[AssetUsage] = field(default_factory=list)
+
+    def _total(self, attribute: str, asset_type: str=None) -> float:
+        return round(sum(getattr(usage, attribute) for usage in self.assets if asset_type is None or usage.asset_type == asset_type), 2)
+
+    @property
+    def flights(self) -> int:
+        return int(self._total("flights", DRONE))
+
+    @property
+    def hours(self) -> float:
+        """Returns the fleet's flight hours, counted once per flight from the drones."""
+        return self._total("hours", DRONE)
+
+    @property
+    def maintenance_cost(self) -> float:
+        return self._total("maintenance_cost")
+
+    @property
+    def depreciation(self) -> float:
+        return self._total("depreciation")
+
+    @property
+    def cost_per_flight_hour(self) -> float:
+        """Returns the maintenance and depreciation of every asset per fleet flight hour, or None if nothing flew."""
+        return round((self.maintenance_cost + self.depreciation) / self.hours, 2) if self.hours else None
+
+    def by_type(self, asset_type: str) -> list[AssetUsage]:
+        return [usage for usage in self.assets if usage.asset_type == asset_type]
+
+
+_cache = {} # type: dict[datetime.date, PeriodReport]
+_lock = threading.Lock()
+"""Guards the cache, the reports are served to several threads."""
+
+
+def invalidate() -> None:
+    """Drops the cached reports. Committed writes to flights, maintenance and assets invalidate automatically, those of the other
+        workstations included, bulk writes have to call this.
+    """
+    with _lock:
+        _cache.clear()
+
+
+events.call_on_change([model.__tablename__ for model in (Flight, DroneMaintenance, EquipmentBatteryMaintenance, *ASSET_MODELS.values())], invalidate)
+
+
+def month_start(date: datetime.date) -> datetime.date:
+    return datetime.date(date.year, date.month, 1)
+
+
+def add_months(date: datetime.date, months: int) -> datetime.date:
+    index = date.year * 12 + date.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def _month_index(date: datetime.date) -> int:
+    return date.year * 12 + date.month - 1
+
+
+def _grouped_by_month(key, date_column, *values):
+    """Returns a query of (key, year, month, *values) grouped by key and month."""
+    year, month = extract("year", date_column), extract("month", date_column)
+    return global_session.query(key, year, month, *values).group_by(key, year, month)
+
+
+def _compute(start: datetime.date, months: int) -> dict[datetime.date, PeriodReport]:
+    end = add_months(start, months)
+    start_time, end_time = datetime.datetime.combine(start, datetime.time()), datetime.datetime.combine(end, datetime.time())
+    reports = {add_months(start, i): PeriodReport(add_months(start, i)) for i in range(months)}
+    usages = {} # type: dict[tuple[datetime.date, str, int], AssetUsage]
+
+    assets = {} # type: dict[tuple[str, int], tuple]
+    for asset_type, model in ASSET_MODELS.items():
+        for asset_id, serial_number, name, purchase_date, item_value in global_session.query(model.id, model.serial_number, model.name, model.purchase_date, model.item_value):
+            assets[(asset_type, asset_id)] = (serial_number, name, purchase_date, item_value or 0.00)
+
+    def usage_for(period: datetime.date, asset_type: str, asset_id: int) -> AssetUsage:
+        key = (period, asset_type, asset_id)
+        if key not in usages:
+            serial_number, name, _, _ = assets.get((asset_type, asset_id), (None, None, None, 0.00))
+            usages[key] = AssetUsage(asset_type, asset_id, serial_number, name)
+        return usages[key]
+
+    completed = and_(Flight.active == True, Flight.status_id == FlightStatus.Completed.id, Flight.date >= start_time, Flight.date < end_time)
+    flight_values = (func.count(Flight.id), func.coalesce(func.sum(Flight.duration), 0))
+    usage_queries = {
+        DRONE: _grouped_by_month(Flight.drone_id, Flight.date, *flight_values).filter(completed),
+        BATTERY: _grouped_by_month(Flight.battery_id, Flight.date, *flight_values).filter(completed, Flight.battery_id != None),
+        # Flight hours are credited to the flight controller currently installed in the drone.
+        FLIGHT_CONTROLLER: _grouped_by_month(Drone.flight_controller_id, Flight.date, *flight_values)
+            .join(Drone, Flight.drone_id == Drone.id)
+            .filter(completed),
+        EQUIPMENT: _grouped_by_month(EquipmentToFlight.equipment_id, Flight.date, *flight_values)
+            .join(Flight, EquipmentToFlight.flight_id == Flight.id)
+            .filter(completed),
+    }
+    for asset_type, query in usage_queries.items():
+        for asset_id, year, month, flights, minutes in query:
+            usage = usage_for(datetime.date(int(year), int(month), 1), asset_type, asset_id)
+            usage.flights = flights
+            usage.hours = round(minutes / 60, 2)
+
+    maintenance_queries = {
+        DRONE: _grouped_by_month(DroneMaintenance.drone_id, DroneMaintenance.date_scheduled, func.coalesce(func.sum(DroneMaintenance.cost), 0))
+            .filter(DroneMaintenance.status_id == MaintenanceStatus.Completed.id)
+            .filter(DroneMaintenance.date_scheduled >= start_time, DroneMaintenance.date_scheduled < end_time),
+        EQUIPMENT: _grouped_by_month(EquipmentBatteryMaintenance.equipment_id, EquipmentBatteryMaintenance.date_scheduled,
+                                     func.coalesce(func.sum(EquipmentBatteryMaintenance.cost), 0))
+            .filter(EquipmentBatteryMaintenance.status_id == MaintenanceStatus.Completed.id)
+            .filter(EquipmentBatteryMaintenance.date_scheduled >= start_time, EquipmentBatteryMaintenance.date_scheduled < end_time),
+    }
+    for asset_type, query in maintenance_queries.items():
+        for asset_id, year, month, cost in query:
+            if asset_id is None: continue
+            usage_for(datetime.date(int(year), int(month), 1), asset_type, asset_id).maintenance_cost = round(cost, 2)
+
+    for (asset_type, asset_id), (_, _, purchase_date, item_value) in assets.items():
+        if not item_value or purchase_date is None: continue
+        life = DEPRECIATION_YEARS[asset_type] * 12
+        purchased = _month_index(purchase_date)
+        for period in reports:
+            months_owned = _month_index(period) - purchased + 1
+            if months_owned <= 0: continue
+            book_value = round(item_value * max(0.00, 1 - months_owned / life), 2)
+            depreciation = round(item_value / life, 2) if months_owned <= life else 0.00
+            if not depreciation and (period, asset_type, asset_id) not in usages: continue
+            usage = usage_for(period, asset_type, asset_id)
+            usage.depreciation = depreciation
+            usage.book_value = book_value
+
+    for (period, _, _), usage in usages.items():
+        reports[period].assets.append(usage)
+    for report in reports.values():
+        report.assets.sort(key=lambda usage: (usage.asset_type, -usage.hours, usage.serial_number or ""))
+    return reports
+
+
+def fleet_report(end: datetime.date=None, months: int=12) -> list[PeriodReport]:
+    """Returns the monthly reports of a period, oldest first. Months not cached yet are computed together with a few grouped queries.
+
+    Args:
+        end (datetime.date, Optional): A day in the last month of the report. Defaults to today.
+        months (int, Optional): Number of months in the report. Defaults to 12.
+    """
+    last = month_start(end or datetime.date.today())
+    periods = [add_months(last, i - months + 1) for i in range(months)]
+    with _lock:
+        missing = [period for period in periods if period not in _cache]
+        if missing:
+            _cache.update(_compute(missing[0], _month_index(missing[-1]) - _month_index(missing[0]) + 1))
+        return [_cache[period] for period in periods]
+
+
+def period_report(date: datetime.date) -> PeriodReport:
+    """Returns the report of the month a date is in."""
+    return fleet_report(date, months=1)[0]
+
+
+def write_csv(reports: list[PeriodReport], file_path: str) -> None:
+    """Writes the reports to a CSV file, one row per asset per month followed by the month's fleet totals."""
+    with open(file_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Month", "Asset Type", "Serial Number", "Name", "Flights", "Flight Hours", "Maintenance Cost", "Depreciation",
+                         "Book Value", "Cost Per Flight Hour"])
+        for report in reports:
+            month = report.start.strftime("%Y-%m")
+            for usage in report.assets:
+                writer.writerow([month, usage.asset_type, usage.serial_number, usage.name, usage.flights, usage.hours, usage.maintenance_cost,
+                                 usage.depreciation, usage.book_value, usage.cost_per_flight_hour])
+            writer.writerow([month, "fleet", "", "Total", report.flights, report.hours, report.maintenance_cost, report.depreciation, "",
+                             report.cost_per_flight_hour])
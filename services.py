@@ -0,0 +1,293 @@
+"""The logbook's operations as plain functions over an injected session, for scripts, batch jobs and servers that run without the GUI.
+
+Every operation takes the session to run on as its first argument. The models use global_session, which each operation points at that
+session on the calling thread, so the same model code runs whichever session is passed. A failed operation rolls its session back.
+The analytics caches (reports, crewstats, batteryanalytics) are kept per process, so a process should work on a single database.
+"""
+from __future__ import annotations
+import datetime
+import functools
+import threading
+from dataclasses import dataclass
+
+from sqlalchemy import and_, create_engine, func, or_
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm.session import Session
+
+import config
+import database
+from database import Airworthyness, Battery, CrewMember, CrewMemberRole, Drone, Equipment, EquipmentToFlight, Flight, FlightStatus, FlightType
+from errors import InvalidArgumentError, RecordNotFoundError
+import batteryanalytics
+import crewstats
+import maintenance
+import reports
+import weightbalance
+
+
+SEARCH_LIMIT = 100
+"""Default number of records returned by a search."""
+FLIGHT_ATTRIBUTES = ("name", "notes", "address", "active", "location_latitude", "location_longitude", "night_flight", "max_agl_altitude",
+                     "distance_traveled", "utm_authorization", "external_case_id", "in_flight_notes", "post_flight_notes")
+"""Flight columns update_flight sets. The status, battery and equipment change through their own operations."""
+
+_engines = {} # type: dict[str, Engine]
+_engines_lock = threading.Lock()
+
+
+@dataclass
+class FlightTotals:
+    """Completed flights of a drone over a period."""
+    drone_id: int
+    drone_name: str
+    flights: int
+    minutes: float
+    distance: float
+    """Distance traveled in meters."""
+
+
+def open_session(database_config: config.DatabaseConfig=None) -> Session:
+    """Opens a new session, on the program's database unless another one is given. Engines are created once per URL and shared by the sessions."""
+    if database_config is None:
+        return database.Session()
+    url = database_config.database_url
+    with _engines_lock:
+        if url not in _engines:
+            _engines[url] = create_engine(url, **config.engine_options(database_config))
+        engine = _engines[url]
+    return database.Session(bind=engine)
+
+
+def operation(function):
+    """Runs an operation with global_session pointed at the session passed as its first argument, rolling the session back if it fails."""
+    @functools.wraps(function)
+    def wrapper(session: Session, *args, **kwargs):
+        with database.use_session(session):
+            try:
+                return function(session, *args, **kwargs)
+            except Exception:
+                session.rollback()
+                raise
+    return wrapper
+
+
+def get(session: Session, model, id_: int):
+    """Returns a record by id.
+
+    Raises:
+        RecordNotFoundError: If there is no record with the id.
+    """
+    record = session.get(model, id_)
+    if record is None:
+        raise RecordNotFoundError(f"{model.__name__} {id_} does not exist.")
+    return record
+
+
+@operation
+def create_schema(session: Session) -> None:
+    """Creates the tables and the default data of a new database, like a fresh SQLite file in tests. Existing tables and data are kept."""
+    database.Base.metadata.create_all(session.get_bind())
+    if session.query(FlightStatus.id).first() is None:
+        database.create_default_data()
+
+
+@operation
+def create_flight(session: Session, drone_id: int, type_id: int, crew: list[tuple[int, int]]=None, battery_id: int=None) -> Flight:
+    """Creates a flight.
+
+    Args:
+        crew (list[tuple[int, int]], Optional): The (crew member id, role id) of the crew.
+        battery_id (int, Optional): The battery flown, it must be assigned to the drone.
+    """
+    crew = [(get(session, CrewMember, crew_member_id), get(session, CrewMemberRole, role_id)) for crew_member_id, role_id in crew or []]
+    flight = Flight.create(get(session, Drone, drone_id), get(session, FlightType, type_id), crew=crew)
+    if battery_id is not None:
+        flight.set_battery(get(session, Battery, battery_id))
+    return flight
+
+
+@operation
+def set_flight_battery(session: Session, flight_id: int, battery_id: int) -> Flight:
+    flight = get(session, Flight, flight_id)
+    flight.set_battery(get(session, Battery, battery_id))
+    return flight
+
+
+@operation
+def update_flight(session: Session, flight_id: int, **attributes) -> Flight:
+    """Sets attributes of a flight through Flight.set_attribute, which keeps the geohash and the flight time totals up to date.
+
+    Raises:
+        InvalidArgumentError: If an attribute is not in FLIGHT_ATTRIBUTES.
+    """
+    unknown = sorted(set(attributes) - set(FLIGHT_ATTRIBUTES))
+    if unknown:
+        raise InvalidArgumentError(f"Flight attributes {', '.join(unknown)} can not be set.")
+    flight = get(session, Flight, flight_id)
+    for name, value in attributes.items():
+        flight.set_attribute(getattr(Flight, name), value)
+    return flight
+
+
+@operation
+def start_flight(session: Session, flight_id: int) -> Flight:
+    """Starts a flight, after the same readiness, compliance and weight checks as the GUI."""
+    flight = get(session, Flight, flight_id)
+    flight.start()
+    return flight
+
+
+@operation
+def end_flight(session: Session, flight_id: int, duration: float) -> Flight:
+    """Ends a flight.
+
+    Args:
+        duration (float): The flight time in minutes.
+    """
+    flight = get(session, Flight, flight_id)
+    flight.end(duration)
+    return flight
+
+
+@operation
+def add_equipment(session: Session, flight_id: int, equipment_ids: list[int]) -> Flight:
+    """Attaches equipment to a flight in one commit. Equipment already attached is ignored."""
+    flight = get(session, Flight, flight_id)
+    equipment_ids = set(equipment_ids)
+    found = {id_ for id_, in session.query(Equipment.id).filter(Equipment.id.in_(equipment_ids))}
+    if equipment_ids - found:
+        raise RecordNotFoundError(f"Equipment {', '.join(str(id_) for id_ in sorted(equipment_ids - found))} does not exist.")
+    attached = {id_ for id_, in session.query(EquipmentToFlight.equipment_id).filter(EquipmentToFlight.flight_id == flight_id)}
+    session.add_all([EquipmentToFlight(flight_id=flight_id, equipment_id=id_) for id_ in sorted(equipment_ids - attached)])
+    flight.date_modified = datetime.datetime.now()
+    session.commit()
+    return flight
+
+
+@operation
+def remove_equipment(session: Session, flight_id: int, equipment_ids: list[int]) -> Flight:
+    """Detaches equipment from a flight in one commit. Equipment not attached is ignored."""
+    flight = get(session, Flight, flight_id)
+    session.query(EquipmentToFlight)\
+        .filter(EquipmentToFlight.flight_id == flight_id, EquipmentToFlight.equipment_id.in_(list(equipment_ids)))\
+        .delete(synchronize_session=False)
+    flight.date_modified = datetime.datetime.now()
+    session.commit()
+    session.expire(flight, ["used_equipment"])
+    return flight
+
+
+@operation
+def search_flights(session: Session, drone_id: int=None, type_id: int=None, status_id: int=None, date_from: datetime.datetime=None,
+                   date_to: datetime.datetime=None, text: str=None, active: bool=True, limit: int=SEARCH_LIMIT, offset: int=0,
+                   after: tuple[datetime.datetime, int]=None) -> list[Flight]:
+    """Finds flights, most recent first.
+
+    Args:
+        date_from (datetime.datetime, Optional): Only flights on or after this date.
+        date_to (datetime.datetime, Optional): Only flights before this date.
+        text (str, Optional): Matched against the uuid, name and address.
+        active (bool, Optional): Only active flights if True, only inactive ones if False, both if None. Defaults to True.
+        after (tuple[datetime.datetime, int], Optional): The (date, id) of the last flight of the previous page. Pages with it instead of the offset,
+            which stays fast deep into the results and does not skip or repeat flights added meanwhile.
+    """
+    query = session.query(Flight)
+    if drone_id is not None:
+        query = query.filter(Flight.drone_id == drone_id)
+    if type_id is not None:
+        query = query.filter(Flight.type_id == type_id)
+    if status_id is not None:
+        query = query.filter(Flight.status_id == status_id)
+    if date_from is not None:
+        query = query.filter(Flight.date >= date_from)
+    if date_to is not None:
+        query = query.filter(Flight.date < date_to)
+    if text:
+        query = query.filter(or_(Flight.uuid == text, Flight.name.like(f"%{text}%"), Flight.address.like(f"%{text}%")))
+    if active is not None:
+        query = query.filter(Flight.active == active)
+    if after is not None:
+        date, id_ = after
+        query = query.filter(or_(Flight.date < date, and_(Flight.date == date, Flight.id < id_)))
+    return query.order_by(Flight.date.desc(), Flight.id.desc()).offset(offset).limit(limit).all()
+
+
+def _search_assets(session: Session, model, text: str, status: Airworthyness, limit: int, offset: int, after: tuple[str, int]) -> list:
+    query = session.query(model)
+    if text:
+        query = query.filter(or_(model.serial_number.like(f"%{text}%"), model.name.like(f"%{text}%")))
+    if status is not None:
+        query = query.filter(model.status == status.value)
+    if after is not None:
+        name, id_ = after
+        query = query.filter(or_(model.name > name, and_(model.name == name, model.id > id_)))
+    return query.order_by(model.name, model.id).offset(offset).limit(limit).all()
+
+
+@operation
+def search_drones(session: Session, text: str=None, status: Airworthyness=None, limit: int=SEARCH_LIMIT, offset: int=0,
+                  after: tuple[str, int]=None) -> list[Drone]:
+    """Finds drones by serial number or name, and status, by name.
+
+    Args:
+        after (tuple[str, int], Optional): The (name, id) of the last drone of the previous page, to page without an offset.
+    """
+    return _search_assets(session, Drone, text, status, limit, offset, after)
+
+
+@operation
+def search_batteries(session: Session, text: str=None, status: Airworthyness=None, limit: int=SEARCH_LIMIT, offset: int=0,
+                     after: tuple[str, int]=None) -> list[Battery]:
+    """Finds batteries by serial number or name, and status."""
+    return _search_assets(session, Battery, text, status, limit, offset, after)
+
+
+@operation
+def search_equipment(session: Session, text: str=None, status: Airworthyness=None, limit: int=SEARCH_LIMIT, offset: int=0,
+                     after: tuple[str, int]=None) -> list[Equipment]:
+    """Finds equipment by serial number or name, and status."""
+    return _search_assets(session, Equipment, text, status, limit, offset, after)
+
+
+@operation
+def flight_totals(session: Session, date_from: datetime.datetime=None, date_to: datetime.datetime=None) -> list[FlightTotals]:
+    """Totals the completed, active flights of each drone over a period in one grouped query, most flown first."""
+    query = session.query(Drone.id, Drone.name, func.count(Flight.id), func.coalesce(func.sum(Flight.duration), 0), func.coalesce(func.sum(Flight.distance_traveled), 0))\
+        .join(Flight, Flight.drone_id == Drone.id)\
+        .filter(Flight.active == True, Flight.status_id == FlightStatus.Completed.id)
+    if date_from is not None:
+        query = query.filter(Flight.date >= date_from)
+    if date_to is not None:
+        query = query.filter(Flight.date < date_to)
+    totals = [FlightTotals(*row) for row in query.group_by(Drone.id, Drone.name)]
+    return sorted(totals, key=lambda totals: totals.minutes, reverse=True)
+
+
+@operation
+def fleet_report(session: Session, end: datetime.date=None, months: int=12) -> list[reports.PeriodReport]:
+    """Monthly utilization and cost of the fleet, see reports.fleet_report."""
+    return reports.fleet_report(end, months)
+
+
+@operation
+def crew_stats(session: Session) -> dict[int, crewstats.CrewStats]:
+    """Logbook hours and currency of every crew member by crew member id."""
+    return crewstats.all_stats()
+
+
+@operation
+def battery_health(session: Session) -> dict[int, batteryanalytics.BatteryHealth]:
+    """Health and forecast of every battery by battery id. Needs numpy."""
+    return batteryanalytics.analyze()
+
+
+@operation
+def weight_audit(session: Session, overweight_only: bool=True) -> list[weightbalance.FlightWeight]:
+    """Takeoff weight and payload margin of the historical flights, most overweight first."""
+    return weightbalance.audit(overweight_only)
+
+
+@operation
+def maintenance_due(session: Session, due_soon: float=maintenance.DUE_SOON) -> list[maintenance.MaintenanceDue]:
+    """Scheduled maintenance due or overdue across the fleet."""
+    return maintenance.find_due(due_soon)
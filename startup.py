@@ -0,0 +1,108 @@
+"""Staged application startup. The stages run in order on a worker thread and report their progress to the splash screen."""
+from __future__ import annotations
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from PyQt5 import QtCore
+
+import database
+import offlinesync
+
+
+@dataclass
+class Stage:
+    name: str
+    """Shown on the splash screen while the stage runs."""
+    function: Callable[[], Any]
+    weight: int = 1
+    """Share of the progress bar, relative to the other stages."""
+
+
+@dataclass
+class StartupResult:
+    results: dict[str, Any] = field(default_factory=dict)
+    """What each stage's function returned, by stage name."""
+    timings: dict[str, float] = field(default_factory=dict)
+    """Seconds each stage took, by stage name."""
+
+
+@dataclass
+class ReferenceData:
+    """Names of the rows of the reference tables, loaded once at startup to fill the comboboxes."""
+    flight_types: list[str]
+    flight_statuses: list[str]
+    flight_operation_types: list[str]
+    flight_operation_approvals: list[str]
+    legal_rules: list[str]
+    battery_chemistries: list[str]
+    """Combobox names of the battery chemistries."""
+    equipment_types: list[str]
+    drone_geometries: list[str]
+
+
+def connect() -> None:
+    """Opens a first connection to the database, so a missing server fails here instead of in the first query.
+        With a replica configured, switches the program to the replica instead, which only needs the server the first time.
+    """
+    if database.DATABASE_CONFIG.replica:
+        offlinesync.open_replica()
+        return
+    with database.engine.connect():
+        pass
+
+
+def load_reference_data() -> ReferenceData:
+    session = database.global_session
+
+    def names(model) -> list[str]:
+        return [name for name, in session.query(model.name).order_by(model.id)]
+
+    return ReferenceData(
+        flight_types=names(database.FlightType),
+        flight_statuses=names(database.FlightStatus),
+        flight_operation_types=names(database.FlightOperationType),
+        flight_operation_approvals=names(database.FlightOperationApproval),
+        legal_rules=names(database.LegalRule),
+        battery_chemistries=[chemistry.combobox_name for chemistry in session.query(database.BatteryChemistry).order_by(database.BatteryChemistry.id)],
+        equipment_types=names(database.EquipmentType),
+        drone_geometries=names(database.DroneGeometry),
+    )
+
+
+class StartupWorker(QtCore.QObject):
+    """Runs the startup stages on the thread it is moved to. The GUI thread must not use the database until finished or failed is emitted."""
+    progress = QtCore.pyqtSignal(int, str)
+    finished = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, stages: list[Stage], progress_range: int=100):
+        """
+        Args:
+            stages (list[Stage]): The stages to run, in order.
+            progress_range (int, Optional): The progress reported once every stage is done. Defaults to 100.
+        """
+        super().__init__()
+        self.stages = stages
+        self.progress_range = progress_range
+
+    def run(self) -> None:
+        total = sum(stage.weight for stage in self.stages) or 1
+        done = 0
+        result = StartupResult()
+        try:
+            for stage in self.stages:
+                self.progress.emit(round(done / total * self.progress_range), stage.name)
+                start = time.perf_counter()
+                try:
+                    result.results[stage.name] = stage.function()
+                except Exception as error:
+                    self.failed.emit(f"{stage.name} failed.\n{error}")
+                    return
+                result.timings[stage.name] = time.perf_counter() - start
+                done += stage.weight
+        finally:
+            # The stages ran on this thread's own session.
+            database.global_session.remove()
+        self.progress.emit(self.progress_range, "Opening window")
+        self.finished.emit(result)
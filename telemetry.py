@@ -0,0 +1,572 @@
+"""Ingestion of flight controller telemetry logs (CSV, ArduPilot DataFlash and PX4 ULog) into the flight log."""
+from __future__ import annotations
+import bisect
+import csv
+import datetime
+import itertools
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from database import global_session, generate_unique_string, log_bulk_write, Drone, DroneFlightTime, Flight, FlightController, FlightStatus, FlightType
+from errors import MissingRequiredSoftwareError, TelemetryLogError
+import bulkimport
+import geo
+
+numpy = None
+"""Imported by _check_numpy when the first log is read."""
+
+
+CSV_CHUNK_SIZE = 100000
+"""Number of CSV rows reduced at a time."""
+GATHER_CHUNK_SIZE = 100000
+"""Number of binary log messages copied out of the memory-mapped file at a time."""
+AIRBORNE_ALTITUDE = 1.0
+"""Height above the takeoff point in meters above which the drone is considered airborne."""
+MATCH_WINDOW = datetime.timedelta(minutes=30)
+"""A log is matched to an existing flight of the drone if their start times are within this window."""
+EARTH_RADIUS = 6371008.8
+"""Mean radius of the earth in meters."""
+GPS_EPOCH = datetime.datetime(1980, 1, 6, tzinfo=datetime.timezone.utc)
+GPS_LEAP_SECONDS = 18
+
+
+@dataclass
+class TelemetrySummary:
+    """Flight statistics computed from a single telemetry log."""
+    file_path: str
+    start_time: datetime.datetime = None
+    duration: float = 0.00
+    """The flight time in minutes."""
+    distance_traveled: float = 0.00
+    """The distance traveled in meters."""
+    max_agl_altitude: float = 0.00
+    """The maximum height above the takeoff point in meters."""
+    takeoff_latitude: float = None
+    takeoff_longitude: float = None
+    min_battery_voltage: float = None
+    """The lowest battery pack voltage in volts."""
+    error: str = None
+    """Why the log could not be read, if it could not."""
+
+
+@dataclass
+class TelemetryIngestResult:
+    created: int = 0
+    updated: int = 0
+    failed: list[TelemetrySummary] = field(default_factory=list)
+
+
+def _check_numpy() -> None:
+    """Imports numpy on first use, it is slow to import."""
+    global numpy
+    if numpy is not None: return
+    try:
+        import numpy
+    except ImportError:
+        raise MissingRequiredSoftwareError("Missing required python package numpy. Please install it to import telemetry logs.")
+
+
+def haversine(latitude: numpy.ndarray, longitude: numpy.ndarray) -> numpy.ndarray:
+    """Returns the great circle distances in meters between consecutive coordinates given in degrees."""
+    latitude = numpy.radians(latitude)
+    longitude = numpy.radians(longitude)
+    a = numpy.sin(numpy.diff(latitude) / 2) ** 2 + numpy.cos(latitude[:-1]) * numpy.cos(latitude[1:]) * numpy.sin(numpy.diff(longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(a))
+
+
+class TelemetryReduction:
+    """Accumulates flight statistics over chunks of telemetry samples, so a log never has to be held in memory at once."""
+
+    def __init__(self):
+        self.first_time = None # type: float
+        self.last_time = None # type: float
+        self.first_airborne_time = None # type: float
+        self.last_airborne_time = None # type: float
+        self.has_altitude = False
+        self.ground_altitude = None # type: float
+        self.takeoff = None # type: tuple[float, float]
+        self.last_fix = None # type: tuple[float, float]
+        self.distance = 0.00
+        self.max_altitude = 0.00
+        self.min_voltage = None # type: float
+
+    def add_positions(self, time: numpy.ndarray, latitude: numpy.ndarray, longitude: numpy.ndarray, altitude: numpy.ndarray=None) -> None:
+        """Adds a chunk of position samples.
+
+        Args:
+            time (numpy.ndarray): Sample times in seconds.
+            latitude (numpy.ndarray): Latitudes in degrees.
+            longitude (numpy.ndarray): Longitudes in degrees.
+            altitude (numpy.ndarray, Optional): Altitudes in meters. Any reference works, heights are taken relative to the first fix.
+        """
+        valid = numpy.isfinite(time) & numpy.isfinite(latitude) & numpy.isfinite(longitude) & ((latitude != 0) | (longitude != 0))
+        if altitude is not None:
+            valid &= numpy.isfinite(altitude)
+        if not valid.any(): return
+        time, latitude, longitude = time[valid], latitude[valid], longitude[valid]
+
+        if self.takeoff is None:
+            self.takeoff = (float(latitude[0]), float(longitude[0]))
+            self.first_time = float(time[0])
+        self.last_time = float(time[-1])
+
+        if self.last_fix is not None:
+            latitude = numpy.concatenate(([self.last_fix[0]], latitude))
+            longitude = numpy.concatenate(([self.last_fix[1]], longitude))
+        self.distance += float(haversine(latitude, longitude).sum())
+        self.last_fix = (float(latitude[-1]), float(longitude[-1]))
+
+        if altitude is None: return
+        altitude = altitude[valid]
+        self.has_altitude = True
+        if self.ground_altitude is None:
+            self.ground_altitude = float(altitude[0])
+        height = altitude - self.ground_altitude
+        self.max_altitude = max(self.max_altitude, float(height.max()))
+
+        airborne = numpy.flatnonzero(height > AIRBORNE_ALTITUDE)
+        if len(airborne) == 0: return
+        if self.first_airborne_time is None:
+            self.first_airborne_time = float(time[airborne[0]])
+        self.last_airborne_time = float(time[airborne[-1]])
+
+    def add_voltages(self, voltage: numpy.ndarray) -> None:
+        """Adds a chunk of battery pack voltages in volts. Zero readings from a disconnected monitor are ignored."""
+        voltage = voltage[numpy.isfinite(voltage) & (voltage > 0)]
+        if len(voltage) == 0: return
+        minimum = float(voltage.min())
+        self.min_voltage = minimum if self.min_voltage is None else min(self.min_voltage, minimum)
+
+    def summary(self, file_path: str, start_time: datetime.datetime) -> TelemetrySummary:
+        """Returns the flight statistics of all the samples added."""
+        if self.takeoff is None:
+            raise TelemetryLogError(f"No GPS positions found in telemetry log {file_path}.")
+
+        if not self.has_altitude:
+            seconds = self.last_time - self.first_time
+        elif self.first_airborne_time is None:
+            seconds = 0.00
+        else:
+            seconds = self.last_airborne_time - self.first_airborne_time
+
+        return TelemetrySummary(
+            file_path=file_path,
+            start_time=start_time,
+            duration=round(seconds / 60, 2),
+            distance_traveled=round(self.distance, 2),
+            max_agl_altitude=round(self.max_altitude, 2),
+            takeoff_latitude=self.takeoff[0],
+            takeoff_longitude=self.takeoff[1],
+            min_battery_voltage=None if self.min_voltage is None else round(self.min_voltage, 3),
+        )
+
+
+def _gps_time(week: int, milliseconds: int) -> datetime.datetime:
+    """Converts a GPS week and time of week to a local datetime."""
+    utc = GPS_EPOCH + datetime.timedelta(weeks=int(week), milliseconds=int(milliseconds) - GPS_LEAP_SECONDS * 1000)
+    return utc.astimezone().replace(tzinfo=None)
+
+
+def _map_file(file_path: str) -> numpy.ndarray:
+    """Memory-maps a binary log as bytes."""
+    if os.path.getsize(file_path) == 0:
+        raise TelemetryLogError(f"Telemetry log {file_path} is empty.")
+    return numpy.memmap(file_path, dtype=numpy.uint8, mode="r")
+
+
+def _gather(data: numpy.ndarray, offsets: numpy.ndarray, dtype: numpy.dtype) -> numpy.ndarray:
+    """Copies fixed size records starting at the given offsets of a mapped file into a structured array."""
+    records = numpy.empty(len(offsets), dtype=dtype)
+    columns = numpy.arange(dtype.itemsize)
+    for start in range(0, len(offsets), GATHER_CHUNK_SIZE):
+        chunk = offsets[start:start + GATHER_CHUNK_SIZE]
+        records[start:start + len(chunk)] = data[chunk[:, None] + columns].view(dtype).reshape(len(chunk))
+    return records
+
+
+# CSV columns, as accepted header names and the factor converting them to seconds, degrees, meters and volts.
+CSV_COLUMNS = {
+    "time": {"time": 1, "time_s": 1, "time(s)": 1, "timestamp": 1, "time_ms": 1e-3, "time(ms)": 1e-3, "time(millisecond)": 1e-3, "time_us": 1e-6, "timeus": 1e-6},
+    "latitude": {"lat": 1, "latitude": 1},
+    "longitude": {"lon": 1, "lng": 1, "longitude": 1},
+    "altitude": {"alt": 1, "altitude": 1, "relative_alt": 1, "height": 1, "height_above_takeoff(meters)": 1, "height_above_takeoff(feet)": 0.3048},
+    "voltage": {"voltage": 1, "volt": 1, "voltage(v)": 1, "battery_voltage": 1},
+}
+CSV_START_TIME_COLUMNS = ["datetime(utc)", "datetime", "date_time"]
+CSV_UTC_START_TIME_COLUMNS = {"datetime(utc)"}
+"""Start time columns holding UTC rather than local times."""
+
+
+def read_csv(file_path: str) -> TelemetrySummary:
+    """Reduces a CSV telemetry log in chunks of CSV_CHUNK_SIZE rows."""
+    reduction = TelemetryReduction()
+    start_time = None
+
+    with open(file_path, "r", newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = [name.strip().lower() for name in next(reader, [])]
+
+        indexes, scales = {}, {}
+        for name, aliases in CSV_COLUMNS.items():
+            for alias, scale in aliases.items():
+                if alias in header:
+                    indexes[name], scales[name] = header.index(alias), scale
+                    break
+        if not {"time", "latitude", "longitude"} <= indexes.keys():
+            raise TelemetryLogError(f"Telemetry log {file_path} is missing a time, latitude or longitude column.")
+        start_time_column = next((name for name in CSV_START_TIME_COLUMNS if name in header), None)
+        start_time_index = None if start_time_column is None else header.index(start_time_column)
+
+        names = list(indexes.keys())
+        while True:
+            rows = list(itertools.islice(reader, CSV_CHUNK_SIZE))
+            if not rows: break
+            if start_time is None and start_time_index is not None:
+                start_time = bulkimport.to_datetime(rows[0][start_time_index], utc=start_time_column in CSV_UTC_START_TIME_COLUMNS)
+
+            block = numpy.array([[row[indexes[name]] if indexes[name] < len(row) else "" for name in names] for row in rows])
+            block[numpy.char.str_len(block) == 0] = "nan"
+            values = {name: block[:, i].astype(float) * scales[name] for i, name in enumerate(names)}
+
+            reduction.add_positions(values["time"], values["latitude"], values["longitude"], values.get("altitude"))
+            if "voltage" in values:
+                reduction.add_voltages(values["voltage"])
+
+    return reduction.summary(file_path, start_time)
+
+
+DATAFLASH_HEADER = (0xA3, 0x95)
+DATAFLASH_FMT_TYPE = 128
+DATAFLASH_FMT_DTYPE = [("type", "u1"), ("length", "u1"), ("name", "S4"), ("format", "S16"), ("labels", "S64")]
+# DataFlash format characters, as numpy types and the scale applied to the stored integers.
+DATAFLASH_TYPES = {
+    "a": ("(32,)<i2", 1), "b": ("i1", 1), "B": ("u1", 1), "h": ("<i2", 1), "H": ("<u2", 1), "i": ("<i4", 1), "I": ("<u4", 1),
+    "f": ("<f4", 1), "d": ("<f8", 1), "n": ("S4", 1), "N": ("S16", 1), "Z": ("S64", 1), "c": ("<i2", 0.01), "C": ("<u2", 0.01),
+    "e": ("<i4", 0.01), "E": ("<u4", 0.01), "L": ("<i4", 1e-7), "M": ("u1", 1), "q": ("<i8", 1), "Q": ("<u8", 1),
+}
+
+
+def _dataflash_messages(data: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, dict]:
+    """Finds every message of a DataFlash log.
+
+    Messages are not length prefixed, so header candidates are located with a vectorized byte search
+    and a candidate is kept only if its declared length ends exactly on another message or the end of the log.
+
+    Returns:
+        tuple[numpy.ndarray, numpy.ndarray, dict]: The offsets and types of the messages and the message formats by name.
+    """
+    candidates = numpy.flatnonzero((data[:-2] == DATAFLASH_HEADER[0]) & (data[1:-1] == DATAFLASH_HEADER[1]))
+    types = data[candidates + 2]
+
+    fmt_dtype = numpy.dtype(DATAFLASH_FMT_DTYPE)
+    fmt_offsets = candidates[(types == DATAFLASH_FMT_TYPE) & (candidates + 3 + fmt_dtype.itemsize <= len(data))]
+    lengths = numpy.zeros(256, dtype=numpy.int64)
+    formats = {}
+    for fmt in _gather(data, fmt_offsets + 3, fmt_dtype):
+        if lengths[fmt["type"]] or fmt["length"] <= 3: continue
+        lengths[fmt["type"]] = fmt["length"]
+        formats[fmt["name"].decode("ascii", "ignore")] = (int(fmt["type"]), fmt["format"].decode("ascii", "ignore"),
+                                                          fmt["labels"].decode("ascii", "ignore").split(","))
+    if not formats:
+        raise TelemetryLogError("No message formats found in DataFlash log.")
+
+    ends = candidates + lengths[types]
+    valid = (lengths[types] > 0) & (ends <= len(data))
+    starts = numpy.zeros(len(data) + 1, dtype=bool)
+    starts[candidates[valid]] = True
+    starts[len(data)] = True
+    valid &= starts[numpy.minimum(ends, len(data))]
+
+    # Header bytes inside another message's payload can still chain up by chance, drop any candidate inside the previous message.
+    while True:
+        kept = numpy.flatnonzero(valid)
+        overlapping = candidates[kept[1:]] < ends[kept[:-1]]
+        if not overlapping.any(): break
+        valid[kept[1:][overlapping]] = False
+
+    return candidates[valid], types[valid], formats
+
+
+def _dataflash_fields(data: numpy.ndarray, offsets: numpy.ndarray, types: numpy.ndarray, formats: dict, name: str) -> dict[str, numpy.ndarray]:
+    """Returns the numeric fields of every message of a type, scaled to their units. Empty if the log has no such message."""
+    if name not in formats: return {}
+    type_, format_, labels = formats[name]
+    if len(format_) != len(labels) or any(char not in DATAFLASH_TYPES for char in format_): return {}
+
+    dtype = numpy.dtype({"names": labels, "formats": [DATAFLASH_TYPES[char][0] for char in format_]})
+    records = _gather(data, offsets[types == type_] + 3, dtype)
+    return {label: records[label].astype(float) * DATAFLASH_TYPES[char][1]
+            for label, char in zip(labels, format_) if char not in "anNZ"}
+
+
+def read_dataflash(file_path: str) -> TelemetrySummary:
+    """Reduces an ArduPilot DataFlash (.bin) log."""
+    data = _map_file(file_path)
+    offsets, types, formats = _dataflash_messages(data)
+
+    reduction = TelemetryReduction()
+    start_time = None
+
+    gps = _dataflash_fields(data, offsets, types, formats, "GPS")
+    if gps:
+        time = gps["TimeUS"] * 1e-6 if "TimeUS" in gps else gps["TimeMS"] * 1e-3
+        fix = gps["Status"] >= 3 if "Status" in gps else numpy.ones(len(time), dtype=bool)
+        reduction.add_positions(time[fix], gps["Lat"][fix], gps["Lng"][fix], gps["Alt"][fix])
+        week = gps.get("GWk", gps.get("Week"))
+        fixed_week = numpy.flatnonzero(fix & (week > 0)) if week is not None else []
+        if len(fixed_week):
+            start_time = _gps_time(week[fixed_week[0]], gps["GMS"][fixed_week[0]] if "GMS" in gps else gps["TimeMS"][fixed_week[0]])
+
+    battery = _dataflash_fields(data, offsets, types, formats, "BAT") or _dataflash_fields(data, offsets, types, formats, "CURR")
+    if "Volt" in battery:
+        reduction.add_voltages(battery["Volt"])
+
+    return reduction.summary(file_path, start_time)
+
+
+ULOG_MAGIC = b"ULog\x01\x12\x35"
+ULOG_HEADER_SIZE = 16
+ULOG_MESSAGE_HEADER = struct.Struct("<HB")
+ULOG_TYPES = {
+    "int8_t": "i1", "uint8_t": "u1", "int16_t": "<i2", "uint16_t": "<u2", "int32_t": "<i4", "uint32_t": "<u4",
+    "int64_t": "<i8", "uint64_t": "<u8", "float": "<f4", "double": "<f8", "bool": "u1", "char": "S1",
+}
+# Topics read from a ULog, with the position fields and their scale to degrees and meters.
+ULOG_POSITION_TOPICS = [
+    ("vehicle_global_position", "lat", "lon", "alt", 1, 1),
+    ("sensor_gps", "latitude_deg", "longitude_deg", "altitude_msl_m", 1, 1),
+    ("vehicle_gps_position", "lat", "lon", "alt", 1e-7, 1e-3),
+]
+ULOG_GPS_TOPICS = ["sensor_gps", "vehicle_gps_position"]
+ULOG_BATTERY_TOPIC = "battery_status"
+
+
+def _ulog_dtype(formats: dict[str, list[tuple[str, str]]], name: str, top_level: bool=True) -> numpy.dtype:
+    """Builds the packed dtype of a ULog message format, including nested formats."""
+    fields = list(formats[name])
+    if top_level:
+        # Padding at the end of a top level message is not written to the log.
+        while fields and fields[-1][1].startswith("_padding"):
+            fields.pop()
+
+    names, dtypes = [], []
+    for type_name, field_name in fields:
+        count = 1
+        if type_name.endswith("]"):
+            type_name, count = type_name[:-1].split("[")
+            count = int(count)
+        base = numpy.dtype(ULOG_TYPES[type_name]) if type_name in ULOG_TYPES else _ulog_dtype(formats, type_name, top_level=False)
+        names.append(field_name)
+        dtypes.append((base, (count,)) if count > 1 else base)
+    return numpy.dtype({"names": names, "formats": dtypes})
+
+
+def _ulog_messages(data: numpy.ndarray) -> tuple[dict, dict, dict]:
+    """Walks the message headers of a ULog.
+
+    ULog messages are length prefixed without sync bytes, so headers are read in order,
+    but only the offsets of data messages are kept and their payloads are copied out per topic afterwards.
+
+    Returns:
+        tuple[dict, dict, dict]: The message formats by name, the subscribed topics by message id and the data offsets by message id.
+    """
+    if bytes(data[:len(ULOG_MAGIC)]) != ULOG_MAGIC:
+        raise TelemetryLogError("Not a ULog file.")
+
+    formats = {} # type: dict[str, list[tuple[str, str]]]
+    subscriptions = {} # type: dict[int, tuple[str, int]]
+    offsets = {} # type: dict[int, list[int]]
+    size = len(data)
+    offset = ULOG_HEADER_SIZE
+    while offset + ULOG_MESSAGE_HEADER.size <= size:
+        message_size, message_type = ULOG_MESSAGE_HEADER.unpack_from(data, offset)
+        payload = offset + ULOG_MESSAGE_HEADER.size
+        offset = payload + message_size
+        if offset > size: break
+
+        if message_type == 0x44: # D: logged data
+            msg_id = int(data[payload]) | int(data[payload + 1]) << 8
+            offsets.setdefault(msg_id, []).append(payload + 2)
+        elif message_type == 0x46: # F: message format
+            name, fields = bytes(data[payload:offset]).decode("ascii", "ignore").split(":", 1)
+            formats[name] = [tuple(field.split(" ", 1)) for field in fields.split(";") if field]
+        elif message_type == 0x41: # A: topic subscription
+            multi_id, msg_id = struct.unpack_from("<BH", data, payload)
+            subscriptions[msg_id] = (bytes(data[payload + 3:offset]).decode("ascii", "ignore"), multi_id)
+
+    return formats, subscriptions, {msg_id: numpy.array(values, dtype=numpy.int64) for msg_id, values in offsets.items()}
+
+
+def _ulog_topic(data: numpy.ndarray, formats: dict, subscriptions: dict, offsets: dict, topic: str) -> numpy.ndarray:
+    """Returns the first instance of a logged topic as a structured array, or None if it was not logged."""
+    for msg_id, (name, multi_id) in subscriptions.items():
+        if name != topic or multi_id != 0 or msg_id not in offsets or topic not in formats: continue
+        return _gather(data, offsets[msg_id], _ulog_dtype(formats, topic))
+    return None
+
+
+def read_ulog(file_path: str) -> TelemetrySummary:
+    """Reduces a PX4 ULog (.ulg) log."""
+    data = _map_file(file_path)
+    formats, subscriptions, offsets = _ulog_messages(data)
+
+    reduction = TelemetryReduction()
+    for topic, latitude, longitude, altitude, degrees, meters in ULOG_POSITION_TOPICS:
+        records = _ulog_topic(data, formats, subscriptions, offsets, topic)
+        if records is None or latitude not in records.dtype.names: continue
+        reduction.add_positions(records["timestamp"] * 1e-6, records[latitude] * degrees, records[longitude] * degrees, records[altitude] * meters)
+        break
+
+    start_time = None
+    for topic in ULOG_GPS_TOPICS:
+        records = _ulog_topic(data, formats, subscriptions, offsets, topic)
+        if records is None or "time_utc_usec" not in records.dtype.names: continue
+        utc = records["time_utc_usec"][records["time_utc_usec"] > 0]
+        if len(utc):
+            start_time = datetime.datetime.fromtimestamp(int(utc[0]) / 1e6)
+        break
+
+    battery = _ulog_topic(data, formats, subscriptions, offsets, ULOG_BATTERY_TOPIC)
+    if battery is not None and "voltage_v" in battery.dtype.names:
+        reduction.add_voltages(battery["voltage_v"].astype(float))
+
+    return reduction.summary(file_path, start_time)
+
+
+LOG_READERS = {
+    ".csv": read_csv,
+    ".bin": read_dataflash,
+    ".ulg": read_ulog,
+}
+
+
+def summarize_file(file_path: str) -> TelemetrySummary:
+    """Computes the flight statistics of a telemetry log.
+        If the log has no absolute time, the file's modification time is used as the start of the flight.
+
+    Raises:
+        MissingRequiredSoftwareError: If numpy is not installed.
+        TelemetryLogError: If the log is not a supported format or has no GPS positions.
+    """
+    _check_numpy()
+    reader = LOG_READERS.get(os.path.splitext(file_path)[1].lower())
+    if reader is None:
+        raise TelemetryLogError(f"Unsupported telemetry log format {file_path}.")
+
+    summary = reader(file_path)
+    if summary.start_time is None:
+        summary.start_time = datetime.datetime.fromtimestamp(os.path.getmtime(file_path))
+    return summary
+
+
+def _summarize_file_or_error(file_path: str) -> TelemetrySummary:
+    try:
+        return summarize_file(file_path)
+    except (TelemetryLogError, OSError, ValueError) as error:
+        return TelemetrySummary(file_path=file_path, error=str(error))
+
+
+def summarize_directory(folder_path: str, workers: int=None) -> list[TelemetrySummary]:
+    """Computes the flight statistics of every telemetry log in a folder, spread across worker processes.
+        Logs that can not be read are returned with their error set.
+
+    Args:
+        folder_path (str): The folder holding the logs.
+        workers (int, Optional): The number of worker processes. Defaults to the number of processors.
+    """
+    _check_numpy()
+    file_paths = [os.path.join(folder_path, name) for name in sorted(os.listdir(folder_path))
+                  if os.path.splitext(name)[1].lower() in LOG_READERS]
+    if len(file_paths) <= 1 or workers == 1:
+        return [_summarize_file_or_error(file_path) for file_path in file_paths]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_summarize_file_or_error, file_paths, chunksize=4))
+
+
+def ingest_summaries(summaries: list[TelemetrySummary], drone: Drone, type_: FlightType, match_window: datetime.timedelta=MATCH_WINDOW) -> TelemetryIngestResult:
+    """Creates or updates the flights of a drone from telemetry summaries in bulk.
+        A summary completes the drone's flight closest to its start time within the match window, otherwise a completed flight is created.
+        Measurements a log does not hold, like the location of a log without GPS, leave the matched flight's values as they are.
+
+    Args:
+        summaries (list[TelemetrySummary]): The summaries to ingest. Summaries with an error are returned as failed.
+        drone (Drone): The drone that flew the logs.
+        type_ (FlightType): The type of the flights created.
+        match_window (datetime.timedelta, Optional): Defaults to MATCH_WINDOW.
+    """
+    result = TelemetryIngestResult(failed=[summary for summary in summaries if summary.error is not None])
+    summaries = sorted((summary for summary in summaries if summary.error is None), key=lambda summary: summary.start_time)
+    if not summaries: return result
+
+    existing = global_session.query(Flight.date, Flight.id)\
+        .filter(Flight.drone_id == drone.id)\
+        .filter(Flight.date.between(summaries[0].start_time - match_window, summaries[-1].start_time + match_window))\
+        .order_by(Flight.date)\
+        .all()
+    dates = [date for date, _ in existing]
+    matched = set() # type: set[int]
+    uuids = None # type: set[str]
+    updates, inserts = [], []
+
+    for summary in summaries:
+        values = {
+            "duration": summary.duration,
+            "distance_traveled": summary.distance_traveled,
+            "max_agl_altitude": summary.max_agl_altitude,
+            "location_latitude": summary.takeoff_latitude,
+            "location_longitude": summary.takeoff_longitude,
+            "min_battery_voltage": summary.min_battery_voltage,
+            "status_id": FlightStatus.Completed.id,
+        }
+        values = {name: value for name, value in values.items() if value is not None}
+        if "location_latitude" in values and "location_longitude" in values:
+            values["geohash"] = geo.encode_or_none(summary.takeoff_latitude, summary.takeoff_longitude)
+
+        index = bisect.bisect_left(dates, summary.start_time)
+        nearby = [i for i in (index - 1, index) if 0 <= i < len(existing) and existing[i][1] not in matched
+                  and abs(existing[i][0] - summary.start_time) <= match_window]
+        if nearby:
+            nearest = min(nearby, key=lambda i: abs(existing[i][0] - summary.start_time))
+            flight_id = existing[nearest][1]
+            matched.add(flight_id)
+            updates.append(dict(values, id=flight_id))
+            continue
+
+        if uuids is None:
+            uuids = {uuid for uuid, in global_session.query(Flight.uuid)}
+        inserts.append(dict(
+            values,
+            drone_id=drone.id,
+            type_id=type_.id,
+            date=summary.start_time,
+            name=f"Flight {summary.start_time}",
+            uuid=generate_unique_string(uuids),
+        ))
+
+    global_session.bulk_update_mappings(Flight, updates)
+    global_session.bulk_insert_mappings(Flight, inserts)
+
+    flight_controller = drone.flight_controller # type: FlightController
+    latest = summaries[-1]
+    if flight_controller is not None and (flight_controller.last_flight_date is None or latest.start_time > flight_controller.last_flight_date):
+        flight_controller.last_flight_date = latest.start_time
+        flight_controller.last_flight_duration = latest.duration
+    global_session.commit()
+    DroneFlightTime.rebuild([drone.id])
+    log_bulk_write([Flight])
+
+    result.created = len(inserts)
+    result.updated = len(updates)
+    return result
+
+
+def ingest_directory(folder_path: str, drone: Drone, type_: FlightType, workers: int=None) -> TelemetryIngestResult:
+    """Reads every telemetry log in a folder in parallel and creates or updates the drone's flights from them.
+
+    Raises:
+        MissingRequiredSoftwareError: If numpy is not installed.
+    """
+    return ingest_summaries(summarize_directory(folder_path, workers=workers), drone, type_)
@@ -0,0 +1,172 @@
+"""Storage of a flight's high rate telemetry samples as compressed, columnar blocks keyed by the flight's uuid."""
+from __future__ import annotations
+import io
+
+from database import global_session, Flight, FlightTelemetryBlock
+from errors import MissingRequiredSoftwareError
+
+numpy = None
+"""Imported by _check_numpy when samples are first stored or read."""
+
+
+CHANNELS = {
+    "time": "<f8",
+    "latitude": "<f8",
+    "longitude": "<f8",
+    "altitude": "<f4",
+    "speed": "<f4",
+    "voltage": "<f4",
+    "current": "<f4",
+}
+"""Channels that can be stored and their storage types. Time is in seconds from the start of the log, the rest in degrees, meters, meters per second, volts and amps."""
+BLOCK_SIZE = 10000
+"""Number of samples per full rate block."""
+OVERVIEW_SAMPLES = 2000
+"""Maximum number of samples kept in a flight's overview."""
+FULL_RATE = 0
+OVERVIEW = 1
+
+
+def _check_numpy() -> None:
+    """Imports numpy on first use, it is slow to import."""
+    global numpy
+    if numpy is not None: return
+    try:
+        import numpy
+    except ImportError:
+        raise MissingRequiredSoftwareError("Missing required python package numpy. Please install it to store telemetry samples.")
+
+
+def _pack(columns: dict[str, numpy.ndarray]) -> bytes:
+    buffer = io.BytesIO()
+    numpy.savez_compressed(buffer, **columns)
+    return buffer.getvalue()
+
+
+def _unpack(data: bytes, channels: list[str]=None) -> dict[str, numpy.ndarray]:
+    """Decompresses the requested channels of a block. The other channels are left compressed."""
+    with numpy.load(io.BytesIO(data)) as archive:
+        return {channel: archive[channel] for channel in (channels or archive.files) if channel in archive.files}
+
+
+def _downsample(columns: dict[str, numpy.ndarray], samples: int) -> dict[str, numpy.ndarray]:
+    """Reduces the columns to at most the given number of samples by averaging equal sized buckets. Each bucket keeps the time of its first sample."""
+    length = len(columns["time"])
+    if length <= samples: return columns
+
+    starts = numpy.linspace(0, length, samples + 1).astype(numpy.int64)[:-1]
+    counts = numpy.diff(numpy.append(starts, length))
+    overview = {}
+    for channel, values in columns.items():
+        if channel == "time":
+            overview[channel] = values[starts]
+        else:
+            overview[channel] = (numpy.add.reduceat(values.astype(numpy.float64), starts) / counts).astype(values.dtype)
+    return overview
+
+
+def write_samples(flight: Flight, samples: dict[str, numpy.ndarray]) -> int:
+    """Stores the telemetry samples of a flight, replacing any stored before.
+
+    Args:
+        flight (Flight): The flight the samples belong to.
+        samples (dict[str, numpy.ndarray]): Arrays of equal length by channel name. Must include time, any other channel of CHANNELS is optional.
+
+    Raises:
+        MissingRequiredSoftwareError: If numpy is not installed.
+        ValueError: If the time channel is missing, a channel is unknown or the arrays are not the same length.
+
+    Returns:
+        int: The number of blocks written.
+    """
+    _check_numpy()
+    if "time" not in samples:
+        raise ValueError("Telemetry samples must include a time channel.")
+    unknown = set(samples) - set(CHANNELS)
+    if unknown:
+        raise ValueError(f"Unknown telemetry channels {', '.join(sorted(unknown))}.")
+
+    columns = {channel: numpy.asarray(values, dtype=CHANNELS[channel]) for channel, values in samples.items()}
+    length = len(columns["time"])
+    if any(len(values) != length for values in columns.values()):
+        raise ValueError("Telemetry channels must all have the same number of samples.")
+    order = numpy.argsort(columns["time"], kind="stable")
+    columns = {channel: values[order] for channel, values in columns.items()}
+
+    delete_samples(flight, commit=False)
+    blocks = []
+    for start in range(0, length, BLOCK_SIZE):
+        blocks.append(_block(flight, FULL_RATE, {channel: values[start:start + BLOCK_SIZE] for channel, values in columns.items()}))
+    if length:
+        blocks.append(_block(flight, OVERVIEW, _downsample(columns, OVERVIEW_SAMPLES)))
+
+    global_session.bulk_insert_mappings(FlightTelemetryBlock, blocks)
+    global_session.commit()
+    return len(blocks)
+
+
+def _block(flight: Flight, level: int, columns: dict[str, numpy.ndarray]) -> dict:
+    return {
+        "flight_uuid": flight.uuid,
+        "level": level,
+        "start_time": float(columns["time"][0]),
+        "end_time": float(columns["time"][-1]),
+        "sample_count": len(columns["time"]),
+        "data": _pack(columns),
+    }
+
+
+def _read(flight: Flight, level: int, start_time: float=None, end_time: float=None, channels: list[str]=None) -> dict[str, numpy.ndarray]:
+    _check_numpy()
+    if channels is not None and "time" not in channels:
+        channels = ["time"] + list(channels)
+
+    query = global_session.query(FlightTelemetryBlock.data)\
+        .filter(FlightTelemetryBlock.flight_uuid == flight.uuid)\
+        .filter(FlightTelemetryBlock.level == level)
+    if start_time is not None:
+        query = query.filter(FlightTelemetryBlock.end_time >= start_time)
+    if end_time is not None:
+        query = query.filter(FlightTelemetryBlock.start_time <= end_time)
+    blocks = [_unpack(data, channels) for data, in query.order_by(FlightTelemetryBlock.start_time)]
+    if not blocks: return {}
+
+    columns = {channel: numpy.concatenate([block[channel] for block in blocks]) for channel in blocks[0]}
+    if start_time is None and end_time is None: return columns
+
+    time = columns["time"]
+    first = 0 if start_time is None else numpy.searchsorted(time, start_time, side="left")
+    last = len(time) if end_time is None else numpy.searchsorted(time, end_time, side="right")
+    return {channel: values[first:last] for channel, values in columns.items()}
+
+
+def read_samples(flight: Flight, start_time: float=None, end_time: float=None, channels: list[str]=None) -> dict[str, numpy.ndarray]:
+    """Reads a flight's full rate samples. Only the blocks overlapping the time window are loaded.
+
+    Args:
+        flight (Flight): The flight to read.
+        start_time (float, Optional): Start of the window in seconds. Defaults to the start of the flight.
+        end_time (float, Optional): End of the window in seconds. Defaults to the end of the flight.
+        channels (list[str], Optional): Channels to read. Time is always included. Defaults to all stored channels.
+
+    Returns:
+        dict[str, numpy.ndarray]: Arrays by channel name, empty if the flight has no samples.
+    """
+    return _read(flight, FULL_RATE, start_time, end_time, channels)
+
+
+def read_overview(flight: Flight, channels: list[str]=None) -> dict[str, numpy.ndarray]:
+    """Reads a flight's downsampled samples, at most OVERVIEW_SAMPLES of them. Meant for plotting the whole flight."""
+    return _read(flight, OVERVIEW, channels=channels)
+
+
+def has_samples(flight: Flight) -> bool:
+    """Returns whether samples are stored for the flight."""
+    return global_session.query(FlightTelemetryBlock.id).filter(FlightTelemetryBlock.flight_uuid == flight.uuid).first() is not None
+
+
+def delete_samples(flight: Flight, commit: bool=True) -> None:
+    """Deletes the samples stored for a flight."""
+    global_session.query(FlightTelemetryBlock).filter(FlightTelemetryBlock.flight_uuid == flight.uuid).delete(synchronize_session=False)
+    if commit:
+        global_session.commit()
@@ -0,0 +1,44 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DRONELOGBOOK_DATABASE_URL", "sqlite://")
+
+import pytest
+
+import bulkimport
+import config
+import database
+
+
+@pytest.fixture
+def logbook(tmp_path):
+    database.configure(config.DatabaseConfig(url=f"sqlite:///{tmp_path / 'logbook.db'}"))
+    database.create_tables()
+    yield
+    database.global_session.remove()
+    database.engine.dispose()
+
+
+def battery_row(serial_number: str) -> dict:
+    return {"serial_number": serial_number, "name": f"Battery {serial_number}", "chemistry": "Li-Po", "capacity": "3000", "cell_count": "4"}
+
+
+def test_failed_batch_releases_its_serial_numbers(logbook):
+    def rows():
+        yield battery_row("B1")
+        # Another workstation adds B2 after the importer loaded the serial numbers, so the first batch fails on the unique constraint.
+        with database.engine.begin() as connection:
+            connection.execute(database.Battery.__table__.insert(), {"serial_number": "B2", "name": "Battery B2", "capacity": 3000, "cell_count": 4})
+        yield battery_row("B2")
+        # Rolled back with the first batch, so free to import again.
+        yield battery_row("B1")
+        yield battery_row("B3")
+
+    result = bulkimport.import_rows(rows(), bulkimport.ImportSpec("battery"), batch_size=2)
+
+    assert result.imported == 2
+    assert [rejected.row_number for rejected in result.rejected] == [2, 3]
+    assert all(rejected.reason.startswith("Batch failed") for rejected in result.rejected)
+    serial_numbers = {serial_number for serial_number, in database.global_session.query(database.Battery.serial_number)}
+    assert serial_numbers == {"B1", "B2", "B3"}
@@ -0,0 +1,564 @@
+"""Automatic flight weather from a pluggable source of station observations, cached per station and hour."""
+from __future__ import annotations
+import bisect
+import datetime
+import json
+import logging
+import math
+import os
+import queue
+import re
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from database import global_session, Flight, Weather
+from errors import WeatherSourceError
+import bulkimport
+import config
+import events
+import geo
+
+
+MAX_STATION_DISTANCE = 50000
+"""Flights further than this many meters from every station get no weather."""
+MAX_OBSERVATION_AGE = datetime.timedelta(minutes=90)
+"""Observations further than this from a flight's hour are not used."""
+STATION_CACHE_PRECISION = 6
+"""Geohash precision the nearest station is cached at. A 6 character cell is about 1.2 by 0.6 kilometers."""
+BACKFILL_WORKERS = 4
+"""Maximum number of observation lookups a backfill runs at once."""
+KNOTS = 0.514444
+"""Meters per second in a knot."""
+INCHES_OF_MERCURY = 33.8639
+"""Hectopascals in an inch of mercury."""
+FILL_FIELDS = frozenset({"location_latitude", "location_longitude", "status_id"})
+"""Flight columns whose change queues the flight for fill_new_flight: it was located, or started or ended."""
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Station:
+    id: str
+    latitude: float
+    longitude: float
+    name: str = None
+
+
+@dataclass
+class Observation:
+    """Weather observed at a station. Measurements the station did not report are None."""
+    station_id: str
+    time: datetime.datetime
+    temperature: float = None
+    """Degrees Celsius."""
+    humidity: float = None
+    """Relative humidity in percent."""
+    pressure: float = None
+    """Hectopascals."""
+    wind_speed: float = None
+    """Meters per second."""
+    wind_direction: float = None
+    """Degrees, None for variable wind."""
+    visibility: float = None
+    """Meters."""
+    cloud_cover: float = None
+    """Percent."""
+
+    def to_weather(self, flight_id: int) -> dict:
+        """Returns the Weather column values of the observation. Measurements the station did not report are stored as 0."""
+        values = {name: getattr(self, name) or 0.00 for name in ("temperature", "humidity", "pressure", "wind_speed", "wind_direction", "visibility", "cloud_cover")}
+        return dict(values, flight_id=flight_id, date=self.time, notes=f"Observed at {self.station_id} {self.time:%Y-%m-%d %H:%M}.")
+
+
+def _local_time(utc: datetime.datetime) -> datetime.datetime:
+    """Converts a UTC time, naive or not, to the naive local time flights are dated in."""
+    if utc.tzinfo is None:
+        utc = utc.replace(tzinfo=datetime.timezone.utc)
+    return utc.astimezone().replace(tzinfo=None)
+
+
+class WeatherSource:
+    """A source of station observations. Subclasses list the stations and look up observations by station and time."""
+
+    def stations(self) -> list[Station]:
+        raise NotImplementedError
+
+    def observations(self, station_id: str, start: datetime.datetime, end: datetime.datetime) -> list[Observation]:
+        """Returns the observations of a station between two times, oldest first."""
+        raise NotImplementedError
+
+
+class ArchiveSource(WeatherSource):
+    """A source read from archive files in a folder. The files are read once, on first use, by whichever thread uses it first."""
+
+    def __init__(self, folder_path: str):
+        self.folder_path = folder_path
+        self._stations = None # type: list[Station]
+        self._observations = {} # type: dict[str, list[Observation]]
+        self._times = {} # type: dict[str, list[datetime.datetime]]
+        self._lock = threading.Lock()
+
+    def _files(self, extension: str) -> list[str]:
+        if not os.path.isdir(self.folder_path):
+            raise WeatherSourceError(f"Weather archive folder {self.folder_path} does not exist.")
+        return sorted(os.path.join(self.folder_path, file_name) for file_name in os.listdir(self.folder_path) if file_name.lower().endswith(extension))
+
+    def _read(self) -> tuple[list[Station], list[Observation]]:
+        raise NotImplementedError
+
+    def _load(self) -> None:
+        if self._stations is not None: return
+        with self._lock:
+            if self._stations is not None: return
+            stations, observations = self._read()
+            for observation in sorted(observations, key=lambda observation: observation.time):
+                self._observations.setdefault(observation.station_id, []).append(observation)
+                self._times.setdefault(observation.station_id, []).append(observation.time)
+            # Set last: the other threads read the observations without the lock once the stations are set.
+            self._stations = stations
+
+    def stations(self) -> list[Station]:
+        self._load()
+        return self._stations
+
+    def observations(self, station_id: str, start: datetime.datetime, end: datetime.datetime) -> list[Observation]:
+        self._load()
+        times = self._times.get(station_id, [])
+        return self._observations.get(station_id, [])[bisect.bisect_left(times, start):bisect.bisect_right(times, end)]
+
+
+class CsvArchiveSource(ArchiveSource):
+    """Observations from the CSV files of a folder. Each row holds a station, latitude, longitude, time and any of the Observation measurements by name."""
+
+    def _read(self) -> tuple[list[Station], list[Observation]]:
+        stations, observations = {}, []
+        for file_path in self._files(".csv"):
+            for row in bulkimport.read_rows(file_path):
+                try:
+                    station_id = row["station"].strip()
+                    if station_id not in stations:
+                        stations[station_id] = Station(station_id, float(row["latitude"]), float(row["longitude"]), row.get("name"))
+                    measurements = {name: float(row[name]) for name in ("temperature", "humidity", "pressure", "wind_speed", "wind_direction", "visibility", "cloud_cover")
+                                    if row.get(name) not in (None, "")}
+                    observations.append(Observation(station_id, bulkimport.to_datetime(row["time"]), **measurements))
+                except (KeyError, ValueError) as error:
+                    raise WeatherSourceError(f"Invalid weather archive row in {file_path}: {error}")
+        return list(stations.values()), observations
+
+
+class MetarArchiveSource(ArchiveSource):
+    """Observations from METAR reports in the text files of a folder, with the station locations in a stations.csv file of id, latitude, longitude and name.
+        Reports are either preceded by a "YYYY/MM/DD HH:MM" line, as in the NOAA cycle files, or prefixed with a "YYYYMMDDHHMM" time.
+        Both times are UTC, like the reports', and converted to local time.
+    """
+    STATIONS_FILE_NAME = "stations.csv"
+
+    def _read(self) -> tuple[list[Station], list[Observation]]:
+        stations_path = os.path.join(self.folder_path, self.STATIONS_FILE_NAME)
+        if not os.path.isfile(stations_path):
+            raise WeatherSourceError(f"Weather archive folder {self.folder_path} has no {self.STATIONS_FILE_NAME}.")
+        stations = [Station(row["id"].strip(), float(row["latitude"]), float(row["longitude"]), row.get("name")) for row in bulkimport.read_rows(stations_path)]
+
+        observations = []
+        for file_path in self._files(".txt"):
+            with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+                time = None
+                for line in f:
+                    line = line.strip()
+                    if not line: continue
+                    match = re.fullmatch(r"(\d{4})/(\d{2})/(\d{2}) (\d{2}):(\d{2})", line)
+                    if match:
+                        time = _local_time(datetime.datetime(*map(int, match.groups())))
+                        continue
+                    match = re.match(r"(\d{12})\s+(.*)", line)
+                    if match:
+                        time, line = _local_time(datetime.datetime.strptime(match.group(1), "%Y%m%d%H%M")), match.group(2)
+                    if time is None: continue
+                    observation = decode_metar(line, time)
+                    if observation is not None:
+                        observations.append(observation)
+        return stations, observations
+
+
+def _visibility(tokens: list[str], index: int) -> tuple[float, int]:
+    """Decodes a visibility in statute miles, like 10SM, 1/2SM or 1 1/2SM, into meters. Returns the visibility and the number of tokens used."""
+    token = tokens[index]
+    if not token.endswith("SM"):
+        if index + 1 < len(tokens) and token.isdigit() and re.fullmatch(r"\d/\d+SM", tokens[index + 1]):
+            miles, used = float(token), 2
+            token = tokens[index + 1]
+        else:
+            return None, 0
+    else:
+        miles, used = 0.00, 1
+    value = token[:-2].lstrip("PM")
+    if "/" in value:
+        numerator, denominator = value.split("/")
+        miles += float(numerator) / float(denominator)
+    else:
+        miles += float(value)
+    return round(miles * 1609.344), used
+
+
+CLOUD_COVER = {"SKC": 0, "CLR": 0, "NSC": 0, "NCD": 0, "FEW": 25, "SCT": 50, "BKN": 75, "OVC": 100, "VV": 100}
+"""Cloud cover in percent by METAR sky condition."""
+
+
+def decode_metar(text: str, time: datetime.datetime) -> Observation:
+    """Decodes a METAR report into an observation, None if it is not a METAR report.
+
+    Args:
+        text (str): The report, like "METAR KSEA 121853Z 18010KT 10SM FEW030 BKN250 15/08 A3012".
+        time (datetime.datetime): The time of the report. METAR reports only hold the day and time.
+    """
+    tokens = text.rstrip("=").split()
+    while tokens and tokens[0] in ("METAR", "SPECI"):
+        tokens.pop(0)
+    if len(tokens) < 2 or not re.fullmatch(r"\d{6}Z", tokens[1]): return None
+
+    observation = Observation(tokens[0], time)
+    cloud_cover = None
+    dew_point = None
+    index = 2
+    while index < len(tokens):
+        token = tokens[index]
+        index += 1
+        if token == "RMK": break
+        wind = re.fullmatch(r"(\d{3}|VRB)(\d{2,3})(G\d{2,3})?(KT|MPS)", token)
+        if wind:
+            observation.wind_direction = None if wind.group(1) == "VRB" else float(wind.group(1))
+            observation.wind_speed = round(float(wind.group(2)) * (KNOTS if wind.group(4) == "KT" else 1), 2)
+            continue
+        if token == "CAVOK":
+            observation.visibility, cloud_cover = 10000.00, 0
+            continue
+        if re.fullmatch(r"\d{4}", token):
+            observation.visibility = 10000.00 if token == "9999" else float(token)
+            continue
+        visibility, used = _visibility(tokens, index - 1)
+        if used:
+            observation.visibility = visibility
+            index += used - 1
+            continue
+        sky = re.match(r"(SKC|CLR|NSC|NCD|FEW|SCT|BKN|OVC|VV)", token)
+        if sky:
+            cloud_cover = max(cloud_cover or 0, CLOUD_COVER[sky.group(1)])
+            continue
+        temperature = re.fullmatch(r"(M?\d{2})/(M?\d{2})?", token)
+        if temperature:
+            observation.temperature = float(temperature.group(1).replace("M", "-"))
+            if temperature.group(2):
+                dew_point = float(temperature.group(2).replace("M", "-"))
+            continue
+        pressure = re.fullmatch(r"([AQ])(\d{4})", token)
+        if pressure:
+            value = float(pressure.group(2))
+            observation.pressure = round(value / 100 * INCHES_OF_MERCURY, 1) if pressure.group(1) == "A" else value
+
+    observation.cloud_cover = cloud_cover
+    if observation.temperature is not None and dew_point is not None:
+        # Magnus approximation of the relative humidity from the temperature and dew point.
+        humidity = math.exp(17.625 * dew_point / (243.04 + dew_point)) / math.exp(17.625 * observation.temperature / (243.04 + observation.temperature))
+        observation.humidity = round(min(humidity, 1.00) * 100, 1)
+    return observation
+
+
+class ServiceSource(WeatherSource):
+    """Observations from a weather service answering GET {url}/stations and GET {url}/observations?station=&start=&end= with JSON lists.
+        Stations have an id, latitude, longitude and name, observations a station, an ISO time and the Observation measurements by name.
+    """
+
+    def __init__(self, url: str, timeout: float=10.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._stations = None # type: list[Station]
+        self._lock = threading.Lock()
+
+    def _get(self, path: str, **parameters) -> list[dict]:
+        url = f"{self.url}/{path}"
+        if parameters:
+            url += "?" + urllib.parse.urlencode(parameters)
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                return json.load(response)
+        except (urllib.error.URLError, OSError, ValueError) as error:
+            raise WeatherSourceError(f"Weather service request {url} failed: {error}")
+
+    def stations(self) -> list[Station]:
+        with self._lock:
+            if self._stations is None:
+                items = self._get("stations")
+                try:
+                    self._stations = [Station(str(item["id"]), float(item["latitude"]), float(item["longitude"]), item.get("name")) for item in items]
+                except (KeyError, TypeError, ValueError, AttributeError) as error:
+                    raise WeatherSourceError(f"Invalid station list from weather service {self.url}: {error!r}")
+            return self._stations
+
+    def observations(self, station_id: str, start: datetime.datetime, end: datetime.datetime) -> list[Observation]:
+        items = self._get("observations", station=station_id, start=start.isoformat(), end=end.isoformat())
+        fields = set(Observation.__dataclass_fields__) - {"station_id", "time"}
+        try:
+            return sorted((Observation(station_id, self._time(item["time"]), **{name: item.get(name) for name in fields}) for item in items),
+                          key=lambda observation: observation.time)
+        except (KeyError, TypeError, ValueError, AttributeError) as error:
+            raise WeatherSourceError(f"Invalid observations of station {station_id} from weather service {self.url}: {error!r}")
+
+    @staticmethod
+    def _time(iso_time: str) -> datetime.datetime:
+        """Parses an observation time. Times with an offset are converted to local time, the others are local already."""
+        time = datetime.datetime.fromisoformat(iso_time)
+        return _local_time(time) if time.tzinfo is not None else time
+
+
+SOURCES = {
+    "csv": CsvArchiveSource,
+    "metar": MetarArchiveSource,
+    "service": ServiceSource,
+}
+"""Weather sources by name. Each is created from a folder path, or the url of the service."""
+
+
+def open_source(name: str, location: str) -> WeatherSource:
+    """Creates a weather source by name.
+
+    Raises:
+        WeatherSourceError: If the source is unknown.
+    """
+    if name not in SOURCES:
+        raise WeatherSourceError(f"Unknown weather source {name}.")
+    return SOURCES[name](location)
+
+
+def open_archive(folder_path: str) -> WeatherSource:
+    """Creates the archive source of a folder, METAR if it holds a stations file and CSV otherwise."""
+    if os.path.isfile(os.path.join(folder_path, MetarArchiveSource.STATIONS_FILE_NAME)):
+        return MetarArchiveSource(folder_path)
+    return CsvArchiveSource(folder_path)
+
+
+def _hour(time: datetime.datetime) -> datetime.datetime:
+    """Rounds a time to the nearest hour."""
+    return (time + datetime.timedelta(minutes=30)).replace(minute=0, second=0, microsecond=0)
+
+
+class WeatherProvider:
+    """Finds the observation nearest in time at the station nearest to a flight.
+        The nearest station is cached per geohash cell and observations per station and hour, so flights close in place and time share one lookup.
+        The caches are shared by the threads filling flights. The source is read outside their lock, so two threads may look up the same key.
+    """
+
+    def __init__(self, source: WeatherSource, max_station_distance: float=MAX_STATION_DISTANCE):
+        self.source = source
+        self.max_station_distance = max_station_distance
+        self._nearest_stations = {} # type: dict[str, Station]
+        self._observations = {} # type: dict[tuple[str, datetime.datetime], Observation]
+        self._lock = threading.Lock()
+
+    def nearest_station(self, latitude: float, longitude: float) -> Station:
+        """Returns the station nearest to a coordinate, None if every station is further than the max station distance."""
+        cell = geo.encode(latitude, longitude, STATION_CACHE_PRECISION)
+        with self._lock:
+            if cell in self._nearest_stations:
+                return self._nearest_stations[cell]
+        distances = [(geo.distance(latitude, longitude, station.latitude, station.longitude), station) for station in self.source.stations()]
+        distance, station = min(distances, key=lambda item: item[0], default=(None, None))
+        station = station if distance is not None and distance <= self.max_station_distance else None
+        with self._lock:
+            return self._nearest_stations.setdefault(cell, station)
+
+    def _fetch(self, station_id: str, hour: datetime.datetime) -> Observation:
+        observations = self.source.observations(station_id, hour - MAX_OBSERVATION_AGE, hour + MAX_OBSERVATION_AGE)
+        return min(observations, key=lambda observation: abs(observation.time - hour), default=None)
+
+    def observation(self, station_id: str, time: datetime.datetime) -> Observation:
+        """Returns a station's observation nearest to the hour of a time, None if there is none within the max observation age."""
+        key = (station_id, _hour(time))
+        with self._lock:
+            if key in self._observations:
+                return self._observations[key]
+        observation = self._fetch(*key)
+        with self._lock:
+            return self._observations.setdefault(key, observation)
+
+    def observation_for(self, latitude: float, longitude: float, time: datetime.datetime) -> Observation:
+        station = self.nearest_station(latitude, longitude)
+        if station is None: return None
+        return self.observation(station.id, time)
+
+    def prefetch(self, keys: set[tuple[str, datetime.datetime]], workers: int=BACKFILL_WORKERS) -> None:
+        """Looks up the observations of many (station id, hour) at once, at most workers at a time."""
+        with self._lock:
+            missing = [key for key in keys if key not in self._observations]
+        if not missing: return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            observations = list(executor.map(lambda key: self._fetch(*key), missing))
+        with self._lock:
+            for key, observation in zip(missing, observations):
+                self._observations.setdefault(key, observation)
+
+
+_provider_lock = threading.Lock()
+_provider = None # type: WeatherProvider
+_provider_loaded = False
+
+
+def configured_provider() -> WeatherProvider:
+    """Returns the provider of the source set in the [weather] section of the config, None if there is none. Created once, so its caches last.
+
+    Raises:
+        WeatherSourceError: If the source is unknown.
+    """
+    global _provider, _provider_loaded
+    with _provider_lock:
+        if not _provider_loaded:
+            weather_config = config.load_weather_config()
+            if weather_config.source:
+                _provider = WeatherProvider(open_source(weather_config.source, weather_config.location))
+            _provider_loaded = True
+        return _provider
+
+
+def _has_location(latitude: float, longitude: float) -> bool:
+    return latitude is not None and longitude is not None and -90 <= latitude <= 90 and -180 <= longitude <= 180
+
+
+def fill_flight(flight: Flight, provider: WeatherProvider) -> Weather:
+    """Sets a flight's weather from the observation nearest to its time and location, replacing any set before.
+
+    Raises:
+        WeatherSourceError: If the source can not be read.
+
+    Returns:
+        Weather: The flight's weather, None if the flight has no valid location or no observation was found.
+    """
+    if not _has_location(flight.location_latitude, flight.location_longitude) or flight.date is None: return None
+    observation = provider.observation_for(flight.location_latitude, flight.location_longitude, flight.date)
+    if observation is None: return None
+
+    values = observation.to_weather(flight.id)
+    if flight.weather is None:
+        flight.set_weather(Weather(**values))
+    else:
+        for name, value in values.items():
+            setattr(flight.weather, name, value)
+        flight.weather.date_modified = flight.date_modified = datetime.datetime.now()
+        global_session.commit()
+    return flight.weather
+
+
+def fill_new_flight(flight: Flight) -> Weather:
+    """Sets the weather of a flight that has none from the configured source, if there is one.
+        Weather already set, by hand or by an earlier fill, is kept. A source that fails is logged, the flight does without weather.
+
+    Returns:
+        Weather: The weather set, None if none was.
+    """
+    if flight.weather is not None or not _has_location(flight.location_latitude, flight.location_longitude): return None
+    try:
+        provider = configured_provider()
+        if provider is None: return None
+        return fill_flight(flight, provider)
+    except WeatherSourceError:
+        logger.exception("Could not fill the weather of flight %s", flight.id)
+        return None
+
+
+_fill_queue = queue.Queue() # type: queue.Queue[int]
+_fill_thread = None # type: threading.Thread
+
+
+def _queue_fills(changes: list[events.ChangeEvent]) -> None:
+    for change in changes:
+        if not change.remote and (change.operation == events.INSERT or change.fields & FILL_FIELDS):
+            _fill_queue.put(change.id)
+
+
+def _fill_queued() -> None:
+    while True:
+        flight_id = _fill_queue.get()
+        try:
+            flight = global_session.get(Flight, flight_id)
+            if flight is not None:
+                fill_new_flight(flight)
+        except Exception:
+            logger.exception("Could not fill the weather of flight %s", flight_id)
+        finally:
+            global_session.remove()
+            _fill_queue.task_done()
+
+
+def start_filling() -> bool:
+    """Fills the weather of the flights this process adds, locates, starts or ends, once their writes commit, with fill_new_flight on a
+        background thread. The writes do not wait for the source. Does nothing if the config sets no weather source.
+
+    Raises:
+        WeatherSourceError: If the source is unknown.
+
+    Returns:
+        bool: Whether flights are filled.
+    """
+    global _fill_thread
+    if configured_provider() is None: return False
+    with _provider_lock:
+        if _fill_thread is None:
+            _fill_thread = threading.Thread(target=_fill_queued, name="weather-fill", daemon=True)
+            _fill_thread.start()
+            events.subscribe("flight", _queue_fills)
+    return True
+
+
+@dataclass
+class WeatherBackfillResult:
+    filled: int = 0
+    no_location: int = 0
+    """Flights without a location or date."""
+    no_observation: int = 0
+    """Flights with no station nearby or no observation near their time."""
+
+
+def backfill(provider: WeatherProvider, workers: int=BACKFILL_WORKERS, batch_size: int=bulkimport.BATCH_SIZE) -> WeatherBackfillResult:
+    """Attaches weather to every flight without any, one transaction per batch of flights.
+        The observations a batch needs are looked up once per station and hour, at most workers at a time.
+
+    Raises:
+        WeatherSourceError: If the source can not be read.
+    """
+    result = WeatherBackfillResult()
+    flights = global_session.query(Flight.id, Flight.date, Flight.location_latitude, Flight.location_longitude)\
+        .outerjoin(Weather, Weather.flight_id == Flight.id)\
+        .filter(Weather.id == None)\
+        .order_by(Flight.id)\
+        .all()
+
+    for start in range(0, len(flights), batch_size):
+        keys = {} # type: dict[int, tuple[str, datetime.datetime]]
+        for flight_id, date, latitude, longitude in flights[start:start + batch_size]:
+            if date is None or not _has_location(latitude, longitude):
+                result.no_location += 1
+                continue
+            station = provider.nearest_station(latitude, longitude)
+            if station is None:
+                result.no_observation += 1
+                continue
+            keys[flight_id] = (station.id, _hour(date))
+
+        provider.prefetch(set(keys.values()), workers=workers)
+        weather = []
+        for flight_id, key in keys.items():
+            observation = provider.observation(*key)
+            if observation is None:
+                result.no_observation += 1
+                continue
+            weather.append(observation.to_weather(flight_id))
+        global_session.bulk_insert_mappings(Weather, weather)
+        # The flights' rows in the exports hold their weather.
+        global_session.query(Flight).filter(Flight.id.in_([values["flight_id"] for values in weather]))\
+            .update({Flight.date_modified: datetime.datetime.now()}, synchronize_session=False)
+        global_session.commit()
+        result.filled += len(weather)
+    return result
@@ -0,0 +1,107 @@
+"""Takeoff weight and payload margin of flights, computed for many flights at once with one joined query."""
+from __future__ import annotations
+import csv
+from dataclasses import dataclass
+
+from sqlalchemy import func
+
+from database import global_session, Battery, Drone, Equipment, EquipmentGroup, EquipmentToFlight, EquipmentType, Flight
+
+
+CHUNK_SIZE = 1000
+"""Number of flight ids per query when computing the weights of a list of flights."""
+
+
+@dataclass
+class FlightWeight:
+    """Weights of a flight in kilograms. The payload is the flight's airborne equipment."""
+    flight_id: int
+    uuid: str
+    drone_id: int
+    drone_weight: float
+    battery_weight: float
+    payload_weight: float
+    max_payload_weight: float
+    """The drone's max payload weight. 0 if the drone has no limit set."""
+
+    @property
+    def takeoff_weight(self) -> float:
+        return round(self.drone_weight + self.battery_weight + self.payload_weight, 4)
+
+    @property
+    def payload_margin(self) -> float:
+        """Returns the payload weight left before the drone's max payload weight, negative if overweight. None if the drone has no limit set."""
+        if not self.max_payload_weight: return None
+        return round(self.max_payload_weight - self.payload_weight, 4)
+
+    @property
+    def overweight(self) -> bool:
+        return self.payload_margin is not None and self.payload_margin < 0
+
+
+def _query():
+    payload = global_session.query(EquipmentToFlight.flight_id, func.sum(Equipment.weight).label("weight"))\
+        .join(Equipment, EquipmentToFlight.equipment_id == Equipment.id)\
+        .join(EquipmentType, Equipment.type_id == EquipmentType.id)\
+        .filter(EquipmentType.group == EquipmentGroup.Airborne_Equipment.value)\
+        .group_by(EquipmentToFlight.flight_id)\
+        .subquery()
+    return global_session.query(Flight.id, Flight.uuid, Flight.drone_id, func.coalesce(Drone.weight, 0), func.coalesce(Battery.weight, 0),
+                                func.coalesce(payload.c.weight, 0), func.coalesce(Drone.max_payload_weight, 0))\
+        .join(Drone, Flight.drone_id == Drone.id)\
+        .outerjoin(Battery, Flight.battery_id == Battery.id)\
+        .outerjoin(payload, payload.c.flight_id == Flight.id)
+
+
+def compute(flight_ids: list[int]=None, active_only: bool=False) -> dict[int, FlightWeight]:
+    """Computes the weights of flights by flight id.
+
+    Args:
+        flight_ids (list[int], Optional): The flights to compute. Defaults to every flight.
+        active_only (bool, Optional): Only compute active flights. Defaults to False.
+    """
+    query = _query()
+    if active_only:
+        query = query.filter(Flight.active == True)
+    if flight_ids is None:
+        return {row[0]: FlightWeight(*row) for row in query}
+
+    flight_ids = list(flight_ids)
+    weights = {}
+    for start in range(0, len(flight_ids), CHUNK_SIZE):
+        weights.update({row[0]: FlightWeight(*row) for row in query.filter(Flight.id.in_(flight_ids[start:start + CHUNK_SIZE]))})
+    return weights
+
+
+def flight_weight(flight: Flight) -> FlightWeight:
+    """Computes the weights of a single flight."""
+    return compute([flight.id]).get(flight.id)
+
+
+def check_flight(flight: Flight) -> list[str]:
+    """Returns why a flight is too heavy to start, or an empty list if its payload is within the drone's limit."""
+    weight = flight_weight(flight)
+    if weight is None or not weight.overweight: return []
+    return [f"Payload of {weight.payload_weight} kg is over the drone's max payload weight of {weight.max_payload_weight} kg."]
+
+
+def audit(overweight_only: bool=True) -> list[FlightWeight]:
+    """Computes the weights of every historical flight in a single pass, most overweight first.
+
+    Args:
+        overweight_only (bool, Optional): Only return overweight flights. Defaults to True.
+    """
+    weights = [FlightWeight(*row) for row in _query().yield_per(CHUNK_SIZE)]
+    if overweight_only:
+        weights = [weight for weight in weights if weight.overweight]
+    return sorted(weights, key=lambda weight: weight.payload_margin if weight.payload_margin is not None else float("inf"))
+
+
+def write_audit_csv(weights: list[FlightWeight], file_path: str) -> None:
+    """Writes an audit to a CSV file, one row per flight."""
+    with open(file_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Flight", "Drone Weight", "Battery Weight", "Payload Weight", "Takeoff Weight", "Max Payload Weight", "Payload Margin", "Overweight"])
+        for weight in weights:
+            writer.writerow([weight.uuid, weight.drone_weight, weight.battery_weight, weight.payload_weight, weight.takeoff_weight,
+                             weight.max_payload_weight, weight.payload_margin, weight.overweight])